@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+# ========================================================================
+#
+# Copyright © 2016 Khepry Quixote
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ========================================================================
+
+import argparse
+import os
+import subprocess
+import sys
+
+from time import time
+
+from pyquake.index import build_index
+
+pgm_name = 'GeoCoderIndex.py'
+pgm_version = '1.0'
+
+
+def time_cold_start(code):
+    # time a cold start in a fresh interpreter,
+    # the child reporting its own elapsed seconds
+    timed_code = 'from time import time\nbgn_time = time()\n%s\nprint(time() - bgn_time)\n' % code
+    output = subprocess.check_output([sys.executable, '-c', timed_code], cwd=os.path.dirname(os.path.abspath(__file__)))
+    return float(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(prog='%s' % pgm_name, description='Build a memory-mapped reverse-geocoding index.')
+
+    arg_parser.add_argument('--index-file-path', default='rg_cities1000.idx', help='index file path (default: rg_cities1000.idx)')
+    arg_parser.add_argument('--rg-file-path', default=None, help='reverse_geocoder formatted cities CSV file path (default: None, the package\'s own)')
+    arg_parser.add_argument('--build', default='Y', choices=['Y', 'N'], help='(re)build the index file (default: Y)')
+    arg_parser.add_argument('--timing-report', default='N', choices=['Y', 'N'], help='compare cold start times before/after (default: N)')
+
+    arg_parser.add_argument('--version', action='version', version='version=%s %s' % (pgm_name, pgm_version))
+
+    args = arg_parser.parse_args()
+
+    if args.index_file_path.startswith('~'):
+        args.index_file_path = os.path.expanduser(args.index_file_path)
+    args.index_file_path = os.path.abspath(args.index_file_path)
+
+    if args.build == 'Y':
+        bgn_time = time()
+        count = build_index(args.index_file_path, args.rg_file_path)
+        seconds = time() - bgn_time
+        print('Built index of {:,} locations in {:,.2f} seconds: "{}" ({:,} bytes)'.format(count, seconds, args.index_file_path,
+                                                                                          os.path.getsize(args.index_file_path)))
+
+    if args.timing_report == 'Y':
+        coordinates = '[(37.78674, -122.39222), (36.1, -97.5)]'
+        import_seconds = time_cold_start('import numpy\nimport scipy.spatial')
+        rg_seconds = time_cold_start('import reverse_geocoder as rg\nrg.search(%s, mode=1, verbose=False)' % coordinates)
+        index_seconds = time_cold_start('from pyquake.index import GeoIndex\nGeoIndex(%r).query(%s)' % (args.index_file_path, coordinates))
+        print('Cold start, numpy and scipy imports only:     {:,.3f} seconds'.format(import_seconds))
+        print('Cold start to first result, reverse_geocoder: {:,.3f} seconds'.format(rg_seconds))
+        print('Cold start to first result, geocoder index:   {:,.3f} seconds'.format(index_seconds))
+        if index_seconds > 0:
+            print('Speed-up: {:,.1f}x'.format(rg_seconds / index_seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+# ========================================================================
+#
+# Copyright © 2016 Khepry Quixote
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ========================================================================
+
+import argparse
+import csv
+import datetime
+import io
+
+from pyquake.rows import (RowTransform, default_dtg_parse_pattern, get_out_fieldnames, normalize_dict_row, parse_comcat_dtg,
+                          parse_comcat_dtgs, reformat_dtg, time_transform)
+
+pgm_name = 'GeoCoderRows.py'
+pgm_version = '1.0'
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(prog='%s' % pgm_name, description='Benchmark the per-row transform of an ANSS ComCat-formatted earthquake CSV file.')
+
+    arg_parser.add_argument('--src-file-path', required=True, help='source file path')
+    arg_parser.add_argument('--src-date-ymd-separator', default='-', help='source date year, month, day separator (default: -)')
+    arg_parser.add_argument('--out-date-ymd-separator', default='-', help='output date year, month, day separator (default: -)')
+    arg_parser.add_argument('--dtg-parse-pattern', default='%Y-%m-%d %H:%M:%S', help='Date-Time-Group Pattern (default: %%Y-%%m-%%d %%H:%%M:%%S)')
+    arg_parser.add_argument('--out-db-null-value', default=None, help='output null value (default: NULL)')
+    arg_parser.add_argument('--repeat', type=int, default=5, help='timing repetitions, the best of which is reported (default: 5)')
+
+    arg_parser.add_argument('--version', action='version', version='version=%s %s' % (pgm_name, pgm_version))
+
+    args = arg_parser.parse_args()
+
+    with io.open(args.src_file_path, 'r', newline='') as src_file:
+        src_rows = list(csv.reader(src_file))
+    src_fieldnames = src_rows.pop(0)
+    fieldnames = get_out_fieldnames(src_fieldnames)
+
+    def run_dict_transform():
+        # read, transform and write
+        # rows as dictionaries
+        out_file = io.StringIO()
+        csv_writer = csv.DictWriter(out_file, fieldnames=fieldnames)
+        for src_row in src_rows:
+            row = dict(zip(fieldnames, src_row))
+            if normalize_dict_row(row, args) is not None:
+                csv_writer.writerow(row)
+        return out_file.getvalue()
+
+    row_transform = RowTransform(fieldnames, len(src_fieldnames), args)
+
+    def run_row_transform():
+        # read, transform and write
+        # rows as positional lists
+        out_file = io.StringIO()
+        csv_writer = csv.writer(out_file)
+        for src_row in src_rows:
+            record = row_transform.get_record(list(src_row))
+            if row_transform(record) is not None:
+                csv_writer.writerow(record)
+        return out_file.getvalue()
+
+    if run_dict_transform() != run_row_transform():
+        raise SystemExit('The row transform output differs from the dictionary transform output!')
+
+    # the event DTGs alone, as reformatted
+    event_dtgs = [reformat_dtg(src_row[src_fieldnames.index('time')], args.src_date_ymd_separator, '-') for src_row in src_rows]
+
+    def run_strptime():
+        for value in event_dtgs:
+            try:
+                datetime.datetime.strptime(value, default_dtg_parse_pattern)
+            except ValueError:
+                pass
+
+    def run_parse_comcat_dtg():
+        for value in event_dtgs:
+            parse_comcat_dtg(value)
+
+    def run_parse_comcat_dtgs():
+        parse_comcat_dtgs(event_dtgs)
+
+    dict_seconds = time_transform(run_dict_transform, args.repeat)
+    row_seconds = time_transform(run_row_transform, args.repeat)
+    print('Transformed {:,} rows, best of {:,} runs:'.format(len(src_rows), args.repeat))
+    print('Dictionary rows, strptime DTGs: {:,.2f} microseconds/row'.format(dict_seconds / max(len(src_rows), 1) * 1e6))
+    print('Positional rows, parsed DTGs:   {:,.2f} microseconds/row'.format(row_seconds / max(len(src_rows), 1) * 1e6))
+    if row_seconds > 0:
+        print('Speed-up: {:,.1f}x'.format(dict_seconds / row_seconds))
+
+    print('Parsed {:,} event DTGs, best of {:,} runs:'.format(len(event_dtgs), args.repeat))
+    for label, run_parse in (('strptime:         ', run_strptime),
+                             ('parse_comcat_dtg: ', run_parse_comcat_dtg),
+                             ('parse_comcat_dtgs:', run_parse_comcat_dtgs)):
+        print('{} {:,.3f} microseconds/DTG'.format(label, time_transform(run_parse, args.repeat) / max(len(event_dtgs), 1) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+# ========================================================================
+#
+# Copyright © 2016 Khepry Quixote
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ========================================================================
+
+import argparse
+import os
+
+from pprint import pprint
+
+from pyquake.geocoder import Geocoder, engine_choices
+from pyquake.service import GeocodeServer
+
+pgm_name = 'GeoCoderService.py'
+pgm_version = '1.0'
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(prog='%s' % pgm_name,
+                                         description='Serve reverse-geocoding lookups over HTTP from a geocoder loaded once.')
+
+    arg_parser.add_argument('--host', default='127.0.0.1', help='address to listen on (default: 127.0.0.1)')
+    arg_parser.add_argument('--port', type=int, default=8080, help='port to listen on (default: 8080)')
+    arg_parser.add_argument('--batch-wait-ms', type=float, default=2.0,
+                            help='milliseconds a lookup waits for concurrent lookups to be searched with it (default: 2.0)')
+    arg_parser.add_argument('--max-batch-coordinates', type=int, default=10000, help='coordinates per batched K-D tree query (default: 10000)')
+    arg_parser.add_argument('--max-request-coordinates', type=int, default=100000, help='coordinates accepted per request (default: 100000)')
+    arg_parser.add_argument('--verbose', default='N', choices=['Y', 'N'], help='log each request (default: N)')
+
+    arg_parser.add_argument('--geocode-index-file-path', default=None, help='memory-mapped geocoder index file path, see GeoCoderIndex.py (default: None)')
+    arg_parser.add_argument('--geocode-cache', default='N', choices=['Y', 'N'], help='cache geocodes by quantized coordinates (default: N)')
+    arg_parser.add_argument('--geocode-cache-precision', type=int, default=3, help='geocode cache coordinate decimal places (default: 3)')
+    arg_parser.add_argument('--geocode-cache-size', type=int, default=100000, help='geocode cache in-memory entries (default: 100000)')
+    arg_parser.add_argument('--geocode-cache-file-path', default=None, help='geocode cache persistent SQLite file path (default: None, in-memory only)')
+    arg_parser.add_argument('--geocode-engine', default='kdtree', choices=engine_choices,
+                            help='cc, admin1 and admin2 from the nearest populated place (kdtree) or the admin polygon holding the point (polygon), '
+                                 'the name being the nearest place\'s either way (default: kdtree)')
+    arg_parser.add_argument('--admin-file-path', default=None, help='admin boundary polygons GeoJSON or shapefile path, for --geocode-engine polygon (default: None)')
+    arg_parser.add_argument('--admin-cc-field', default='cc', help='admin polygons\' cc property (default: cc)')
+    arg_parser.add_argument('--admin-admin1-field', default='admin1', help='admin polygons\' admin1 property (default: admin1)')
+    arg_parser.add_argument('--admin-admin2-field', default='admin2', help='admin polygons\' admin2 property (default: admin2)')
+
+    arg_parser.add_argument('--version', action='version', version='version=%s %s' % (pgm_name, pgm_version))
+
+    args = arg_parser.parse_args()
+
+    if args.geocode_engine == 'polygon' and args.admin_file_path is None:
+        arg_parser.error('--geocode-engine polygon requires --admin-file-path')
+
+    for arg_name in ('geocode_index_file_path', 'geocode_cache_file_path', 'admin_file_path'):
+        arg_value = getattr(args, arg_name)
+        if arg_value is not None:
+            setattr(args, arg_name, os.path.abspath(os.path.expanduser(arg_value)))
+
+    print('Command line args:')
+    pprint(vars(args))
+    print('')
+
+    # the geocoder, its K-D tree loaded
+    # before the first lookup, and any cache
+    geocoder = Geocoder.from_args(args)
+    geocoder.warm()
+
+    server = GeocodeServer((args.host, args.port), geocoder,
+                           max_batch_coordinates=args.max_batch_coordinates,
+                           batch_wait_seconds=args.batch_wait_ms / 1000.0,
+                           max_request_coordinates=args.max_request_coordinates,
+                           verbose=args.verbose == 'Y')
+    print('Serving reverse-geocoding lookups on: "http://%s:%d/reverse"' % server.server_address[:2])
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+    print(server.batcher.get_stats())
+    message = geocoder.get_message()
+    if message is not None:
+        print(message)
+    geocoder.close()
+    print('Serving finished!')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+# ========================================================================
+#
+# Copyright © 2016 Khepry Quixote
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ========================================================================
+
+import argparse
+import csv
+import io
+import random
+import threading
+
+from time import time
+
+import requests
+
+from pyquake.cache import result_keys
+
+pgm_name = 'GeoCoderServiceBench.py'
+pgm_version = '1.0'
+
+
+def get_percentile(sorted_values, percent):
+    if len(sorted_values) == 0:
+        return 0.0
+    return sorted_values[min(int(len(sorted_values) * percent / 100.0), len(sorted_values) - 1)]
+
+
+def load_lookups(args):
+    # the coordinates of the source rows, and their
+    # geocodes too when the file was output by GeoCoderRev2.py
+    with io.open(args.src_file_path, 'r', encoding='utf-8', newline='') as src_file:
+        csv_reader = csv.DictReader(src_file, delimiter=args.src_delimiter)
+        verify = all(result_key in csv_reader.fieldnames for result_key in result_keys)
+        lookups = []
+        for row in csv_reader:
+            try:
+                coordinates = [float(row['latitude']), float(row['longitude'])]
+            except (TypeError, ValueError):
+                continue
+            expected = {result_key: row[result_key] for result_key in result_keys} if verify else None
+            lookups.append((coordinates, expected))
+    return lookups, verify
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(prog='%s' % pgm_name,
+                                         description='Measure the latency and throughput of GeoCoderService.py lookups.')
+
+    arg_parser.add_argument('--url', default='http://127.0.0.1:8080/reverse', help='service lookup URL (default: http://127.0.0.1:8080/reverse)')
+    arg_parser.add_argument('--src-file-path', required=True,
+                            help='CSV file with latitude and longitude columns, its cc, admin1, admin2 and name columns verified when present')
+    arg_parser.add_argument('--src-delimiter', default=',', help='source file delimiter character')
+    arg_parser.add_argument('--requests', type=int, default=1000, help='requests to send (default: 1000)')
+    arg_parser.add_argument('--concurrency', type=int, default=8, help='requests in flight at once (default: 8)')
+    arg_parser.add_argument('--batch-size', type=int, default=1, help='coordinates per request, 1 sending single GET lookups (default: 1)')
+    arg_parser.add_argument('--seed', type=int, default=0, help='random seed choosing the coordinates (default: 0)')
+
+    arg_parser.add_argument('--version', action='version', version='version=%s %s' % (pgm_name, pgm_version))
+
+    args = arg_parser.parse_args()
+
+    args.requests = max(abs(args.requests), 1)
+    args.concurrency = max(abs(args.concurrency), 1)
+    args.batch_size = max(abs(args.batch_size), 1)
+
+    lookups, verify = load_lookups(args)
+    if len(lookups) == 0:
+        raise SystemExit('No coordinates in: "%s"' % args.src_file_path)
+    print('Loaded {:,} coordinates from: "{}"{}'.format(len(lookups), args.src_file_path, ', verifying their geocodes' if verify else ''))
+
+    # each request's lookups, chosen up front
+    chooser = random.Random(args.seed)
+    request_batches = [[chooser.choice(lookups) for _ in range(args.batch_size)] for _ in range(args.requests)]
+
+    lock = threading.Lock()
+    latencies = []
+    error_count = [0]
+    mismatch_count = [0]
+    next_request = [0]
+
+    def send_requests():
+        # one keep-alive session per thread
+        session = requests.Session()
+        while True:
+            with lock:
+                if next_request[0] >= len(request_batches):
+                    break
+                request_batch = request_batches[next_request[0]]
+                next_request[0] += 1
+            bgn_time = time()
+            try:
+                if len(request_batch) == 1:
+                    latitude, longitude = request_batch[0][0]
+                    response = session.get(args.url, params={'lat': repr(latitude), 'lon': repr(longitude)})
+                    response.raise_for_status()
+                    results = [response.json()]
+                else:
+                    response = session.post(args.url, json=[coordinates for coordinates, expected in request_batch])
+                    response.raise_for_status()
+                    results = response.json()
+            except (requests.RequestException, ValueError) as e:
+                with lock:
+                    error_count[0] += 1
+                print('Error: %s' % e)
+                continue
+            seconds = time() - bgn_time
+            mismatches = sum(1 for (coordinates, expected), result in zip(request_batch, results)
+                             if expected is not None and expected != result)
+            with lock:
+                latencies.append(seconds)
+                mismatch_count[0] += mismatches
+        session.close()
+
+    bgn_time = time()
+    threads = [threading.Thread(target=send_requests) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time() - bgn_time
+
+    latencies.sort()
+    print('Sent {:,} requests of {:,} coordinates, {:,} at once, in {:,.2f} seconds: {:,} errors'.format(
+        args.requests, args.batch_size, args.concurrency, seconds, error_count[0]))
+    print('Throughput: {:,.0f} requests/second, {:,.0f} coordinates/second'.format(
+        len(latencies) / seconds if seconds > 0 else 0, len(latencies) * args.batch_size / seconds if seconds > 0 else 0))
+    print('Latency: p50 {:,.2f} ms, p95 {:,.2f} ms, p99 {:,.2f} ms, max {:,.2f} ms'.format(
+        get_percentile(latencies, 50) * 1000, get_percentile(latencies, 95) * 1000,
+        get_percentile(latencies, 99) * 1000, (latencies[-1] if latencies else 0) * 1000))
+    if verify:
+        print('Verified against: "{}", {:,} mismatched geocodes'.format(args.src_file_path, mismatch_count[0]))
+
+    try:
+        response = requests.get(args.url.rsplit('/', 1)[0] + '/stats')
+        if response.status_code == 200:
+            print('Service: %s' % response.json())
+    except requests.RequestException:
+        pass
+
+
+if __name__ == '__main__':
+    main()
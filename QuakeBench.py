@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+
+# ========================================================================
+#
+# Copyright © 2016 Khepry Quixote
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ========================================================================
+
+import argparse
+import csv
+import io
+import os
+import shlex
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+
+from datetime import datetime
+from time import sleep, time
+
+pgm_name = 'QuakeBench.py'
+pgm_version = '1.0'
+
+program_choices = ('requester', 'counter', 'geocoder', 'polygon')
+
+results_fieldnames = ['run_dtg', 'program', 'version', 'commit', 'rows', 'out_rows', 'seconds', 'rows_per_second', 'peak_rss_mb', 'returncode']
+
+# the working tree, rather than a commit
+working_tree_version = '.'
+
+
+def git(repo_path, *git_args):
+    return subprocess.check_output(('git',) + git_args, cwd=repo_path, universal_newlines=True).strip()
+
+
+def count_csv_rows(file_path):
+    # the data rows of a CSV file with a header row
+    if not os.path.exists(file_path):
+        return None
+    with io.open(file_path, 'r', encoding='utf-8', newline='') as csv_file:
+        return max(sum(1 for _ in csv.reader(csv_file)) - 1, 0)
+
+
+def sum_counts(counts_file_path):
+    # the events counted by a QuakeRestCounter.py counts table
+    if not os.path.exists(counts_file_path):
+        return None
+    with io.open(counts_file_path, 'r', newline='') as counts_file:
+        return sum(int(row['count']) for row in csv.DictReader(counts_file))
+
+
+def run_measured(command, cwd, log_file_path):
+    # the command's exit code, wall seconds and peak RSS in
+    # megabytes, as reported by the kernel when it's reaped;
+    # that includes this process's RSS when it was forked,
+    # so nothing here imports the pyquake package (and numpy)
+    with io.open(log_file_path, 'w') as log_file:
+        bgn_time = time()
+        process = subprocess.Popen(command, cwd=cwd, stdout=log_file, stderr=subprocess.STDOUT)
+        pid, status, rusage = os.wait4(process.pid, 0)
+        seconds = time() - bgn_time
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # kilobytes on Linux, bytes on macOS
+    peak_rss_mb = rusage.ru_maxrss / (1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0)
+    return process.returncode, seconds, peak_rss_mb
+
+
+def get_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as free_socket:
+        free_socket.bind(('127.0.0.1', 0))
+        return free_socket.getsockname()[1]
+
+
+def wait_for_port(port, process, timeout_seconds=60.0):
+    # until the server accepts connections
+    bgn_time = time()
+    while time() - bgn_time < timeout_seconds:
+        if process.poll() is not None:
+            raise RuntimeError('The stub FDSN server exited with code %d' % process.returncode)
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1.0).close()
+            return
+        except OSError:
+            sleep(0.1)
+    raise RuntimeError('The stub FDSN server did not start listening on port %d' % port)
+
+
+def get_command(program, version_path, run_path, catalog_file_path, base_url, args):
+    # the program's command line, and a function returning the
+    # rows it processed (its throughput) and the rows it output
+    if program == 'requester':
+        command = [args.python, os.path.join(version_path, 'QuakeRequester.py'),
+                   '--base_url', base_url,
+                   '--bgn_date', args.bgn_date,
+                   '--end_date', args.end_date,
+                   '--iteration_type', args.iteration_type,
+                   '--requests_per_second', str(args.requests_per_second),
+                   '--sleep_seconds', '0',
+                   '--tgt_path', run_path,
+                   '--tgt_file_basename', 'requester']
+        tgt_file_path = os.path.join(run_path, 'requester.csv')
+        return command, lambda: (count_csv_rows(tgt_file_path),) * 2
+    if program == 'counter':
+        counts_file_path = os.path.join(run_path, 'counts.csv')
+        command = [args.python, os.path.join(version_path, 'QuakeRestCounter.py'),
+                   '--base_url', base_url,
+                   '--bgn_date', args.bgn_date,
+                   '--max_date', args.end_date,
+                   '--iteration_type', 'days',
+                   '--how_many_iterations', '1000000',
+                   '--requests_per_second', str(args.requests_per_second),
+                   '--counts_file_path', counts_file_path,
+                   '--reuse_counts', 'N']
+        return command, lambda: (sum_counts(counts_file_path), count_csv_rows(counts_file_path))
+    # the output file named by its parts, which every
+    # version honours, rather than by --out-file-path
+    out_file_path = os.path.join(run_path, 'geocoded.csv')
+    command = [args.python, os.path.join(version_path, 'GeoCoderRev2.py'),
+               '--src-file-path', catalog_file_path,
+               '--out-file-name-folder', run_path,
+               '--out-file-name-prefix', 'geocoded',
+               '--out-file-name-suffix', '',
+               '--out-file-name-extension', '.csv'] + shlex.split(args.geocoder_args)
+    if program == 'polygon':
+        # the same, with the admin polygons' point-in-polygon
+        # engine rather than the K-D tree's nearest places
+        command += ['--geocode-engine', 'polygon', '--admin-file-path', args.admin_file_path]
+    # versions before user-014 drop rows whose DTGs have a
+    # fraction of a second, so every row processed counts
+    return command, lambda: (args.rows, count_csv_rows(out_file_path))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(prog='%s' % pgm_name,
+                                         description='Benchmark QuakeRequester.py, QuakeRestCounter.py and GeoCoderRev2.py across versions, '
+                                                     'against a synthetic catalog and a stub FDSN event web service, '
+                                                     'GeoCoderRev2.py\'s polygon engine against synthetic admin polygons.')
+
+    arg_parser.add_argument('--versions', nargs='+', default=[working_tree_version],
+                            help='git commits, branches or tags to benchmark, "." being the working tree (default: .)')
+    arg_parser.add_argument('--programs', nargs='+', default=list(program_choices), choices=program_choices,
+                            help='programs to benchmark (default: all)')
+    arg_parser.add_argument('--repeat', type=int, default=1, help='runs of each program and version, the fastest of which is reported (default: 1)')
+    arg_parser.add_argument('--python', default=sys.executable, help='Python interpreter running the programs (default: this one)')
+    arg_parser.add_argument('--work-path', default=None, help='folder for the catalog, versions and outputs (default: None, a temporary one)')
+    arg_parser.add_argument('--results-file-path', default=None, help='CSV file the results are appended to (default: None, not saved)')
+
+    arg_parser.add_argument('--rows', type=int, default=100000, help='synthetic catalog rows geocoded by GeoCoderRev2.py (default: 100000)')
+    arg_parser.add_argument('--catalog-events-per-day', type=float, default=1000.0, help='synthetic catalog file mean events per day (default: 1000.0)')
+    arg_parser.add_argument('--geocoder-args', default='', help='further GeoCoderRev2.py arguments, e.g. "--workers 4" (default: none)')
+    arg_parser.add_argument('--admin-cell-degrees', type=float, default=5.0, help='synthetic admin polygons grid cell size, in degrees (default: 5.0)')
+    arg_parser.add_argument('--admin-cell-vertices', type=int, default=32, help='synthetic admin polygons vertices per cell side (default: 32)')
+
+    arg_parser.add_argument('--bgn-date', default='2018-01-01', help='starting date fetched and counted (default: 2018-01-01)')
+    arg_parser.add_argument('--end-date', default='2018-12-31', help='ending date fetched and counted (default: 2018-12-31)')
+    arg_parser.add_argument('--iteration-type', default='months', choices=('days', 'weeks', 'months', 'years'),
+                            help='QuakeRequester.py iteration type (default: months)')
+    arg_parser.add_argument('--requests-per-second', type=float, default=100.0, help='request rate of the fetchers (default: 100.0)')
+    arg_parser.add_argument('--stub-events-per-day', type=float, default=80.0, help='stub FDSN server mean events per day (default: 80.0)')
+    arg_parser.add_argument('--stub-search-limit', type=int, default=20000, help='stub FDSN server search limit (default: 20000)')
+    arg_parser.add_argument('--stub-latency-seconds', type=float, default=0.05, help='stub FDSN server response latency (default: 0.05)')
+    arg_parser.add_argument('--stub-error-rate', type=float, default=0.0, help='stub FDSN server fraction of 503 responses (default: 0.0)')
+    arg_parser.add_argument('--seed', type=int, default=0, help='synthetic catalog random seed (default: 0)')
+
+    arg_parser.add_argument('--version', action='version', version='version=%s %s' % (pgm_name, pgm_version))
+
+    args = arg_parser.parse_args()
+
+    args.repeat = max(abs(args.repeat), 1)
+    args.rows = max(abs(args.rows), 1)
+
+    repo_path = os.path.dirname(os.path.abspath(__file__))
+    work_path = os.path.abspath(os.path.expanduser(args.work_path)) if args.work_path is not None else tempfile.mkdtemp(prefix='quake_bench_')
+    os.makedirs(work_path, exist_ok=True)
+    print('Benchmarking in: "%s"' % work_path)
+
+    catalog_file_path = None
+    if 'geocoder' in args.programs or 'polygon' in args.programs:
+        # generated once, and reused by
+        # later benchmarks in the same folder
+        catalog_file_path = os.path.join(work_path, 'catalog_%d_%d_%d.csv' % (args.rows, args.catalog_events_per_day, args.seed))
+        if not os.path.exists(catalog_file_path):
+            print('Generating: {:,} catalog rows'.format(args.rows))
+            subprocess.check_call([args.python, os.path.join(repo_path, 'QuakeSynthetic.py'),
+                                   '--out-file-path', catalog_file_path,
+                                   '--rows', str(args.rows),
+                                   '--events-per-day', str(args.catalog_events_per_day),
+                                   '--seed', str(args.seed)])
+
+    args.admin_file_path = None
+    if 'polygon' in args.programs:
+        # likewise the admin polygons
+        args.admin_file_path = os.path.join(work_path, 'admin_%g_%d_%d.geojson' % (args.admin_cell_degrees, args.admin_cell_vertices, args.seed))
+        if not os.path.exists(args.admin_file_path):
+            print('Generating: admin polygons of {:g} degree cells'.format(args.admin_cell_degrees))
+            subprocess.check_call([args.python, os.path.join(repo_path, 'QuakeSynthetic.py'),
+                                   '--admin-file-path', args.admin_file_path,
+                                   '--admin-cell-degrees', str(args.admin_cell_degrees),
+                                   '--admin-cell-vertices', str(args.admin_cell_vertices),
+                                   '--seed', str(args.seed)])
+
+    server_process = None
+    server_log_file_path = os.path.join(work_path, 'stub_server.log')
+    base_url = None
+    if 'requester' in args.programs or 'counter' in args.programs:
+        # in a process of its own, not competing
+        # with this one for the interpreter lock
+        port = get_free_port()
+        with io.open(server_log_file_path, 'w') as server_log_file:
+            server_process = subprocess.Popen([args.python, os.path.join(repo_path, 'QuakeStubServer.py'),
+                                               '--port', str(port),
+                                               '--events-per-day', str(args.stub_events_per_day),
+                                               '--seed', str(args.seed),
+                                               '--search-limit', str(args.stub_search_limit),
+                                               '--latency-seconds', str(args.stub_latency_seconds),
+                                               '--error-rate', str(args.stub_error_rate)],
+                                              stdout=server_log_file, stderr=subprocess.STDOUT)
+        wait_for_port(port, server_process)
+        base_url = 'http://127.0.0.1:%d/fdsnws/event/1/' % port
+        print('Serving the stub FDSN event web service on: "%s"' % base_url)
+
+    run_dtg = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    results = []
+    try:
+        for version in args.versions:
+            if version == working_tree_version:
+                version_path = repo_path
+                commit = git(repo_path, 'rev-parse', '--short', 'HEAD')
+                if git(repo_path, 'status', '--porcelain', '--untracked-files=no') != '':
+                    commit += '+'
+            else:
+                # the version checked out on its own
+                commit = git(repo_path, 'rev-parse', '--short', version + '^{commit}')
+                version_path = os.path.join(work_path, 'version_%s' % commit)
+                if not os.path.exists(version_path):
+                    git(repo_path, 'worktree', 'add', '--detach', version_path, commit)
+
+            try:
+                for program in args.programs:
+                    best = None
+                    for run_number in range(args.repeat):
+                        run_path = os.path.join(work_path, 'run_%s_%s_%d' % (program, commit, run_number))
+                        shutil.rmtree(run_path, ignore_errors=True)
+                        os.makedirs(run_path)
+                        command, get_rows = get_command(program, version_path, run_path, catalog_file_path, base_url, args)
+                        returncode, seconds, peak_rss_mb = run_measured(command, version_path, os.path.join(work_path, 'run_%s_%s_%d.log' % (program, commit, run_number)))
+                        rows, out_rows = get_rows() if returncode == 0 else (None, None)
+                        shutil.rmtree(run_path, ignore_errors=True)
+                        print('{} {} ({}) run {:,}: {} rows in {:,.2f} seconds, {} output, peak RSS {:,.1f} MB, exit code {}'.format(
+                            program, version, commit, run_number + 1, '{:,}'.format(rows) if rows is not None else '?', seconds,
+                            '{:,}'.format(out_rows) if out_rows is not None else '?', peak_rss_mb, returncode))
+                        result = {'run_dtg': run_dtg,
+                                  'program': program,
+                                  'version': version,
+                                  'commit': commit,
+                                  'rows': rows,
+                                  'out_rows': out_rows,
+                                  'seconds': round(seconds, 3),
+                                  'rows_per_second': round(rows / seconds, 1) if rows is not None and seconds > 0 else None,
+                                  'peak_rss_mb': round(peak_rss_mb, 1),
+                                  'returncode': returncode}
+                        if best is None or (returncode == 0 and (best['returncode'] != 0 or seconds < best['seconds'])):
+                            best = result
+                        else:
+                            best['peak_rss_mb'] = max(best['peak_rss_mb'], result['peak_rss_mb'])
+                    results.append(best)
+            finally:
+                if version != working_tree_version:
+                    git(repo_path, 'worktree', 'remove', '--force', version_path)
+    finally:
+        if server_process is not None:
+            server_process.send_signal(signal.SIGINT)
+            server_process.wait()
+            with io.open(server_log_file_path, 'r') as server_log_file:
+                print(server_log_file.read().strip().splitlines()[-1])
+
+    if args.results_file_path is not None:
+        results_file_path = os.path.abspath(os.path.expanduser(args.results_file_path))
+        write_header = not os.path.exists(results_file_path)
+        with io.open(results_file_path, 'a', newline='') as results_file:
+            csv_writer = csv.DictWriter(results_file, fieldnames=results_fieldnames, lineterminator='\n')
+            if write_header:
+                csv_writer.writeheader()
+            csv_writer.writerows(results)
+        print('Appended {:,} results to: "{}"'.format(len(results), results_file_path))
+
+    # each program's versions against the first
+    print('')
+    print('{:<10} {:<24} {:>12} {:>10} {:>12} {:>10} {:>8}'.format('program', 'version', 'rows', 'seconds', 'rows/second', 'peak MB', 'change'))
+    for program in args.programs:
+        first = None
+        for result in results:
+            if result['program'] != program:
+                continue
+            change = ''
+            if result['returncode'] != 0:
+                change = 'failed'
+            elif first is None:
+                first = result
+            elif first['rows_per_second'] and result['rows_per_second']:
+                change = '{:+.1f}%'.format((result['rows_per_second'] / first['rows_per_second'] - 1.0) * 100.0)
+            print('{:<10} {:<24} {:>12} {:>10,.2f} {:>12} {:>10,.1f} {:>8}'.format(
+                program, ('%s (%s)' % (result['version'], result['commit']))[:24],
+                '{:,}'.format(result['rows']) if result['rows'] is not None else '?',
+                result['seconds'],
+                '{:,.0f}'.format(result['rows_per_second']) if result['rows_per_second'] is not None else '?',
+                result['peak_rss_mb'], change))
+
+    if args.work_path is None:
+        shutil.rmtree(work_path, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
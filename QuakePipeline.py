@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+
+# ========================================================================
+#
+# Copyright © 2016 Khepry Quixote
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ========================================================================
+
+import argparse
+import os
+
+from datetime import datetime
+from pprint import pprint
+from time import time
+
+from pyquake.csv_geocoder import delimiter_xlator, quotemode_choices, quotemode_xlator
+from pyquake.fetcher import CatalogFetcher
+from pyquake.geocoder import Geocoder, engine_choices
+from pyquake.metrics import MetricsReporter, Profiler, metrics, profile_choices
+from pyquake.output import open_out_file
+from pyquake.pipeline import BatchGeocoder, Pipeline, RowNormalizer, output_row_batches
+from pyquake.windows import get_service_url
+
+pgm_name = 'QuakePipeline.py'
+pgm_version = '1.0'
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(prog='%s' % pgm_name,
+                                         description='Obtain ANSS ComCat earthquakes via ReSTful interface, reverse-geocoding them as they stream in.')
+
+    arg_parser.add_argument('--bgn-date', default='1900-01-01', help='starting date (default: 1900-01-01)')
+    arg_parser.add_argument('--end-date', default='2019-12-31', help='ending date (default: 2019-12-31)')
+    arg_parser.add_argument('--iteration-type', default='years', choices=('days', 'weeks', 'months', 'years'),
+                            help='iteration type (default: years)')
+    arg_parser.add_argument('--min-magnitude', type=float, default=None, help='minimum magnitude (0 or greater)')
+    arg_parser.add_argument('--max-magnitude', type=float, default=None, help='maximum magnitude (0 or greater)')
+    arg_parser.add_argument('--min-depth', type=float, default=-100, help='minimum depth in kilometers (-100 to 1000)')
+    arg_parser.add_argument('--max-depth', type=float, default=1000, help='maximum depth in kilometers (-100 to 1000)')
+    arg_parser.add_argument('--base-url', default='https://earthquake.usgs.gov/fdsnws/event/1/', help='FDSN event web service base URL')
+    arg_parser.add_argument('--requests-per-second', type=float, default=1.0, help='request rate (default: 1.0)')
+    arg_parser.add_argument('--connect-timeout', type=float, default=10.0, help='seconds to wait for a connection (default: 10.0)')
+    arg_parser.add_argument('--read-timeout', type=float, default=120.0, help='seconds to wait between bytes of a response (default: 120.0)')
+    arg_parser.add_argument('--max-retries', type=int, default=5, help='retries of a request after errors or busy (429/5xx) responses (default: 5)')
+    arg_parser.add_argument('--tile-levels', type=int, default=0,
+                            help='quadtree levels every window is split into bounding box tiles up front, 4 tiles per level (default: 0, tiling only the days over the search limit)')
+    arg_parser.add_argument('--backoff-seconds', type=float, default=1.0, help='initial retry backoff, doubling with each retry (default: 1.0)')
+
+    arg_parser.add_argument('--src-date-ymd-separator', default='-', help='source date year, month, day separator (default: -)')
+    arg_parser.add_argument('--dtg-parse-pattern', default='%Y-%m-%d %H:%M:%S', help='Date-Time-Group Pattern (default: %%Y-%%m-%%d %%H:%%M:%%S)')
+
+    arg_parser.add_argument('--out-file-path', default='ANSS_ComCat_earthquakes_reverse_geocoded.csv', help='output file path')
+    arg_parser.add_argument('--out-delimiter', default=',', help='output file delimiter character')
+    arg_parser.add_argument('--out-quotechar', default='"', help='output file quote character')
+    arg_parser.add_argument('--out-quotemode', dest='out_quotemode_str', default='QUOTE_MINIMAL', choices=quotemode_choices,
+                            help='output file quoting mode (default: %s)' % 'QUOTE_MINIMAL')
+    arg_parser.add_argument('--out-header-row', default='Y', choices=['Y', 'N'], help='output a header row to file (default: Y)')
+    arg_parser.add_argument('--out-db-null-value', default=None, help='output null value (default: NULL)')
+    arg_parser.add_argument('--out-es-null-value', default=None, help='output null value (default: NULL)')
+    arg_parser.add_argument('--out-format', default='csv', choices=['csv', 'parquet'], help='output file format (default: csv)')
+    arg_parser.add_argument('--out-row-group-rows', type=int, default=100000, help='rows per Parquet row group (default: 100000)')
+    arg_parser.add_argument('--out-date-ymd-separator', default='-', help='output date year, month, day separator (default: -)')
+    arg_parser.add_argument('--out-elastic-search', default='N', choices=['Y', 'N'], help='output to ElasticSearch index (default: N)')
+
+    arg_parser.add_argument('--es-host-url', default='localhost', help='ElasticSearch host URL')
+    arg_parser.add_argument('--es-port-number', default='9200', help='ElasticSearch port number')
+    arg_parser.add_argument('--es-index-name', default='quakes', help='ElasticSearch alias of the versioned index loaded (default: quakes)')
+    arg_parser.add_argument('--es-replicas', type=int, default=1, help='ElasticSearch index replicas, once loaded (default: 1)')
+    arg_parser.add_argument('--es-refresh-interval', default='1s', help='ElasticSearch index refresh interval, once loaded (default: 1s)')
+    arg_parser.add_argument('--es-keep-old-indices', default='N', choices=['Y', 'N'], help='keep the indices the alias is swapped from (default: N)')
+    arg_parser.add_argument('--es-bulk-docs', type=int, default=500, help='ElasticSearch documents per bulk request (default: 500)')
+    arg_parser.add_argument('--es-bulk-bytes', type=int, default=5242880, help='ElasticSearch bytes per bulk request (default: 5242880)')
+    arg_parser.add_argument('--es-bulk-threads', type=int, default=2, help='ElasticSearch bulk requests in flight at once (default: 2)')
+    arg_parser.add_argument('--es-bulk-queue-size', type=int, default=4, help='ElasticSearch bulk requests queued before output waits (default: 4)')
+    arg_parser.add_argument('--es-bulk-retries', type=int, default=3, help='ElasticSearch retries of rejected documents and failed bulk requests (default: 3)')
+
+    arg_parser.add_argument('--batch-rows', type=int, default=1000, help='rows per batch handed between the stages, and per K-D tree query (default: 1000)')
+    arg_parser.add_argument('--queue-batches', type=int, default=4, help='batches queued between two stages before the earlier one waits (default: 4)')
+    arg_parser.add_argument('--flush-rows', type=int, default=10000, help='progress message interval, in rows (default: 10000)')
+
+    arg_parser.add_argument('--geocode-index-file-path', default=None, help='memory-mapped geocoder index file path, see GeoCoderIndex.py (default: None)')
+    arg_parser.add_argument('--geocode-cache', default='N', choices=['Y', 'N'], help='cache geocodes by quantized coordinates (default: N)')
+    arg_parser.add_argument('--geocode-cache-precision', type=int, default=3, help='geocode cache coordinate decimal places (default: 3)')
+    arg_parser.add_argument('--geocode-cache-size', type=int, default=100000, help='geocode cache in-memory entries (default: 100000)')
+    arg_parser.add_argument('--geocode-cache-file-path', default=None, help='geocode cache persistent SQLite file path (default: None, in-memory only)')
+    arg_parser.add_argument('--geocode-engine', default='kdtree', choices=engine_choices,
+                            help='cc, admin1 and admin2 from the nearest populated place (kdtree) or the admin polygon holding the point (polygon), '
+                                 'the name being the nearest place\'s either way (default: kdtree)')
+    arg_parser.add_argument('--admin-file-path', default=None, help='admin boundary polygons GeoJSON or shapefile path, for --geocode-engine polygon (default: None)')
+    arg_parser.add_argument('--admin-cc-field', default='cc', help='admin polygons\' cc property (default: cc)')
+    arg_parser.add_argument('--admin-admin1-field', default='admin1', help='admin polygons\' admin1 property (default: admin1)')
+    arg_parser.add_argument('--admin-admin2-field', default='admin2', help='admin polygons\' admin2 property (default: admin2)')
+
+    arg_parser.add_argument('--stats-seconds', type=float, default=0, help='JSON stats line interval, in seconds (default: 0, a stats line only at the end when --stats-file-path is set)')
+    arg_parser.add_argument('--stats-file-path', default=None, help='JSON stats lines file path, appended to (default: None, printed)')
+    arg_parser.add_argument('--metrics-file-path', default=None, help='Prometheus text metrics file path, rewritten as the stats are (default: None)')
+    arg_parser.add_argument('--metrics-port', type=int, default=0, help='Prometheus metrics port, served at /metrics (default: 0, not served)')
+    arg_parser.add_argument('--profile', default='none', choices=profile_choices, help='profile with cProfile or by sampling the stacks (default: none)')
+    arg_parser.add_argument('--profile-file-path', default=None, help='profile output file path (default: the program name with .prof or .folded)')
+
+    arg_parser.add_argument('--version', action='version', version='version=%s %s' % (pgm_name, pgm_version))
+
+    args = arg_parser.parse_args()
+
+    if args.geocode_engine == 'polygon' and args.admin_file_path is None:
+        arg_parser.error('--geocode-engine polygon requires --admin-file-path')
+
+    if args.out_format == 'parquet' and args.out_file_path.endswith('.csv'):
+        args.out_file_path = args.out_file_path[:-len('.csv')] + '.parquet'
+
+    args.out_quotemode_enm = quotemode_xlator(args.out_quotemode_str)
+    args.out_delimiter = delimiter_xlator(args.out_delimiter)
+
+    args.batch_rows = max(abs(args.batch_rows), 1)
+    args.flush_rows = max(abs(args.flush_rows), 1)
+    args.out_row_group_rows = max(abs(args.out_row_group_rows), 1)
+
+    for arg_name in ('out_file_path', 'geocode_index_file_path', 'geocode_cache_file_path', 'admin_file_path'):
+        arg_value = getattr(args, arg_name)
+        if arg_value is not None:
+            setattr(args, arg_name, os.path.abspath(os.path.expanduser(arg_value)))
+
+    print('Reverse-geocoding ANSS ComCat earthquakes from: "%s"' % args.base_url)
+    print('Outputting to the target ANSS ComCat earthquakes file: "%s"' % args.out_file_path)
+    print('')
+
+    print('Command line args:')
+    pprint(vars(args))
+    print('')
+
+    # one keep-alive connection, request
+    # rate and retry policy for the windows
+    catalog_fetcher = CatalogFetcher(args)
+
+    # the geocoder, its K-D tree loaded
+    # before the rows arrive, and any cache
+    geocoder = Geocoder.from_args(args)
+    geocoder.warm()
+
+    es = None
+    if args.out_elastic_search == 'Y':
+        from elasticsearch import Elasticsearch
+        # connect to the ElasticSearch cluster
+        es = Elasticsearch([{'host': args.es_host_url, 'port': int(args.es_port_number)}])
+
+    bgn_date = datetime.strptime(args.bgn_date, '%Y-%m-%d')
+    end_date = datetime.strptime(args.end_date, '%Y-%m-%d')
+    base_url = get_service_url(args.base_url, 'query', 'csv', args.min_depth, args.max_depth, args.min_magnitude, args.max_magnitude)
+
+    # fetch -> normalize -> geocode, each stage in its own
+    # thread, the rows then being output by this thread
+    row_normalizer = RowNormalizer(args)
+    pipeline = Pipeline(queue_size=args.queue_batches)
+    pipeline.add_stage('fetch', lambda: catalog_fetcher.fetch_line_batches(base_url, bgn_date, end_date, args.iteration_type, args.batch_rows))
+    pipeline.add_stage('normalize', row_normalizer)
+    pipeline.add_stage('geocode', BatchGeocoder(row_normalizer, geocoder))
+
+    # periodic stats lines and any Prometheus
+    # metrics, the queue depths among them
+    metrics.add_collector(pipeline.collect_metrics)
+    metrics_reporter = MetricsReporter.from_args(args)
+
+    # beginning time hack
+    bgn_time = time()
+
+    # open the target file for writing
+    with Profiler.from_args(args, pgm_name), open_out_file(args.out_file_path, 'utf-8', args) as out_file:
+        row_output = output_row_batches(pipeline, row_normalizer, out_file, args, es, geocoder)
+        if row_output is not None:
+            row_output.close()
+
+    if row_output is not None:
+        # swap the alias to the loaded index
+        row_output.finish()
+
+    geocoder.close()
+    metrics_reporter.close()
+
+    # ending time hack
+    seconds = time() - bgn_time
+    message = "Processed: {:,} rows in {:,.0f} seconds @ {:,.0f} records/second".format(
+        row_normalizer.row_count, seconds, row_normalizer.row_count / seconds if seconds > 0 else row_normalizer.row_count)
+    for other_message in (geocoder.get_message(), row_output.get_message() if row_output is not None else None):
+        if other_message is not None:
+            message += ', ' + other_message
+    print(message)
+    if metrics.get_message() is not None:
+        print(metrics.get_message())
+    print(catalog_fetcher.http_client.get_message())
+    catalog_fetcher.close()
+    print('Output file path: "%s"' % args.out_file_path)
+    print("Processing finished, {:,} rows output!".format(row_output.out_count if row_output is not None else 0))
+
+
+if __name__ == '__main__':
+    main()
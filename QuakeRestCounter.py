@@ -5,98 +5,161 @@ Created on Tue Sep 26 16:02:09 2017
 @author: Khepry Quixote
 """
 import argparse
-import requests
+import os
 import sys
 
+from datetime import datetime
+from pyquake.counter import CatalogCounter, counts_fieldnames, get_counts_key, load_counts_table, save_counts_table
+from pyquake.metrics import MetricsReporter, Profiler, profile_choices
+from pyquake.windows import get_next_dates_list
 
-from datetime import datetime, timedelta
-from monthdelta import monthdelta
-from pprint import pprint
-from time import sleep
-
-# handle incoming parameters,
-# pushing their values into the
-# args dictionary for later usage
-
-arg_parser = argparse.ArgumentParser(description='Obtain earthquakes via ReSTful interface')
-
-arg_parser.add_argument('--bgn_date',
-                        type=str,
-                        default='1898-01-01',
-                        help='starting date')
-arg_parser.add_argument('--max_date',
-                        type=str,
-                        default='2020-01-01',
-                        help='maximum date')
-arg_parser.add_argument('--iteration_type',
-                        type=str,
-                        default='years',
-                        choices=('days', 'weeks', 'months', 'years'),
-                        help='iteration type (e.g. days, weeks, months, years)')
-arg_parser.add_argument('--how_many_iterations',
-                        type=int,
-                        default=5,
-                        help='how many iterations')
-arg_parser.add_argument('--minmagnitude',
-                        type=float,
-                        default=0.0,
-                        help='minimum magnitude (0 or greater)')
-arg_parser.add_argument('--sleep_seconds',
-                        type=int,
-                        default=5,
-                        help='sleep seconds')
-
-args = arg_parser.parse_args()
-
-
-def get_next_dates_list(bgn_date_parm,
-                        max_date_parm,
-                        iteration_type,
-                        how_many_iterations):
-    bgn_end_dates_list = []
-    date_time = bgn_date_parm
-    for i in range(0, how_many_iterations):
-        bgn_date_parm = date_time.strftime('%Y-%m-%d')
-        try:
-            if iteration_type == 'days':
-                date_time += timedelta(days=1)
-                end_date = (date_time + timedelta(days=1)).strftime('%Y-%m-%d')
-            elif iteration_type == 'weeks':
-                date_time += timedelta(weeks=1)
-                end_date = date_time.strftime('%Y-%m-%d')
-            elif iteration_type == 'months':
-                date_time += monthdelta(months=1)
-                end_date = date_time.strftime('%Y-%m-%d')
-            elif iteration_type == 'years':
-                date_time += monthdelta(months=12)
-                end_date = date_time.strftime('%Y-%m-%d')
-            else:
-                date_time += timedelta(days=1)
-                end_date = (date_time + timedelta(days=1)).strftime('%Y-%m-%d')
-            if datetime.strptime(end_date, '%Y-%m-%d') < max_date:
-                bgn_end_dates_list.append((bgn_date_parm, end_date))
-            else:
-                bgn_end_dates_list.append((bgn_date_parm, max_date.strftime('%Y-%m-%d')))
-                break
-        except Exception as e:
-            sys.stderr.write('Exception: %s' % e)
-    return bgn_end_dates_list
-
-
-bgn_date = datetime.strptime(args.bgn_date, '%Y-%m-%d')
-max_date = datetime.strptime(args.max_date, '%Y-%m-%d')
-bgn_end_dates_list = get_next_dates_list(bgn_date,
-                                    max_date,
-                                    args.iteration_type,
-                                    args.how_many_iterations)
-
-for bgn_end_date in bgn_end_dates_list:
-    url = 'https://earthquake.usgs.gov/fdsnws/event/1/count?minmagnitude=%d&starttime=%s&endtime=%s' % (args.minmagnitude, bgn_end_date[0], bgn_end_date[1])
-    print(url)
-    try:
-        response = requests.get(url)
-        count = response.content
-        print(count.decode('utf-8'))
-    except Exception as e:
-        print('Bad response. Got an error code:', e)
-    sleep(args.sleep_seconds)
+
+def main():
+    # handle incoming parameters,
+    # pushing their values into the
+    # args dictionary for later usage
+
+    arg_parser = argparse.ArgumentParser(description='Obtain earthquakes via ReSTful interface')
+
+    arg_parser.add_argument('--bgn_date',
+                            type=str,
+                            default='1898-01-01',
+                            help='starting date')
+    arg_parser.add_argument('--max_date',
+                            type=str,
+                            default='2020-01-01',
+                            help='maximum date')
+    arg_parser.add_argument('--iteration_type',
+                            type=str,
+                            default='years',
+                            choices=('days', 'weeks', 'months', 'years'),
+                            help='iteration type (e.g. days, weeks, months, years)')
+    arg_parser.add_argument('--how_many_iterations',
+                            type=int,
+                            default=5,
+                            help='how many iterations')
+    arg_parser.add_argument('--minmagnitude',
+                            type=float,
+                            default=0.0,
+                            help='minimum magnitude (0 or greater)')
+    arg_parser.add_argument('--concurrency',
+                            type=int,
+                            default=4,
+                            help='count requests in flight at once')
+    arg_parser.add_argument('--requests_per_second',
+                            type=float,
+                            default=1.0,
+                            help='request rate shared by all concurrent count requests')
+    arg_parser.add_argument('--base_url',
+                            type=str,
+                            default='https://earthquake.usgs.gov/fdsnws/event/1/',
+                            help='FDSN event web service base URL')
+    arg_parser.add_argument('--counts_file_path',
+                            type=str,
+                            default=None,
+                            help='counts table file path, JSON if ending in .json, else CSV (default: None, not saved)')
+    arg_parser.add_argument('--reuse_counts',
+                            type=str,
+                            default='Y',
+                            choices=('Y', 'N'),
+                            help='reuse the counts already in the counts table file')
+    arg_parser.add_argument('--connect_timeout',
+                            type=float,
+                            default=10.0,
+                            help='seconds to wait for a connection')
+    arg_parser.add_argument('--read_timeout',
+                            type=float,
+                            default=60.0,
+                            help='seconds to wait between bytes of a response')
+    arg_parser.add_argument('--max_retries',
+                            type=int,
+                            default=5,
+                            help='retries of a request after errors or busy (429/5xx) responses')
+    arg_parser.add_argument('--backoff_seconds',
+                            type=float,
+                            default=1.0,
+                            help='initial retry backoff, doubling with each retry')
+
+    arg_parser.add_argument('--stats_seconds',
+                            type=float,
+                            default=0,
+                            help='JSON stats line interval, in seconds (0 for a stats line only at the end when a stats file is set)')
+    arg_parser.add_argument('--stats_file_path',
+                            type=str,
+                            default=None,
+                            help='JSON stats lines file, appended to (printed when not set)')
+    arg_parser.add_argument('--metrics_file_path',
+                            type=str,
+                            default=None,
+                            help='Prometheus text metrics file, rewritten as the stats are')
+    arg_parser.add_argument('--metrics_port',
+                            type=int,
+                            default=0,
+                            help='Prometheus metrics port, served at /metrics (0 for not served)')
+    arg_parser.add_argument('--profile',
+                            type=str,
+                            default='none',
+                            choices=profile_choices,
+                            help='profile with cProfile or by sampling the stacks')
+    arg_parser.add_argument('--profile_file_path',
+                            type=str,
+                            default=None,
+                            help='profile output file (the program name with .prof or .folded when not set)')
+
+    args = arg_parser.parse_args()
+
+    # the counter, its keep-alive connections,
+    # request rate and retry policy
+    catalog_counter = CatalogCounter(args)
+
+    bgn_date = datetime.strptime(args.bgn_date, '%Y-%m-%d')
+    max_date = datetime.strptime(args.max_date, '%Y-%m-%d')
+    bgn_end_dates_list = get_next_dates_list(bgn_date,
+                                             max_date,
+                                             args.iteration_type,
+                                             args.how_many_iterations)
+
+    if args.counts_file_path is not None and args.counts_file_path.startswith('~'):
+        args.counts_file_path = os.path.expanduser(args.counts_file_path)
+
+    # counts already obtained by an earlier sweep
+    counts_table = load_counts_table(args.counts_file_path) if args.reuse_counts == 'Y' else {}
+
+    # periodic stats lines and
+    # any Prometheus metrics
+    metrics_reporter = MetricsReporter.from_args(args)
+
+    # windows whose counts couldn't be obtained
+    with Profiler.from_args(args, 'QuakeRestCounter.py'):
+        failed_urls = catalog_counter.count_windows(bgn_end_dates_list, counts_table)
+
+    metrics_reporter.close()
+
+    if args.counts_file_path is not None:
+        save_counts_table(args.counts_file_path, counts_table)
+        print('Saved %d counts: %s' % (len(counts_table), args.counts_file_path))
+
+    # the sweep's counts, in window order
+    total_count = 0
+    print(','.join(counts_fieldnames))
+    for bgn_end_date in bgn_end_dates_list:
+        counts_row = counts_table.get(get_counts_key(bgn_end_date[0], bgn_end_date[1], args.minmagnitude))
+        if counts_row is not None:
+            total_count += counts_row['count']
+            print(','.join(str(counts_row[fieldname]) for fieldname in counts_fieldnames))
+    print('Total count: %d' % total_count)
+
+    print(catalog_counter.http_client.get_message())
+    catalog_counter.close()
+
+    # report the windows missing
+    # counts rather than drop them
+    if len(failed_urls) > 0:
+        sys.stderr.write('No counts obtained for %d windows:\n' % len(failed_urls))
+        for url in failed_urls:
+            sys.stderr.write('%s\n' % url)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
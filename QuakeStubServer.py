@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+# ========================================================================
+#
+# Copyright © 2016 Khepry Quixote
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ========================================================================
+
+import argparse
+
+from pyquake.stub_fdsn import StubFdsnServer
+from pyquake.synthetic import SyntheticCatalog
+from pyquake.windows import max_rows_per_query
+
+pgm_name = 'QuakeStubServer.py'
+pgm_version = '1.0'
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(prog='%s' % pgm_name,
+                                         description='Serve a synthetic ANSS ComCat catalog as a stub FDSN event web service.')
+
+    arg_parser.add_argument('--host', default='127.0.0.1', help='address to listen on (default: 127.0.0.1)')
+    arg_parser.add_argument('--port', type=int, default=8765, help='port to listen on (default: 8765)')
+    arg_parser.add_argument('--events-per-day', type=float, default=80.0, help='mean events per day (default: 80.0)')
+    arg_parser.add_argument('--seed', type=int, default=0, help='catalog random seed (default: 0)')
+    arg_parser.add_argument('--search-limit', type=int, default=max_rows_per_query,
+                            help='events a query may match (default: %d)' % max_rows_per_query)
+    arg_parser.add_argument('--latency-seconds', type=float, default=0.05, help='seconds each response is delayed (default: 0.05)')
+    arg_parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests failed with 503 responses (default: 0.0)')
+    arg_parser.add_argument('--verbose', default='N', choices=['Y', 'N'], help='log each request (default: N)')
+
+    arg_parser.add_argument('--version', action='version', version='version=%s %s' % (pgm_name, pgm_version))
+
+    args = arg_parser.parse_args()
+
+    server = StubFdsnServer((args.host, args.port), SyntheticCatalog(args.events_per_day, args.seed),
+                            search_limit=args.search_limit,
+                            latency_seconds=args.latency_seconds,
+                            error_rate=args.error_rate,
+                            seed=args.seed,
+                            verbose=args.verbose == 'Y')
+    print('Serving the stub FDSN event web service on: "http://%s:%d/fdsnws/event/1/"' % server.server_address[:2])
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+    print(server.get_message())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+# ========================================================================
+#
+# Copyright © 2016 Khepry Quixote
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ========================================================================
+
+import argparse
+import os
+
+from datetime import datetime
+from time import time
+
+from pyquake.synthetic import SyntheticCatalog, write_admin_geojson, write_catalog_csv
+
+pgm_name = 'QuakeSynthetic.py'
+pgm_version = '1.0'
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(prog='%s' % pgm_name,
+                                         description='Generate a synthetic ANSS ComCat-formatted earthquake CSV file, '
+                                                     'and optionally synthetic admin polygons, for benchmarking.')
+
+    arg_parser.add_argument('--out-file-path', default=None, help='output file path (default: None, no catalog generated)')
+    arg_parser.add_argument('--rows', type=int, default=1000000, help='rows to generate (default: 1000000)')
+    arg_parser.add_argument('--bgn-date', default='1990-01-01', help='date of the first day generated (default: 1990-01-01)')
+    arg_parser.add_argument('--events-per-day', type=float, default=1000.0, help='mean events per day (default: 1000.0)')
+    arg_parser.add_argument('--seed', type=int, default=0, help='catalog random seed (default: 0)')
+    arg_parser.add_argument('--workers', type=int, default=1, help='processes generating the days, 1 generating them in this one (default: 1)')
+    arg_parser.add_argument('--flush-rows', type=int, default=1000000, help='progress message interval, in rows (default: 1000000)')
+
+    arg_parser.add_argument('--admin-file-path', default=None, help='admin polygons GeoJSON output file path, for GeoCoderRev2.py --geocode-engine polygon (default: None, not generated)')
+    arg_parser.add_argument('--admin-cell-degrees', type=float, default=5.0, help='admin polygons grid cell size, in degrees (default: 5.0)')
+    arg_parser.add_argument('--admin-cell-vertices', type=int, default=32, help='admin polygons vertices per cell side (default: 32)')
+
+    arg_parser.add_argument('--version', action='version', version='version=%s %s' % (pgm_name, pgm_version))
+
+    args = arg_parser.parse_args()
+
+    if args.out_file_path is None and args.admin_file_path is None:
+        arg_parser.error('--out-file-path, --admin-file-path or both are required')
+
+    if args.out_file_path is not None:
+        args.out_file_path = os.path.abspath(os.path.expanduser(args.out_file_path))
+
+        catalog = SyntheticCatalog(args.events_per_day, args.seed)
+
+        bgn_time = time()
+        row_count = write_catalog_csv(args.out_file_path, max(abs(args.rows), 1), datetime.strptime(args.bgn_date, '%Y-%m-%d'),
+                                      catalog, args.flush_rows, max(args.workers, 1))
+        seconds = time() - bgn_time
+
+        print("Generated: {:,} rows in {:,.0f} seconds @ {:,.0f} rows/second".format(
+            row_count, seconds, row_count / seconds if seconds > 0 else row_count))
+        print('Output file path: "%s"' % args.out_file_path)
+
+    if args.admin_file_path is not None:
+        args.admin_file_path = os.path.abspath(os.path.expanduser(args.admin_file_path))
+
+        # the cells a divisor of 180 degrees,
+        # so the grid covers the world exactly
+        admin_cell_degrees = 180.0 / max(int(round(180.0 / abs(args.admin_cell_degrees))), 1)
+        polygon_count = write_admin_geojson(args.admin_file_path, admin_cell_degrees, max(abs(args.admin_cell_vertices), 1), args.seed)
+
+        print('Generated: {:,} admin polygons of {:g} degree cells'.format(polygon_count, admin_cell_degrees))
+        print('Admin file path: "%s"' % args.admin_file_path)
+
+
+if __name__ == '__main__':
+    main()
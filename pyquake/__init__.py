@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+# ========================================================================
+#
+# Copyright © 2016 Khepry Quixote
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ========================================================================
+
+"""
+Fetching and reverse-geocoding of ANSS ComCat earthquakes, the scripts
+alongside this package being thin command-line interfaces over it:
+
+- CatalogFetcher: fetches the catalog window by window, into a journaled
+  file or as batches of lines (QuakeRequester.py, QuakePipeline.py)
+- CatalogCounter: counts the catalog's events by window (QuakeRestCounter.py)
+- EventIndex: the on-disk index of a fetched catalog's event ids, keeping
+  the newest version of each event (QuakeRequester.py --dedup)
+- Geocoder: holds the loaded K-D tree and any geocode cache, reverse
+  geocoding batches of rows (GeoCoderRev2.py, QuakePipeline.py)
+- AdminIndex: the R-tree of admin boundary polygons the point-in-polygon
+  engine takes cc, admin1 and admin2 from (--geocode-engine polygon)
+- geocode_csv_file: reverse-geocodes a catalog CSV file (GeoCoderRev2.py)
+- iter_format_rows: parses the service's GeoJSON, QuakeML and text formats
+  into CSV rows as they're read (QuakeRequester.py, GeoCoderRev2.py)
+- Pipeline: runs the fetch, normalize and geocode stages on their own
+  threads (QuakePipeline.py)
+- GeocodeServer: answers reverse-geocoding lookups over HTTP, batching
+  those of concurrent requests (GeoCoderService.py)
+- SyntheticCatalog, StubFdsnServer: a synthetic catalog, and a stand-in
+  for the FDSN event web service serving it (QuakeSynthetic.py,
+  QuakeStubServer.py, QuakeBench.py)
+- Metrics, MetricsReporter, Profiler: the counters, stage times and
+  latency histograms the modules above update, reported as JSON stats
+  lines or Prometheus text, and the scripts' --profile option
+
+The names below are imported from their modules on first use, so that a
+script needing only some of them doesn't pay for loading numpy and scipy;
+the pyarrow and elasticsearch packages are only imported when their output
+is used.
+"""
+
+from importlib import import_module
+
+# each public name, and the module it's imported from
+_exports = {
+    'AdminIndex': 'admin',
+    'load_admin_polygons': 'admin',
+    'GeoCodeCache': 'cache',
+    'CatalogCounter': 'counter',
+    'load_counts_table': 'counter',
+    'save_counts_table': 'counter',
+    'geocode_csv_file': 'csv_geocoder',
+    'EventIndex': 'dedup',
+    'CatalogFetcher': 'fetcher',
+    'WindowJournal': 'fetcher',
+    'comcat_fieldnames': 'formats',
+    'iter_format_rows': 'formats',
+    'Geocoder': 'geocoder',
+    'HttpClient': 'http_client',
+    'RateLimiter': 'http_client',
+    'GeoIndex': 'index',
+    'build_index': 'index',
+    'Metrics': 'metrics',
+    'MetricsReporter': 'metrics',
+    'Profiler': 'metrics',
+    'BatchGeocoder': 'pipeline',
+    'Pipeline': 'pipeline',
+    'RowNormalizer': 'pipeline',
+    'RowTransform': 'rows',
+    'get_magnitude_values': 'rows',
+    'get_out_fieldnames': 'rows',
+    'parse_comcat_dtg': 'rows',
+    'parse_comcat_dtgs': 'rows',
+    'GeocodeServer': 'service',
+    'LookupBatcher': 'service',
+    'StubFdsnServer': 'stub_fdsn',
+    'SyntheticCatalog': 'synthetic',
+    'write_admin_geojson': 'synthetic',
+    'write_catalog_csv': 'synthetic',
+    'get_bbox_tiles': 'windows',
+    'get_next_dates_list': 'windows',
+    'get_next_end_date': 'windows',
+    'get_next_smaller_iteration_type': 'windows',
+    'get_window_end_date': 'windows',
+    'get_window_url': 'windows',
+    'is_in_tile': 'windows',
+    'split_tile': 'windows',
+    'split_window': 'windows',
+}
+
+__all__ = sorted(_exports)
+
+
+def __getattr__(name):
+    if name not in _exports:
+        raise AttributeError('module %r has no attribute %r' % (__name__, name))
+    value = getattr(import_module('.' + _exports[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_exports))
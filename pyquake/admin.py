@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+
+# ========================================================================
+#
+# Copyright © 2016 Khepry Quixote
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ========================================================================
+
+import io
+import math
+import os
+
+import numpy as np
+
+from .formats import iter_json_array
+from .metrics import metrics
+
+# the result values filled from the polygons' properties,
+# and those of a point outside every polygon
+admin_keys = ('cc', 'admin1', 'admin2')
+empty_admin_values = ('', '', '')
+
+# the R-tree's children per node
+default_node_capacity = 16
+
+# points by edges compared at once
+# by the point-in-polygon tests
+max_pip_cells = 1 << 20
+
+
+def get_ring_area(ring):
+    # the signed area of a ring of (x, y) vertices,
+    # negative when they're ordered clockwise
+    x, y = ring[:, 0], ring[:, 1]
+    return 0.5 * float(np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y))
+
+
+def get_property_values(properties, field_names):
+    # a polygon's cc, admin1 and admin2 values
+    # from its properties, missing ones empty
+    values = []
+    for field_name in field_names:
+        value = properties.get(field_name)
+        values.append('' if value is None else str(value).strip())
+    return tuple(values)
+
+
+def iter_geojson_polygons(file_path, field_names):
+    # the (values, parts) of each polygon feature of a GeoJSON
+    # FeatureCollection, each part a list of rings, streamed
+    # rather than loaded whole
+    with io.open(file_path, 'rb') as src_file:
+        for feature in iter_json_array(src_file, 'features'):
+            geometry = feature.get('geometry') or {}
+            if geometry.get('type') == 'Polygon':
+                polygons = [geometry['coordinates']]
+            elif geometry.get('type') == 'MultiPolygon':
+                polygons = geometry['coordinates']
+            else:
+                continue
+            parts = [[np.asarray(ring, dtype='<f8')[:, :2] for ring in polygon if len(ring) > 0] for polygon in polygons]
+            yield get_property_values(feature.get('properties') or {}, field_names), parts
+
+
+def iter_shapefile_polygons(file_path, field_names):
+    # the (values, parts) of each polygon shape of a shapefile,
+    # its rings grouped into parts by their orientation, each
+    # clockwise (outer) ring starting a part its holes follow
+    try:
+        import shapefile
+    except ImportError:
+        raise ImportError('Reading shapefiles requires the pyshp package (pip install pyshp), or convert "%s" to GeoJSON' % file_path)
+    with shapefile.Reader(file_path) as reader:
+        for shape_record in reader.iterShapeRecords():
+            shape = shape_record.shape
+            if shape.shapeType not in (shapefile.POLYGON, shapefile.POLYGONM, shapefile.POLYGONZ) or len(shape.points) == 0:
+                continue
+            points = np.asarray(shape.points, dtype='<f8')[:, :2]
+            bounds = list(shape.parts) + [len(points)]
+            parts = []
+            for bgn, end in zip(bounds[:-1], bounds[1:]):
+                ring = points[bgn:end]
+                if len(parts) == 0 or get_ring_area(ring) < 0:
+                    parts.append([])
+                parts[-1].append(ring)
+            yield get_property_values(shape_record.record.as_dict(), field_names), parts
+
+
+def get_admin_source(file_path, field_names=admin_keys):
+    # identifies the polygons loaded from the file, by its
+    # path, modification time and size, and the fields read,
+    # so geocodes cached from other polygons aren't reused
+    file_stat = os.stat(file_path)
+    return '%s|%d|%d|%s' % (os.path.abspath(file_path), file_stat.st_mtime_ns, file_stat.st_size, ','.join(field_names))
+
+
+def load_admin_polygons(file_path, field_names=admin_keys):
+    """
+    Loads the administrative boundary polygons of a GeoJSON file or, with
+    the pyshp package installed, a shapefile (.shp), returning each
+    polygon's cc, admin1 and admin2 values, read from its field_names
+    properties, and its parts, each a list of rings of (lon, lat) vertices.
+    """
+    if os.path.splitext(file_path)[1].lower() == '.shp':
+        polygons = iter_shapefile_polygons(file_path, field_names)
+    else:
+        polygons = iter_geojson_polygons(file_path, field_names)
+    values_list = []
+    parts_list = []
+    for values, parts in polygons:
+        values_list.append(values)
+        parts_list.append(parts)
+    return values_list, parts_list
+
+
+def get_str_order(bboxes, node_capacity):
+    # the Sort-Tile-Recursive packing order of the bounding
+    # boxes: sorted by their centers' x into vertical slices,
+    # each sorted by their centers' y, so each consecutive
+    # node_capacity of them are near one another
+    centers_x = bboxes[:, 0] + bboxes[:, 2]
+    centers_y = bboxes[:, 1] + bboxes[:, 3]
+    node_count = int(math.ceil(len(bboxes) / float(node_capacity)))
+    slice_size = int(math.ceil(math.sqrt(node_count))) * node_capacity
+    order = np.argsort(centers_x, kind='stable')
+    for bgn in range(0, len(order), slice_size):
+        slice_order = order[bgn:bgn + slice_size]
+        order[bgn:bgn + slice_size] = slice_order[np.argsort(centers_y[slice_order], kind='stable')]
+    return order
+
+
+def pack_nodes(bboxes, node_capacity):
+    # the bounding boxes and child ranges of the
+    # nodes holding consecutive runs of the boxes
+    starts = np.arange(0, len(bboxes), node_capacity)
+    ends = np.minimum(starts + node_capacity, len(bboxes))
+    node_bboxes = np.column_stack((np.minimum.reduceat(bboxes[:, 0], starts),
+                                   np.minimum.reduceat(bboxes[:, 1], starts),
+                                   np.maximum.reduceat(bboxes[:, 2], starts),
+                                   np.maximum.reduceat(bboxes[:, 3], starts)))
+    return node_bboxes, starts, ends
+
+
+class AdminIndex(object):
+    """
+    Point-in-polygon index of administrative boundary polygons, so a point
+    gets the cc, admin1 and admin2 values of the polygon it's inside rather
+    than those of the nearest populated place, which may be across a border
+    or, offshore, anywhere along the coast.
+
+    Each polygon part's bounding box is packed into an R-tree (STR), held as
+    numpy arrays a level at a time.  A batch of points descends it together,
+    as (point, node) pairs, to the parts whose boxes hold them, and each
+    candidate part's edges are ray-cast against its points at once (the
+    even-odd rule, so holes need no special handling).  A point inside more
+    than one polygon gets the first's values, in file order.
+    """
+
+    def __init__(self, values_list, parts_list, node_capacity=default_node_capacity):
+        self.values_list = values_list
+        self.node_capacity = max(node_capacity, 2)
+        # (set by from_file)
+        self.source = None
+
+        # each part's polygon, bounding box and non-horizontal edges
+        # (the only ones a horizontal ray can cross), each edge's
+        # x1, y1, y2 and its x per y, for where a ray crosses it
+        part_polygons = []
+        part_bboxes = []
+        part_edges = []
+        for polygon_number, parts in enumerate(parts_list):
+            for rings in parts:
+                rings = [ring for ring in rings if len(ring) >= 3]
+                if len(rings) == 0:
+                    continue
+                vertices = np.concatenate(rings)
+                part_polygons.append(polygon_number)
+                part_bboxes.append((vertices[:, 0].min(), vertices[:, 1].min(), vertices[:, 0].max(), vertices[:, 1].max()))
+                edges = np.concatenate([np.column_stack((ring, np.roll(ring, -1, axis=0))) for ring in rings])
+                edges = edges[edges[:, 1] != edges[:, 3]]
+                part_edges.append(np.column_stack((edges[:, 0], edges[:, 1], edges[:, 3],
+                                                   (edges[:, 2] - edges[:, 0]) / (edges[:, 3] - edges[:, 1]))))
+
+        self.part_count = len(part_polygons)
+        self.part_polygons = np.asarray(part_polygons, dtype='<i8')
+        self.part_bboxes = np.asarray(part_bboxes, dtype='<f8').reshape(-1, 4)
+        self.edge_offsets = np.zeros(self.part_count + 1, dtype='<i8')
+        self.edge_offsets[1:] = np.cumsum([len(edges) for edges in part_edges])
+        self.edges = np.concatenate(part_edges) if self.part_count > 0 else np.zeros((0, 4), dtype='<f8')
+
+        self.part_order = np.zeros(0, dtype='<i8')
+        self.levels = []
+        if self.part_count > 0:
+            self.build_tree()
+
+    @classmethod
+    def from_file(cls, file_path, field_names=admin_keys, node_capacity=default_node_capacity):
+        values_list, parts_list = load_admin_polygons(file_path, field_names)
+        admin_index = cls(values_list, parts_list, node_capacity)
+        admin_index.source = get_admin_source(file_path, field_names)
+        print('Loaded {:,} admin polygons ({:,} parts, {:,} edges) from: "{}"'.format(
+            len(values_list), admin_index.part_count, len(admin_index.edges), file_path))
+        return admin_index
+
+    def build_tree(self):
+        # the leaves hold runs of the parts in their packing
+        # order, and each level above runs of the one below,
+        # up to a single root node
+        self.part_order = get_str_order(self.part_bboxes, self.node_capacity)
+        level = pack_nodes(self.part_bboxes[self.part_order], self.node_capacity)
+        self.levels = [level]
+        while len(level[0]) > 1:
+            order = get_str_order(level[0], self.node_capacity)
+            self.levels[-1] = level = tuple(array[order] for array in level)
+            level = pack_nodes(level[0], self.node_capacity)
+            self.levels.append(level)
+
+    def get_candidates(self, xs, ys):
+        # the (point, part) pairs of the parts
+        # whose bounding boxes hold the points
+        point_numbers = np.arange(len(xs))
+        node_numbers = np.zeros(len(xs), dtype='<i8')
+        for node_bboxes, starts, ends in reversed(self.levels):
+            bboxes = node_bboxes[node_numbers]
+            inside = (bboxes[:, 0] <= xs[point_numbers]) & (xs[point_numbers] <= bboxes[:, 2]) & \
+                     (bboxes[:, 1] <= ys[point_numbers]) & (ys[point_numbers] <= bboxes[:, 3])
+            point_numbers, node_numbers = point_numbers[inside], node_numbers[inside]
+            # each pair's node expanded into its children
+            counts = ends[node_numbers] - starts[node_numbers]
+            point_numbers = np.repeat(point_numbers, counts)
+            node_numbers = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts - starts[node_numbers], counts)
+        part_numbers = self.part_order[node_numbers]
+        bboxes = self.part_bboxes[part_numbers]
+        inside = (bboxes[:, 0] <= xs[point_numbers]) & (xs[point_numbers] <= bboxes[:, 2]) & \
+                 (bboxes[:, 1] <= ys[point_numbers]) & (ys[point_numbers] <= bboxes[:, 3])
+        return point_numbers[inside], part_numbers[inside]
+
+    def get_inside(self, xs, ys, part_number):
+        # whether each point is inside the part, by how many of
+        # its edges a ray cast east from the point crosses
+        edges = self.edges[self.edge_offsets[part_number]:self.edge_offsets[part_number + 1]]
+        x1, y1, y2, x_per_y = edges[:, 0], edges[:, 1], edges[:, 2], edges[:, 3]
+        inside = np.zeros(len(xs), dtype=bool)
+        chunk_size = max(max_pip_cells // max(len(edges), 1), 1)
+        for bgn in range(0, len(xs), chunk_size):
+            chunk_xs, chunk_ys = xs[bgn:bgn + chunk_size, np.newaxis], ys[bgn:bgn + chunk_size, np.newaxis]
+            # (the edges spanning the point's latitude, half-open so
+            # a vertex is crossed once, and east of the point there)
+            spanning = (y1 > chunk_ys) != (y2 > chunk_ys)
+            crossings = spanning & (chunk_xs < x1 + (chunk_ys - y1) * x_per_y)
+            inside[bgn:bgn + chunk_size] = np.count_nonzero(crossings, axis=1) % 2 == 1
+        return inside
+
+    def query_polygons(self, coordinates_list):
+        # the number of the first polygon each (latitude,
+        # longitude) tuple is inside, -1 for none
+        coordinates = np.asarray(coordinates_list, dtype='<f8').reshape(-1, 2)
+        ys, xs = coordinates[:, 0], coordinates[:, 1]
+        polygon_count = len(self.values_list)
+        polygon_numbers = np.full(len(coordinates), polygon_count, dtype='<i8')
+        if self.part_count > 0 and len(coordinates) > 0:
+            point_numbers, part_numbers = self.get_candidates(xs, ys)
+            # each candidate part's points tested at once
+            order = np.argsort(part_numbers, kind='stable')
+            point_numbers, part_numbers = point_numbers[order], part_numbers[order]
+            unique_parts, bgns = np.unique(part_numbers, return_index=True)
+            ends = np.append(bgns[1:], len(part_numbers))
+            for part_number, bgn, end in zip(unique_parts, bgns, ends):
+                part_points = point_numbers[bgn:end]
+                inside = self.get_inside(xs[part_points], ys[part_points], part_number)
+                np.minimum.at(polygon_numbers, part_points[inside], self.part_polygons[part_number])
+        polygon_numbers[polygon_numbers == polygon_count] = -1
+        return polygon_numbers
+
+    def query(self, coordinates_list):
+        # the cc, admin1 and admin2 values for each (latitude,
+        # longitude) tuple, empty when it's outside every polygon
+        polygon_numbers = self.query_polygons(coordinates_list)
+        inside_count = int(np.count_nonzero(polygon_numbers >= 0))
+        if inside_count > 0:
+            metrics.inc('admin_lookups_total', inside_count, result='inside')
+        if inside_count < len(polygon_numbers):
+            metrics.inc('admin_lookups_total', len(polygon_numbers) - inside_count, result='outside')
+        return [self.values_list[polygon_number] if polygon_number >= 0 else empty_admin_values for polygon_number in polygon_numbers]
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+# ========================================================================
+#
+# Copyright © 2016 Khepry Quixote
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ========================================================================
+
+import os
+import sqlite3
+import threading
+
+from collections import OrderedDict
+
+from .metrics import metrics
+
+# the values cached for each quantized coordinate
+result_keys = ('cc', 'admin1', 'admin2', 'name')
+
+
+class GeoCodeCache(object):
+    """
+    Reverse-geocoding cache keyed by latitude/longitude quantized to a
+    number of decimal places, with an in-memory LRU tier in front of an
+    optional persistent SQLite tier that survives across runs.
+
+    Every coordinate falling into the same quantized cell resolves to the
+    geocoding result of the cell's quantized coordinate, so the output
+    doesn't depend upon which rows happened to be cached first.
+
+    Given a db_source, identifying what the results are geocoded from
+    (e.g. an admin polygon file), the SQLite table remembers it in a
+    companion table and is emptied when it's opened with another.
+    """
+
+    def __init__(self, precision=3, max_entries=100000, db_file_path=None, db_commit_rows=1000, db_table_name='geocodes', db_source=None):
+        self.precision = precision
+        self.scale = 10 ** precision
+        self.max_entries = max(max_entries, 1)
+        self.db_file_path = db_file_path
+        self.db_commit_rows = max(db_commit_rows, 1)
+        # (each geocoding engine's results in a table of their own)
+        self.db_table_name = db_table_name
+        self.db_source = db_source
+
+        self.memory = OrderedDict()
+
+        self.db_conn = None
+        self.db_owner = None
+        self.db_inserts = []
+
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    def get_key(self, latitude, longitude):
+        return int(round(latitude * self.scale)), int(round(longitude * self.scale))
+
+    def get_connection(self):
+        # connections aren't shared across forked processes
+        # or threads, each opening its own on first use
+        if self.db_conn is not None and self.db_owner != (os.getpid(), threading.get_ident()):
+            self.db_conn = None
+        if self.db_conn is None:
+            self.db_conn = sqlite3.connect(self.db_file_path, timeout=60)
+            self.db_conn.execute('PRAGMA journal_mode=WAL')
+            self.db_conn.execute('CREATE TABLE IF NOT EXISTS %s ('
+                                 'precision INTEGER NOT NULL, lat_key INTEGER NOT NULL, lon_key INTEGER NOT NULL, '
+                                 'cc TEXT, admin1 TEXT, admin2 TEXT, name TEXT, '
+                                 'PRIMARY KEY (precision, lat_key, lon_key)) WITHOUT ROWID' % self.db_table_name)
+            self.db_conn.commit()
+            if self.db_source is not None:
+                self.check_source()
+            self.db_owner = (os.getpid(), threading.get_ident())
+        return self.db_conn
+
+    def check_source(self):
+        # empty the table of results geocoded from another
+        # source, locked against other processes doing so
+        source_table_name = self.db_table_name + '_source'
+        self.db_conn.execute('CREATE TABLE IF NOT EXISTS %s (source TEXT NOT NULL)' % source_table_name)
+        self.db_conn.commit()
+        self.db_conn.execute('BEGIN IMMEDIATE')
+        db_row = self.db_conn.execute('SELECT source FROM %s' % source_table_name).fetchone()
+        if db_row is None or db_row[0] != self.db_source:
+            self.db_conn.execute('DELETE FROM %s' % self.db_table_name)
+            self.db_conn.execute('DELETE FROM %s' % source_table_name)
+            self.db_conn.execute('INSERT INTO %s (source) VALUES (?)' % source_table_name, (self.db_source,))
+        self.db_conn.commit()
+
+    def remember(self, key, result):
+        self.memory[key] = result
+        # evict the least recently used entries
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def search(self, coordinates_list, search_function):
+        results = [None] * len(coordinates_list)
+        counts = (self.memory_hits, self.db_hits, self.misses)
+
+        # positions of the coordinates
+        # missing from the memory tier
+        missing = OrderedDict()
+
+        for position, (latitude, longitude) in enumerate(coordinates_list):
+            key = self.get_key(latitude, longitude)
+            result = self.memory.get(key)
+            if result is not None:
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+                results[position] = result
+            else:
+                missing.setdefault(key, []).append(position)
+
+        # look the missing keys up in the persistent tier
+        if len(missing) > 0 and self.db_file_path is not None:
+            db_conn = self.get_connection()
+            for key in list(missing.keys()):
+                db_row = db_conn.execute('SELECT cc, admin1, admin2, name FROM %s WHERE precision = ? AND lat_key = ? AND lon_key = ?' % self.db_table_name,
+                                         (self.precision, key[0], key[1])).fetchone()
+                if db_row is not None:
+                    result = dict(zip(result_keys, db_row))
+                    self.remember(key, result)
+                    for position in missing.pop(key):
+                        self.db_hits += 1
+                        results[position] = result
+
+        # geocode the remaining keys' quantized
+        # coordinates with a single search
+        if len(missing) > 0:
+            keys = list(missing.keys())
+            search_results = search_function([(key[0] / self.scale, key[1] / self.scale) for key in keys])
+            for key, search_result in zip(keys, search_results):
+                result = {result_key: search_result[result_key] for result_key in result_keys}
+                self.remember(key, result)
+                for position in missing[key]:
+                    self.misses += 1
+                    results[position] = result
+                if self.db_file_path is not None:
+                    self.db_inserts.append((self.precision, key[0], key[1]) + tuple(result[result_key] for result_key in result_keys))
+
+            if len(self.db_inserts) >= self.db_commit_rows:
+                self.flush()
+
+        # the batch's lookups, tier by tier
+        for result, before, after in zip(('memory_hit', 'disk_hit', 'miss'), counts, (self.memory_hits, self.db_hits, self.misses)):
+            if after > before:
+                metrics.inc('geocode_cache_lookups_total', after - before, result=result)
+
+        return results
+
+    def flush(self):
+        # write the newly geocoded keys
+        # to the persistent tier
+        if self.db_file_path is not None and len(self.db_inserts) > 0:
+            db_conn = self.get_connection()
+            db_conn.executemany('INSERT OR IGNORE INTO %s (precision, lat_key, lon_key, cc, admin1, admin2, name) VALUES (?, ?, ?, ?, ?, ?, ?)' % self.db_table_name,
+                                self.db_inserts)
+            db_conn.commit()
+            self.db_inserts = []
+
+    def close(self):
+        self.flush()
+        if self.db_conn is not None and self.db_owner == (os.getpid(), threading.get_ident()):
+            self.db_conn.close()
+        self.db_conn = None
+
+    def get_counts(self):
+        return self.memory_hits, self.db_hits, self.misses
+
+    def add_counts(self, counts):
+        # accumulate counts gathered by
+        # another (e.g. worker) process
+        self.memory_hits += counts[0]
+        self.db_hits += counts[1]
+        self.misses += counts[2]
+
+    def get_message(self):
+        return "cache: {:,} memory hits, {:,} disk hits, {:,} misses".format(self.memory_hits, self.db_hits, self.misses)
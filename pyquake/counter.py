@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+# ========================================================================
+#
+# Copyright © 2016 Khepry Quixote
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ========================================================================
+
+import csv
+import io
+import json
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .http_client import HttpClient
+from .metrics import metrics
+
+# the counts table's columns
+counts_fieldnames = ['bgn_date', 'end_date', 'min_magnitude', 'count', 'latency_seconds']
+
+
+def get_counts_key(bgn_date_parm, end_date_parm, min_magnitude):
+    return bgn_date_parm, end_date_parm, float(min_magnitude)
+
+
+def load_counts_table(counts_file_path):
+    # previously obtained counts by window and
+    # magnitude floor, from a JSON or CSV table
+    counts_table = {}
+    if counts_file_path is not None and os.path.exists(counts_file_path):
+        with io.open(counts_file_path, 'r', newline='') as counts_file:
+            if counts_file_path.lower().endswith('.json'):
+                rows = json.load(counts_file)
+            else:
+                rows = list(csv.DictReader(counts_file))
+        for row in rows:
+            counts_row = {'bgn_date': row['bgn_date'],
+                          'end_date': row['end_date'],
+                          'min_magnitude': float(row['min_magnitude']),
+                          'count': int(row['count']),
+                          'latency_seconds': float(row['latency_seconds'])}
+            counts_table[get_counts_key(counts_row['bgn_date'], counts_row['end_date'], counts_row['min_magnitude'])] = counts_row
+    return counts_table
+
+
+def save_counts_table(counts_file_path, counts_table):
+    # written aside and then swapped in,
+    # so an interrupted save loses nothing
+    rows = [counts_table[key] for key in sorted(counts_table.keys())]
+    tmp_file_path = counts_file_path + '.tmp'
+    with io.open(tmp_file_path, 'w', newline='') as counts_file:
+        if counts_file_path.lower().endswith('.json'):
+            json.dump(rows, counts_file, indent=1)
+            counts_file.write('\n')
+        else:
+            csv_writer = csv.DictWriter(counts_file, fieldnames=counts_fieldnames, lineterminator='\n')
+            csv_writer.writeheader()
+            csv_writer.writerows(rows)
+    os.replace(tmp_file_path, counts_file_path)
+
+
+class CatalogCounter(object):
+    """
+    Counts the ANSS ComCat events of date windows via the FDSN event web
+    service's count endpoint, as configured by QuakeRestCounter.py's
+    options, concurrently and under the client's request rate.
+    """
+
+    def __init__(self, args, http_client=None):
+        self.args = args
+        # keep-alive connections,
+        # request rate and retry policy
+        # shared by every count request
+        if http_client is None:
+            http_client = HttpClient(pool_size=args.concurrency,
+                                     connect_timeout=args.connect_timeout,
+                                     read_timeout=args.read_timeout,
+                                     max_retries=args.max_retries,
+                                     backoff_seconds=args.backoff_seconds,
+                                     requests_per_second=args.requests_per_second)
+        self.http_client = http_client
+
+    def get_count_url(self, bgn_date_parm, end_date_parm, min_magnitude):
+        return '%scount?minmagnitude=%g&starttime=%s&endtime=%s' % (self.args.base_url, min_magnitude, bgn_date_parm, end_date_parm)
+
+    def fetch_count(self, bgn_end_date):
+        # the window's counts row, or None when
+        # its count couldn't be obtained
+        url = self.get_count_url(bgn_end_date[0], bgn_end_date[1], self.args.minmagnitude)
+        try:
+            response = self.http_client.get(url)
+            if response.ok:
+                return url, {'bgn_date': bgn_end_date[0],
+                             'end_date': bgn_end_date[1],
+                             'min_magnitude': self.args.minmagnitude,
+                             'count': int(response.content.decode('utf-8').strip()),
+                             # (the response's own latency, not
+                             # the time spent awaiting the rate limit)
+                             'latency_seconds': round(response.elapsed.total_seconds(), 3)}
+            print('Bad response. Got:', response.content.decode('utf-8').strip())
+        except Exception as e:
+            print('Bad response. Got an error code:', e)
+        return url, None
+
+    def count_windows(self, bgn_end_dates_list, counts_table):
+        """
+        Counts the windows not already in the counts table, adding their
+        rows to it, and returns the urls of those that couldn't be counted.
+        """
+        # windows whose counts couldn't be obtained
+        failed_urls = []
+
+        # count the windows not already in the
+        # table concurrently, under the rate limit
+        pending_list = [bgn_end_date for bgn_end_date in bgn_end_dates_list
+                        if get_counts_key(bgn_end_date[0], bgn_end_date[1], self.args.minmagnitude) not in counts_table]
+        print('Counting %d windows, reusing %d' % (len(pending_list), len(bgn_end_dates_list) - len(pending_list)))
+        metrics.inc('windows_counted_total', len(bgn_end_dates_list) - len(pending_list), result='reused')
+
+        with ThreadPoolExecutor(max_workers=max(self.args.concurrency, 1)) as executor:
+            for url, counts_row in executor.map(self.fetch_count, pending_list):
+                if counts_row is None:
+                    failed_urls.append(url)
+                    metrics.inc('windows_counted_total', result='failed')
+                else:
+                    print('%s: %d' % (url, counts_row['count']))
+                    metrics.inc('windows_counted_total', result='counted')
+                    metrics.inc('events_counted_total', counts_row['count'])
+                    counts_table[get_counts_key(counts_row['bgn_date'], counts_row['end_date'], counts_row['min_magnitude'])] = counts_row
+
+        return failed_urls
+
+    def close(self):
+        self.http_client.close()
@@ -0,0 +1,424 @@
+# -*- coding: utf-8 -*-
+
+# ========================================================================
+#
+# Copyright © 2016 Khepry Quixote
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ========================================================================
+
+import csv
+import io
+import locale
+import multiprocessing
+import os
+import shutil
+
+from time import perf_counter, time
+
+from .formats import iter_format_rows
+from .metrics import get_metric_key, metrics
+from .output import RowOutput, open_out_file
+from .rows import RowTransform, get_out_fieldnames
+
+quotemode_choices = ['QUOTE_MINIMAL', 'QUOTE_NONE', 'QUOTE_ALL', 'QUOTE_NONNUMERIC']
+
+# the geocoder the forked shard
+# worker processes inherit
+shard_geocoder = None
+
+
+def delimiter_xlator(delimiter_str):
+    delimiter_val = ','
+
+    if delimiter_str == '\\t' or delimiter_str == '\t':
+        delimiter_val = '\t'
+
+    return delimiter_val
+
+
+def quotemode_xlator(quote_mode_str):
+    quote_mode_val = csv.QUOTE_MINIMAL
+
+    if quote_mode_str.upper() == 'QUOTE_MINIMAL':
+        quote_mode_val = csv.QUOTE_MINIMAL
+    elif quote_mode_str.upper() == 'QUOTE_ALL':
+        quote_mode_val = csv.QUOTE_ALL
+    elif quote_mode_str.upper() == 'QUOTE_NONE':
+        quote_mode_val = csv.QUOTE_NONE
+    elif quote_mode_str.upper() == 'QUOTE_NONNUMERIC':
+        quote_mode_val = csv.QUOTE_NONNUMERIC
+
+    return quote_mode_val
+
+
+def get_progress_message(row_count, bgn_time, messages=()):
+    # ending time hack
+    end_time = time()
+    # compute records/second
+    seconds = end_time - bgn_time
+    if seconds > 0:
+        rcds_per_second = row_count / seconds
+    else:
+        rcds_per_second = 0
+    # the progress message, plus any
+    # cache and indexing messages
+    message = "Processed: {:,} rows in {:,.0f} seconds @ {:,.0f} records/second".format(row_count, seconds, rcds_per_second)
+    for other_message in messages:
+        if other_message is not None:
+            message += ', ' + other_message
+    return message
+
+
+def write_rows(pending_rows, row_output, row_transform, args):
+    # (the source file's first row isn't
+    # output when the header row isn't)
+    if args.out_header_row != 'Y' and len(pending_rows) > 0 and pending_rows[0][0] == 1:
+        pending_rows = pending_rows[1:]
+        metrics.inc('rows_dropped_total', reason='no_header_row')
+    row_output.write_rows(pending_rows, row_transform)
+
+
+# the row counters updated batch by batch
+rows_read_key = get_metric_key('rows_read_total', {})
+rows_invalid_dtg_key = get_metric_key('rows_dropped_total', {'reason': 'invalid_dtg'})
+rows_output_key = get_metric_key('rows_output_total', {})
+
+
+def geocode_batch(src_rows, read_time, row_output, row_transform, geocoder, args):
+    """
+    Normalizes, geocodes and outputs a batch of (row number, source row),
+    read since read_time, timing each step as a stage, and returns the
+    time it finished, i.e. when reading the next batch begins.
+    """
+    transform_time = perf_counter()
+    if len(src_rows) == 0:
+        metrics.add_stage_seconds('read', transform_time - read_time)
+        return transform_time
+
+    pending_rows = []
+    for row_number, src_row in src_rows:
+        # normalize the row, obtaining its coordinates
+        # or None if it's not a valid date-time stamp
+        record = row_transform.get_record(src_row)
+        coordinates = row_transform(record)
+
+        # only output rows with valid DTGs
+        if coordinates is not None:
+            pending_rows.append((row_number, record, coordinates))
+
+    geocode_time = perf_counter()
+    geocoder.geocode_rows(pending_rows, row_transform)
+
+    write_time = perf_counter()
+    out_count = row_output.out_count
+    write_rows(pending_rows, row_output, row_transform, args)
+
+    # (recorded at once, costing little
+    # even when a batch is a single row)
+    end_time = perf_counter()
+    metrics.add_batch((('read', transform_time - read_time),
+                       ('transform', geocode_time - transform_time),
+                       ('geocode', write_time - geocode_time),
+                       ('write', end_time - write_time)),
+                      ((rows_read_key, len(src_rows)),
+                       (rows_invalid_dtg_key, len(src_rows) - len(pending_rows)),
+                       (rows_output_key, row_output.out_count - out_count)))
+    return end_time
+
+
+def get_shard_ranges(src_file_path, data_offset, shard_count):
+    shard_ranges = []
+
+    # split the data portion of the source file
+    # into roughly equal byte ranges, each range
+    # ending on a line boundary (ComCat CSV rows
+    # never contain embedded line breaks)
+    file_size = os.path.getsize(src_file_path)
+    shard_size = max((file_size - data_offset) // max(shard_count, 1), 1)
+
+    with io.open(src_file_path, 'rb') as src_file:
+        bgn_offset = data_offset
+        while bgn_offset < file_size:
+            end_offset = bgn_offset + shard_size
+            if end_offset < file_size:
+                # advance to the end of the line
+                # holding the last byte of the range
+                src_file.seek(end_offset - 1)
+                src_file.readline()
+                end_offset = src_file.tell()
+            else:
+                end_offset = file_size
+            shard_ranges.append((bgn_offset, end_offset))
+            bgn_offset = end_offset
+
+    return shard_ranges
+
+
+def read_shard_lines(src_file_path, bgn_offset, end_offset, encoding):
+    # yield the decoded lines
+    # within the byte range
+    with io.open(src_file_path, 'rb') as src_file:
+        src_file.seek(bgn_offset)
+        while src_file.tell() < end_offset:
+            line = src_file.readline()
+            if not line:
+                break
+            yield line.decode(encoding)
+
+
+def geocode_shard(shard):
+    shard_index, bgn_offset, end_offset, row_transform, shard_file_path, encoding, args = shard
+
+    geocoder = shard_geocoder
+    geocode_cache = geocoder.geocode_cache
+
+    # this process's metrics are its shard's,
+    # merged by the parent into its own
+    metrics.reset()
+
+    row_count = 0
+
+    # this process's cache counts before the shard
+    if geocode_cache is not None:
+        bgn_cache_counts = geocode_cache.get_counts()
+
+    # open the shard's target file for writing
+    with open_out_file(shard_file_path, encoding, args) as shard_file:
+
+        # the shard's lines are parsed exactly
+        # as the single-process reader parses them
+        csv_reader = csv.reader(read_shard_lines(args.src_file_path, bgn_offset, end_offset, encoding),
+                                delimiter=args.src_delimiter, quotechar=args.src_quotechar, quoting=args.src_quotemode_enm)
+        row_output = RowOutput(shard_file, row_transform.fieldnames, args, write_header=False)
+
+        # rows awaiting a batched geocoding pass
+        src_rows = []
+        read_time = perf_counter()
+
+        # reader row-by-row
+        for src_row in csv_reader:
+
+            # skip blank lines
+            if not src_row:
+                continue
+
+            row_count += 1
+
+            # only the very first shard holds the
+            # source file's first row, every other
+            # shard's rows are numbered after it
+            src_rows.append((row_count if shard_index == 0 else row_count + 1, src_row))
+
+            # if the batch is full, geocode and output it
+            if len(src_rows) >= args.batch_rows:
+                read_time = geocode_batch(src_rows, read_time, row_output, row_transform, geocoder, args)
+                src_rows.clear()
+
+        # geocode and output
+        # any remaining rows
+        geocode_batch(src_rows, read_time, row_output, row_transform, geocoder, args)
+        src_rows.clear()
+
+        row_output.close()
+
+    # persist the newly cached geocodes and
+    # report the cache counts for this shard
+    cache_counts = None
+    if geocode_cache is not None:
+        geocode_cache.flush()
+        cache_counts = [end - bgn for bgn, end in zip(bgn_cache_counts, geocode_cache.get_counts())]
+
+    return shard_file_path, row_count, row_output.out_count, cache_counts, metrics.snapshot()
+
+
+def geocode_shards(row_transform, out_file, row_output, bgn_time, geocoder, args):
+    global shard_geocoder
+
+    row_count = 0
+    out_count = 0
+
+    # the source file's encoding, as used by io.open
+    encoding = locale.getpreferredencoding(False)
+
+    # skip over the header line
+    # to find the first data byte
+    with io.open(args.src_file_path, 'rb') as src_file:
+        src_file.readline()
+        data_offset = src_file.tell()
+
+    # several shards per worker so that
+    # a slow shard doesn't idle the pool
+    shard_ranges = get_shard_ranges(args.src_file_path, data_offset, args.workers * 4)
+    shards = [(shard_index, bgn_offset, end_offset, row_transform, '%s.shard%04d' % (args.out_file_path, shard_index), encoding, args)
+              for shard_index, (bgn_offset, end_offset) in enumerate(shard_ranges)]
+
+    # load the K-D tree once, before the pool is
+    # forked, so that every worker process shares
+    # its pages copy-on-write rather than rebuilding it
+    geocoder.warm()
+    shard_geocoder = geocoder
+
+    # flush the header row before
+    # appending the shards' output
+    out_file.flush()
+
+    with multiprocessing.get_context('fork').Pool(processes=args.workers) as pool:
+
+        # shard results are merged back
+        # in original source row order
+        for shard_file_path, shard_row_count, shard_out_count, cache_counts, shard_metrics in pool.imap(geocode_shard, shards):
+
+            if args.out_format == 'parquet':
+                row_output.row_writer.write_file(shard_file_path)
+            else:
+                with io.open(shard_file_path, 'r', newline='', encoding=encoding) as shard_file:
+                    shutil.copyfileobj(shard_file, out_file)
+            os.remove(shard_file_path)
+
+            row_count += shard_row_count
+            out_count += shard_out_count
+            if cache_counts is not None:
+                geocoder.geocode_cache.add_counts(cache_counts)
+            metrics.merge(shard_metrics)
+
+            # flush accumulated
+            # rows to target file
+            out_file.flush()
+
+            # output progress message
+            print(get_progress_message(row_count, bgn_time, (geocoder.get_message(),)))
+
+    shard_geocoder = None
+    row_output.out_count += out_count
+
+    return row_count
+
+
+def open_src_rows(args):
+    # the source file, and a CSV file reader over it, or
+    # the rows parsed from one of the other FDSN formats,
+    # the CSV format's header row first
+    src_format = getattr(args, 'src_format', 'csv')
+    if src_format == 'csv':
+        src_file = io.open(args.src_file_path, 'r', newline='')
+        return src_file, csv.reader(src_file, delimiter=args.src_delimiter, quotechar=args.src_quotechar, quoting=args.src_quotemode_enm)
+    src_file = io.open(args.src_file_path, 'rb')
+    return src_file, iter_format_rows(src_file, src_format)
+
+
+def geocode_csv_file(args, geocoder, es=None):
+    """
+    Reverse-geocodes the ANSS ComCat-formatted CSV file args.src_file_path
+    (or QuakeML, GeoJSON or text file, as args.src_format has it)
+    into args.out_file_path, and into a fresh ElasticSearch index given a
+    client, returning the source rows read and the row output, whose
+    finish swaps the index's alias once it's loaded.
+    """
+    row_count = 0
+
+    # open the target file for writing
+    with open_out_file(args.out_file_path, None, args) as out_file:
+
+        # open the source file for reading,
+        # and a CSV file reader object
+        src_file, csv_reader = open_src_rows(args)
+        with src_file:
+
+            # obtain the field names from
+            # the first line of the source file
+            src_fieldnames = next(csv_reader, [])
+
+            # rename some and append various
+            # deriviative fields to field names list
+            fieldnames = get_out_fieldnames(src_fieldnames)
+
+            # resolve the column positions once,
+            # rows being handled as positional lists
+            row_transform = RowTransform(fieldnames, len(src_fieldnames), args)
+
+            # the CSV (or Parquet) writer,
+            # and any ElasticSearch load index
+            row_output = RowOutput(out_file, fieldnames, args, es)
+
+            # a failed load's index is deleted
+            try:
+                # beginning time hack
+                bgn_time = time()
+
+                # geocode shards of the source
+                # file across multiple processes
+                if args.workers > 1:
+                    row_count = geocode_shards(row_transform, out_file, row_output, bgn_time, geocoder, args)
+
+                else:
+
+                    # rows awaiting a batched geocoding pass,
+                    # the time taken to read them being the
+                    # time passed since the last batch's pass
+                    src_rows = []
+                    read_time = perf_counter()
+
+                    # reader row-by-row
+                    for src_row in csv_reader:
+
+                        # skip blank lines
+                        if not src_row:
+                            continue
+
+                        row_count += 1
+                        src_rows.append((row_count, src_row))
+
+                        # if the batch is full, geocode and output it
+                        if len(src_rows) >= args.batch_rows:
+                            read_time = geocode_batch(src_rows, read_time, row_output, row_transform, geocoder, args)
+                            src_rows.clear()
+
+                        # if row count equals or exceeds max rows
+                        if args.max_rows > 0 and row_count >= args.max_rows:
+                            # break out of reading loop
+                            break
+
+                        # if row count is modulus
+                        # of the flush count value
+                        if row_count % args.flush_rows == 0:
+
+                            # geocode and output
+                            # any partial batch
+                            read_time = geocode_batch(src_rows, read_time, row_output, row_transform, geocoder, args)
+                            src_rows.clear()
+
+                            # flush accumulated
+                            # rows to target file
+                            with metrics.stage('write'):
+                                out_file.flush()
+
+                            # output progress message
+                            print(get_progress_message(row_count, bgn_time, (geocoder.get_message(), row_output.get_message())))
+                            read_time = perf_counter()
+
+                    # geocode and output
+                    # any remaining rows
+                    geocode_batch(src_rows, read_time, row_output, row_transform, geocoder, args)
+                    src_rows.clear()
+
+            except BaseException:
+                row_output.abort()
+                raise
+
+            # write the last row group
+            # and the Parquet footer
+            row_output.close()
+
+    return row_count, row_output
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+
+# ========================================================================
+#
+# Copyright © 2016 Khepry Quixote
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ========================================================================
+
+import csv
+import hashlib
+import io
+import os
+import sqlite3
+
+from .metrics import metrics
+
+
+class EventIndex(object):
+    """
+    On-disk index of the event ids in a catalog file being fetched, kept in
+    an SQLite file next to it, so that a catalog of tens of millions of
+    events is deduplicated within the fixed memory of SQLite's page cache
+    rather than that of a dict of every id.
+
+    Each window's rows are looked up a batch at a time as they stream in:
+    a row of an event already in the file is dropped, unless its updated
+    time is newer, in which case the row already in the file is marked as
+    superseded, to be removed once the fetch is complete (compact).  Rows
+    are identified by their number among the file's rows, and the index is
+    committed along with each window's journal entry, being rebuilt from
+    the file when the two don't match.
+    """
+
+    def __init__(self, index_file_name, cache_mb=64, batch_rows=500):
+        self.index_file_name = index_file_name
+        self.cache_mb = max(cache_mb, 1)
+        # (within SQLite's limit on query parameters)
+        self.batch_rows = min(max(batch_rows, 1), 500)
+
+        self.db_conn = None
+
+        # the rows in the file, as committed
+        # and with the current window's
+        self.committed_row_count = 0
+        self.row_count = 0
+
+        # the current window's counts
+        self.window_dropped_count = 0
+        self.window_superseded_count = 0
+
+        self.dropped_count = 0
+        self.superseded_count = 0
+        self.removed_count = 0
+
+    def open(self, tgt_file_name, offset):
+        # the index as of the target file's first offset
+        # bytes, reused when it was committed at just that
+        # offset, otherwise rebuilt from the file's rows
+        self.db_conn = sqlite3.connect(self.index_file_name)
+        self.db_conn.execute('PRAGMA journal_mode=WAL')
+        self.db_conn.execute('PRAGMA synchronous=NORMAL')
+        self.db_conn.execute('PRAGMA cache_size=%d' % -(self.cache_mb * 1024))
+        self.db_conn.execute('CREATE TABLE IF NOT EXISTS events ('
+                             'id TEXT PRIMARY KEY, updated TEXT NOT NULL, row_number INTEGER NOT NULL) WITHOUT ROWID')
+        self.db_conn.execute('CREATE TABLE IF NOT EXISTS superseded (row_number INTEGER PRIMARY KEY)')
+        self.db_conn.execute('CREATE TABLE IF NOT EXISTS state (name TEXT PRIMARY KEY, value INTEGER NOT NULL) WITHOUT ROWID')
+        self.db_conn.commit()
+
+        state = dict(self.db_conn.execute('SELECT name, value FROM state'))
+        if offset > 0 and state.get('offset') == offset:
+            self.row_count = self.committed_row_count = state['rows']
+            self.superseded_count = self.db_conn.execute('SELECT COUNT(*) FROM superseded').fetchone()[0]
+            print('Reusing the index of {:,} rows: {}'.format(self.row_count, self.index_file_name))
+        else:
+            self.rebuild(tgt_file_name, offset)
+
+    def rebuild(self, tgt_file_name, offset):
+        self.db_conn.execute('DELETE FROM events')
+        self.db_conn.execute('DELETE FROM superseded')
+        self.row_count = self.committed_row_count = 0
+        self.superseded_count = 0
+        if offset > 0:
+            print('Indexing the event ids of the target file: %s' % tgt_file_name)
+            with io.open(tgt_file_name, 'rb') as tgt_file:
+                for line in self.iter_new_lines(tgt_file, True):
+                    pass
+        self.commit(offset)
+
+    def get_known_rows(self, event_ids):
+        # the updated time and row number of
+        # each of the ids already in the index
+        known_rows = {}
+        for position in range(0, len(event_ids), self.batch_rows):
+            batch_ids = event_ids[position:position + self.batch_rows]
+            for event_id, updated, row_number in self.db_conn.execute(
+                    'SELECT id, updated, row_number FROM events WHERE id IN (%s)' % ','.join('?' * len(batch_ids)), batch_ids):
+                known_rows[event_id] = (updated, row_number)
+        return known_rows
+
+    def index_batch(self, batch, in_file):
+        # index a batch of (line, id, updated) rows, returning
+        # the lines to write, those of the rows already in the
+        # file (in_file) numbered and superseded as needed
+        known_rows = self.get_known_rows(list({event_id for line, event_id, updated in batch}))
+        new_lines = []
+        upserts = {}
+        superseded = []
+        for line, event_id, updated in batch:
+            known_row = known_rows.get(event_id)
+            if known_row is not None and updated <= known_row[0]:
+                # the same or an older version
+                # of an event already in the file
+                if in_file:
+                    superseded.append(self.row_count)
+                    self.row_count += 1
+                else:
+                    self.window_dropped_count += 1
+                continue
+            if known_row is not None:
+                superseded.append(known_row[1])
+            known_rows[event_id] = (updated, self.row_count)
+            upserts[event_id] = (event_id, updated, self.row_count)
+            self.row_count += 1
+            new_lines.append(line)
+        self.db_conn.executemany('INSERT OR REPLACE INTO events (id, updated, row_number) VALUES (?, ?, ?)', upserts.values())
+        if len(superseded) > 0:
+            self.db_conn.executemany('INSERT OR IGNORE INTO superseded (row_number) VALUES (?)', [(row_number,) for row_number in superseded])
+            self.window_superseded_count += len(superseded)
+        return new_lines
+
+    def iter_new_lines(self, lines, in_file=False):
+        """
+        Yields a window's CSV lines, the header line first, without those
+        of the events already in the file in the same or a newer version,
+        indexing the rest as the file's next rows.
+        """
+        id_index = None
+        batch = []
+        for line in lines:
+            if line.strip() == b'':
+                continue
+            row = next(csv.reader([line.decode('utf-8')]))
+            if id_index is None:
+                id_index, updated_index = row.index('id'), row.index('updated')
+                yield line
+                continue
+            batch.append((line, row[id_index], row[updated_index] if len(row) > updated_index else ''))
+            if len(batch) >= self.batch_rows:
+                for new_line in self.index_batch(batch, in_file):
+                    yield new_line
+                batch = []
+        if len(batch) > 0:
+            for new_line in self.index_batch(batch, in_file):
+                yield new_line
+
+    def commit(self, offset):
+        # commit the window's rows, as of the target
+        # file's offset, returning its counts
+        self.db_conn.executemany('INSERT OR REPLACE INTO state (name, value) VALUES (?, ?)',
+                                 [('offset', offset), ('rows', self.row_count)])
+        self.db_conn.commit()
+        self.committed_row_count = self.row_count
+        counts = self.window_dropped_count, self.window_superseded_count
+        if counts[0] > 0:
+            metrics.inc('rows_dropped_total', counts[0], reason='duplicate')
+        if counts[1] > 0:
+            metrics.inc('rows_superseded_total', counts[1])
+        self.dropped_count += counts[0]
+        self.superseded_count += counts[1]
+        self.window_dropped_count = self.window_superseded_count = 0
+        return counts
+
+    def rollback(self):
+        # forget a window that wasn't written whole
+        self.db_conn.rollback()
+        self.row_count = self.committed_row_count
+        self.window_dropped_count = self.window_superseded_count = 0
+
+    def compact(self, tgt_file_name, journal_entries):
+        """
+        Rewrites the target file without its superseded rows, a line at a
+        time, returning the journal entries with their offsets, row counts
+        and SHA-1s updated to match, and rebuilds the index from it.
+        """
+        superseded_cursor = self.db_conn.execute('SELECT row_number FROM superseded ORDER BY row_number')
+        superseded = (row[0] for row in superseded_cursor)
+        next_superseded = next(superseded, None)
+
+        entries = [dict(entry) for entry in journal_entries]
+        entry_index = 0
+        sha1 = hashlib.sha1()
+        removed_count = 0
+        offset = 0
+        bgn_offset = new_offset = 0
+
+        compacted_file_name = tgt_file_name + '.compacted'
+        with io.open(tgt_file_name, 'rb') as tgt_file, io.open(compacted_file_name, 'wb') as compacted_file:
+            line_number = 0
+            while True:
+                # the journal entries ending here
+                while entry_index < len(entries) and entries[entry_index]['offset'] <= offset:
+                    entry = entries[entry_index]
+                    entry['bgn_offset'], entry['offset'], entry['sha1'] = bgn_offset, new_offset, sha1.hexdigest()
+                    entry['rows'] -= removed_count
+                    bgn_offset = new_offset
+                    sha1 = hashlib.sha1()
+                    removed_count = 0
+                    entry_index += 1
+                line = tgt_file.readline()
+                if line == b'':
+                    break
+                offset += len(line)
+                # (the first line being the header)
+                if line_number > 0 and line_number - 1 == next_superseded:
+                    next_superseded = next(superseded, None)
+                    removed_count += 1
+                else:
+                    compacted_file.write(line)
+                    sha1.update(line)
+                    new_offset += len(line)
+                line_number += 1
+        superseded_cursor.close()
+
+        os.replace(compacted_file_name, tgt_file_name)
+        print('Removed {:,} superseded rows: {}'.format(self.superseded_count, tgt_file_name))
+        self.removed_count += self.superseded_count
+        self.rebuild(tgt_file_name, new_offset)
+        return entries
+
+    def close(self):
+        if self.db_conn is not None:
+            self.db_conn.close()
+            self.db_conn = None
+
+    def get_message(self):
+        return 'ids: {:,} rows indexed, {:,} duplicates dropped, {:,} rows superseded by newer versions removed'.format(
+            self.row_count, self.dropped_count, self.removed_count)
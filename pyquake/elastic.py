@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+
+# ========================================================================
+#
+# Copyright © 2016 Khepry Quixote
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ========================================================================
+
+import json
+import queue
+import random
+import re
+import sys
+import threading
+
+from datetime import datetime
+from time import sleep, time
+
+from .metrics import metrics
+
+# bulk item statuses worth retrying,
+# the cluster being (briefly) overloaded
+retry_statuses = (429, 503)
+
+# field types of the quake mapping,
+# any other field is a keyword
+quake_field_types = {
+    'latitude': 'float',
+    'longitude': 'float',
+    'depth': 'float',
+    'mag': 'float',
+    'gap': 'float',
+    'dmin': 'float',
+    'rms': 'float',
+    'horizontalError': 'float',
+    'depthError': 'float',
+    'magError': 'float',
+    'nst': 'integer',
+    'magNst': 'integer',
+    'Event_Year': 'short',
+    'Event_Month': 'byte',
+    'Event_Day': 'byte',
+    'Event_Hour': 'byte',
+    'Event_Min': 'byte',
+    'Event_Sec': 'byte',
+    'magInt': 'byte',
+}
+for mag_bin in range(10):
+    quake_field_types['mag%d' % mag_bin] = 'byte'
+
+# the timestamp suffix of
+# create_load_index's names
+load_index_suffix_pattern = re.compile(r'-\d{20}$')
+
+
+def get_quake_mapping(fieldnames, ymd_separator='-'):
+    # explicit mapping of the geocoded catalog's fields,
+    # plus the geo_point location built from its coordinates
+    date_format = 'yyyy{0}MM{0}dd HH:mm:ss||strict_date_optional_time'.format(ymd_separator)
+    properties = {'location': {'type': 'geo_point'}}
+    for fieldname in fieldnames:
+        if fieldname in ('Event_DTG', 'Updated_DTG'):
+            properties[fieldname] = {'type': 'date', 'format': date_format}
+        elif fieldname == 'place':
+            properties[fieldname] = {'type': 'text', 'fields': {'keyword': {'type': 'keyword', 'ignore_above': 256}}}
+        else:
+            properties[fieldname] = {'type': quake_field_types.get(fieldname, 'keyword')}
+    return {'dynamic': False, 'properties': properties}
+
+
+def get_quake_doc(source, latitude, longitude, null_value=None):
+    # empty values are nulls (ignored by the
+    # mapping), plus the point for geo queries
+    doc = {fieldname: (null_value if value == '' else value) for fieldname, value in source.items()}
+    doc['location'] = {'lat': latitude, 'lon': longitude}
+    return doc
+
+
+def create_load_index(es, alias_name, fieldnames, ymd_separator='-'):
+    """
+    Creates a fresh, versioned index to be loaded and then swapped in
+    behind the alias, with settings favouring the bulk load: no refreshes
+    and no replicas until finish_load_index restores them.
+    """
+    index_name = '%s-%s' % (alias_name, datetime.utcnow().strftime('%Y%m%d%H%M%S%f'))
+    es.indices.create(index=index_name, body={
+        'settings': {'index': {'number_of_replicas': 0,
+                               'refresh_interval': '-1',
+                               'mapping': {'ignore_malformed': True}}},
+        'mappings': get_quake_mapping(fieldnames, ymd_separator)})
+    return index_name
+
+
+def get_load_index_names(es, alias_name):
+    # the versioned indices created for the alias,
+    # whether or not the alias points at them
+    index_names = es.indices.get_alias(index='%s-*' % alias_name).keys()
+    return sorted(index_name for index_name in index_names
+                  if load_index_suffix_pattern.match(index_name[len(alias_name):]))
+
+
+def finish_load_index(es, index_name, alias_name, replicas=1, refresh_interval='1s', keep_old_indices=False):
+    """
+    Restores the loaded index's settings, refreshes it and atomically
+    points the alias at it, returning the indices the alias was moved
+    from (which are deleted unless they're kept).  Unless they're kept,
+    the alias's other load indices, left by loads that failed, are
+    deleted too, loads behind one alias not being run at the same time.
+    """
+    es.indices.put_settings(index=index_name, body={'index': {'number_of_replicas': replicas,
+                                                              'refresh_interval': refresh_interval}})
+    es.indices.refresh(index=index_name)
+
+    actions = [{'add': {'index': index_name, 'alias': alias_name}}]
+    old_index_names = []
+    if es.indices.exists_alias(name=alias_name):
+        old_index_names = sorted(es.indices.get_alias(name=alias_name).keys())
+        for old_index_name in old_index_names:
+            actions.append({'remove': {'index': old_index_name, 'alias': alias_name}})
+    elif es.indices.exists(index=alias_name):
+        # a concrete index of the alias's name, as loaded
+        # by earlier versions, is replaced in the same step
+        actions.append({'remove_index': {'index': alias_name}})
+    es.indices.update_aliases(body={'actions': actions})
+
+    if not keep_old_indices:
+        for old_index_name in old_index_names:
+            es.indices.delete(index=old_index_name, ignore=[404])
+        for stale_index_name in get_load_index_names(es, alias_name):
+            if stale_index_name != index_name and stale_index_name not in old_index_names:
+                es.indices.delete(index=stale_index_name, ignore=[404])
+    return old_index_names
+
+
+class BulkIndexer(object):
+    """
+    Streaming ElasticSearch bulk indexer.
+
+    Documents are serialized once as they are added and gathered into
+    chunks bounded by both a document count and a byte size.  Full chunks
+    go onto a bounded queue drained by a few threads, each sending bulk
+    requests, so geocoding carries on while requests are in flight and
+    blocks only when the queue is full.  Documents rejected as too many
+    requests (429) and chunks failing outright are retried with
+    exponential backoff, and every chunk's throughput is tallied.
+
+    Only the client's bulk(body=...) method is used, so any stand-in
+    providing it, e.g. a mock transport, can be indexed into.
+    """
+
+    def __init__(self, es, index_name, chunk_docs=500, chunk_bytes=5 * 1024 * 1024, threads=2, queue_size=4,
+                 max_retries=3, backoff_seconds=1.0):
+        self.es = es
+        self.index_name = index_name
+        self.chunk_docs = max(chunk_docs, 1)
+        self.chunk_bytes = max(chunk_bytes, 1)
+        self.max_retries = max(max_retries, 0)
+        self.backoff_seconds = backoff_seconds
+
+        self.chunk = []
+        self.chunk_size = 0
+
+        self.chunks = queue.Queue(maxsize=max(queue_size, 1))
+        self.lock = threading.Lock()
+        self.exceptions = []
+
+        self.docs = 0
+        self.indexed_docs = 0
+        self.indexed_bytes = 0
+        self.batches = 0
+        self.retried_docs = 0
+        self.failed_docs = 0
+        self.bulk_seconds = 0.0
+        self.last_batch = None
+        self.bgn_time = time()
+
+        self.threads = [threading.Thread(target=self.run, name='BulkIndexer-%d' % thread_number, daemon=True)
+                        for thread_number in range(max(threads, 1))]
+        for thread in self.threads:
+            thread.start()
+
+    def get_action(self, doc_id, source):
+        # the bulk action and source lines
+        action = {'index': {'_index': self.index_name, '_id': doc_id}}
+        return (json.dumps(action) + '\n' + json.dumps(source) + '\n').encode('utf-8')
+
+    def add(self, doc_id, source):
+        if len(self.exceptions) > 0:
+            raise RuntimeError('Bulk indexing failed: %s' % self.exceptions[0])
+        action = self.get_action(doc_id, source)
+        # start another chunk if this
+        # document would overflow its bytes
+        if len(self.chunk) > 0 and self.chunk_size + len(action) > self.chunk_bytes:
+            self.flush()
+        self.chunk.append(action)
+        self.chunk_size += len(action)
+        self.docs += 1
+        if len(self.chunk) >= self.chunk_docs:
+            self.flush()
+
+    def flush(self):
+        # hand the chunk to the threads, waiting
+        # for room on the queue when it's full
+        if len(self.chunk) > 0:
+            self.chunks.put(self.chunk)
+            self.chunk = []
+            self.chunk_size = 0
+
+    def run(self):
+        while True:
+            chunk = self.chunks.get()
+            try:
+                if chunk is None:
+                    return
+                self.index_chunk(chunk)
+            except Exception as e:
+                with self.lock:
+                    self.exceptions.append(e)
+            finally:
+                self.chunks.task_done()
+
+    def backoff(self, attempt):
+        sleep(random.uniform(0, self.backoff_seconds * 2 ** attempt))
+
+    def index_chunk(self, chunk):
+        attempt = 0
+        while len(chunk) > 0:
+            body = b''.join(chunk)
+            bgn_time = time()
+            try:
+                response = self.es.bulk(body=body)
+            except Exception as e:
+                # the whole request failed,
+                # retried unless out of attempts
+                metrics.inc('es_bulk_requests_total', outcome='failed')
+                if attempt >= self.max_retries:
+                    raise
+                sys.stderr.write('Retrying bulk request after an error: %s\n' % e)
+                self.backoff(attempt)
+                attempt += 1
+                continue
+            seconds = time() - bgn_time
+
+            # the documents rejected for
+            # now are retried, any others fail
+            retry_chunk = []
+            failed_docs = 0
+            for action, item in zip(chunk, response.get('items', [])):
+                result = next(iter(item.values()))
+                status = result.get('status', 200)
+                if status < 300:
+                    continue
+                if status in retry_statuses and attempt < self.max_retries:
+                    retry_chunk.append(action)
+                else:
+                    failed_docs += 1
+                    if self.failed_docs + failed_docs <= 10:
+                        sys.stderr.write('Failed to index document: %s\n' % json.dumps(result.get('error', result)))
+
+            with self.lock:
+                indexed_docs = len(chunk) - len(retry_chunk) - failed_docs
+                self.indexed_docs += indexed_docs
+                self.indexed_bytes += len(body)
+                self.retried_docs += len(retry_chunk)
+                self.failed_docs += failed_docs
+                self.batches += 1
+                self.bulk_seconds += seconds
+                self.last_batch = (indexed_docs, len(body), seconds)
+            metrics.observe('es_bulk_request_seconds', seconds)
+            metrics.inc('es_bulk_requests_total', outcome='ok')
+            metrics.inc('es_bytes_total', len(body))
+            for result, doc_count in (('indexed', indexed_docs), ('retried', len(retry_chunk)), ('failed', failed_docs)):
+                if doc_count > 0:
+                    metrics.inc('es_docs_total', doc_count, result=result)
+
+            if len(retry_chunk) > 0:
+                self.backoff(attempt)
+                attempt += 1
+            chunk = retry_chunk
+
+    def abort(self):
+        # drop the documents not yet sent and
+        # wait for the requests in flight
+        self.chunk = []
+        self.chunk_size = 0
+        while True:
+            try:
+                self.chunks.get_nowait()
+            except queue.Empty:
+                break
+            self.chunks.task_done()
+        for thread in self.threads:
+            if thread.is_alive():
+                self.chunks.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def close(self):
+        # index the last chunk and
+        # wait for the threads to finish
+        self.flush()
+        for _ in self.threads:
+            self.chunks.put(None)
+        for thread in self.threads:
+            thread.join()
+        if len(self.exceptions) > 0:
+            raise RuntimeError('Bulk indexing failed: %s' % self.exceptions[0])
+
+    def get_message(self):
+        seconds = time() - self.bgn_time
+        message = "indexed: {:,} of {:,} docs in {:,} batches @ {:,.0f} docs/second, {:,} retried, {:,} failed".format(
+            self.indexed_docs, self.docs, self.batches, self.indexed_docs / seconds if seconds > 0 else 0, self.retried_docs, self.failed_docs)
+        if self.last_batch is not None:
+            docs, body_bytes, batch_seconds = self.last_batch
+            message += ", last batch {:,} docs, {:,} bytes in {:,.3f} seconds".format(docs, body_bytes, batch_seconds)
+        return message
@@ -0,0 +1,842 @@
+# -*- coding: utf-8 -*-
+
+# ========================================================================
+#
+# Copyright © 2016 Khepry Quixote
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ========================================================================
+
+import csv
+import hashlib
+import io
+import json
+import os
+import tempfile
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from datetime import datetime, timedelta
+from time import sleep, time
+
+from .dedup import EventIndex
+from .formats import iter_csv_lines, iter_format_rows
+from .http_client import HttpClient
+from .metrics import metrics
+from .windows import get_bbox_tiles, get_next_smaller_iteration_type, get_service_url, get_window_end_date, get_window_url, is_in_tile, \
+    max_rows_per_query, split_tile, split_window, world_bbox
+
+
+def save_window_plan(plan_file_path, planned_windows):
+    # each window's dates and count,
+    # plus the bounding box of a tile
+    with io.open(plan_file_path, 'w') as plan_file:
+        json.dump([[window_bgn_date.strftime('%Y-%m-%d'), window_end_date.strftime('%Y-%m-%d'), count] + ([list(bbox)] if bbox is not None else [])
+                   for window_bgn_date, window_end_date, count, bbox in planned_windows], plan_file, indent=1)
+
+
+def load_window_plan(plan_file_path):
+    # (plans saved before windows were
+    # tiled have no bounding boxes)
+    with io.open(plan_file_path, 'r') as plan_file:
+        return [(datetime.strptime(window[0], '%Y-%m-%d'), datetime.strptime(window[1], '%Y-%m-%d'), window[2],
+                 tuple(window[3]) if len(window) > 3 else None)
+                for window in json.load(plan_file)]
+
+
+class WindowJournal(object):
+    """
+    Checkpoint journal kept next to the target file, one JSON line per
+    completed window recording its date range, iteration type, row count,
+    byte offsets within the target file and the SHA-1 of its bytes.  A
+    tiled window has a line per tile, with its bounding box and whether
+    it's the window's last tile, a window being resumed from only once
+    all of its tiles are complete.
+    """
+
+    def __init__(self, tgt_file_name):
+        self.tgt_file_name = tgt_file_name
+        self.journal_file_name = tgt_file_name + '.journal'
+        self.journal_file = None
+        self.entries = []
+        # the day the next window ought to begin
+        self.next_date = None
+
+    def load(self):
+        # the journal's entries, up to the last
+        # one whose bytes are intact in the target
+        entries = []
+        if os.path.exists(self.journal_file_name) and os.path.exists(self.tgt_file_name):
+            with io.open(self.journal_file_name, 'r') as journal_file:
+                for line in journal_file:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        # a partially written last line
+                        break
+            tgt_file_size = os.path.getsize(self.tgt_file_name)
+            with io.open(self.tgt_file_name, 'rb') as tgt_file:
+                while len(entries) > 0:
+                    entry = entries[-1]
+                    if entry['offset'] <= tgt_file_size:
+                        tgt_file.seek(entry['bgn_offset'])
+                        if hashlib.sha1(tgt_file.read(entry['offset'] - entry['bgn_offset'])).hexdigest() == entry['sha1']:
+                            break
+                    entries.pop()
+            # the tiles of a window left unfinished are
+            # fetched again with the rest of the window
+            while len(entries) > 0 and not entries[-1].get('last_tile', True):
+                entries.pop()
+        return entries
+
+    def open(self, entries, next_date=None):
+        # rewrite the journal with just
+        # the entries being resumed from
+        self.journal_file = io.open(self.journal_file_name, 'w')
+        for entry in entries:
+            self.journal_file.write(json.dumps(entry) + '\n')
+        self.journal_file.flush()
+        self.entries = list(entries)
+        self.next_date = next_date
+
+    def get_gap(self, window_bgn_date):
+        # the first and last days, if any, between the
+        # last complete window and one beginning on
+        # window_bgn_date that no window covers
+        if self.next_date is not None and window_bgn_date > self.next_date:
+            return self.next_date, window_bgn_date - timedelta(days=1)
+        return None
+
+    def record(self, tgt_file, window_bgn_date, window_end_date, window_iteration_type, byte_count, sha1_digest, row_count, bbox=None, last_tile=True):
+        # the window's bytes are made durable
+        # before its entry is written
+        tgt_file.flush()
+        os.fsync(tgt_file.fileno())
+        offset = tgt_file.tell()
+        entry = {'bgn_date': window_bgn_date.strftime('%Y-%m-%d'),
+                 'end_date': window_end_date.strftime('%Y-%m-%d'),
+                 'iteration_type': window_iteration_type,
+                 'rows': row_count,
+                 'bgn_offset': offset - byte_count,
+                 'offset': offset,
+                 'sha1': sha1_digest}
+        if bbox is not None:
+            entry['bbox'] = list(bbox)
+            entry['last_tile'] = last_tile
+        self.journal_file.write(json.dumps(entry) + '\n')
+        self.journal_file.flush()
+        os.fsync(self.journal_file.fileno())
+        self.entries.append(entry)
+        if last_tile:
+            self.next_date = window_end_date + timedelta(days=1)
+
+    def close(self):
+        if self.journal_file is not None:
+            self.journal_file.close()
+            self.journal_file = None
+
+
+def write_window(tgt_file, lines, first_pass):
+    # streams the window's lines straight to the target file,
+    # dropping its header line unless it's the first window,
+    # counting rows and hashing its bytes along the way
+    sha1 = hashlib.sha1()
+    byte_count = 0
+    row_count = 0
+    header_pending = True
+    bgn_offset = tgt_file.tell()
+    try:
+        for line in lines:
+            line = line.rstrip(b'\r\n')
+            if header_pending and not first_pass:
+                header_pending = False
+                continue
+            if line.strip() == b'':
+                continue
+            if header_pending:
+                header_pending = False
+            else:
+                row_count += 1
+            line += b'\n'
+            tgt_file.write(line)
+            sha1.update(line)
+            byte_count += len(line)
+    except Exception:
+        # drop the partially written window
+        tgt_file.truncate(bgn_offset)
+        tgt_file.seek(bgn_offset)
+        raise
+    if byte_count > 0:
+        first_pass = False
+        tgt_file.flush()
+    return first_pass, byte_count, sha1.hexdigest(), row_count
+
+
+def get_window_lines(body_file, format_parm):
+    # a window's body as CSV lines, those of the other
+    # formats converted to the CSV format's columns
+    # as they're parsed, never held whole
+    if format_parm in (None, 'csv'):
+        return body_file
+    return iter_csv_lines(iter_format_rows(body_file, format_parm))
+
+
+def iter_tile_lines(lines, bbox):
+    # a tile's CSV lines, the header line first, without
+    # the rows on its north and east edges, which belong
+    # to the tiles beyond them (see is_in_tile)
+    latitude_index = None
+    for line in lines:
+        if line.strip() == b'':
+            continue
+        row = next(csv.reader([line.decode('utf-8')]))
+        if latitude_index is None:
+            latitude_index, longitude_index = row.index('latitude'), row.index('longitude')
+        elif not is_in_tile(float(row[latitude_index]), float(row[longitude_index]), bbox):
+            metrics.inc('rows_dropped_total', reason='tile_edge')
+            continue
+        yield line
+
+
+def get_tile_lines(lines, bbox):
+    # the lines of a window, or of one of its tiles
+    return lines if bbox is None else iter_tile_lines(lines, bbox)
+
+
+def print_window_summary(url, row_count, byte_count, seconds, message=''):
+    print('{}: {:,} rows, {:,} bytes in {:,.2f} seconds{}'.format(url, row_count, byte_count, seconds, message))
+    metrics.inc('windows_fetched_total')
+    metrics.inc('rows_fetched_total', row_count)
+    metrics.observe('window_fetch_seconds', seconds)
+
+
+def print_window_gap(gap_bgn_date, gap_end_date):
+    # days no window covers, e.g. after
+    # reusing a plan of a shorter date range
+    days = (gap_end_date - gap_bgn_date).days + 1
+    print('Gap: no window fetched from %s to %s (%d days)' % (gap_bgn_date.strftime('%Y-%m-%d'), gap_end_date.strftime('%Y-%m-%d'), days))
+    metrics.inc('window_gaps_total')
+    metrics.inc('window_gap_days_total', days)
+
+
+def get_window_retry_reason(content):
+    # why a window has to be fetched again
+    # (or in smaller windows), by its response
+    return 'search_limit' if content.find('matching events exceeds search limit') > -1 else 'rejected'
+
+
+def read_high_water_marks(tgt_file_name_parm):
+    # the latest event time and update time
+    # of the catalog, read a row at a time
+    max_time = ''
+    max_updated = ''
+    row_count = 0
+    if not os.path.exists(tgt_file_name_parm):
+        return max_time, max_updated, row_count
+    with io.open(tgt_file_name_parm, 'r', encoding='utf-8', newline='') as tgt_file:
+        csv_reader = csv.reader(tgt_file)
+        fieldnames = next(csv_reader, None)
+        if fieldnames is None:
+            return max_time, max_updated, row_count
+        time_index = fieldnames.index('time')
+        updated_index = fieldnames.index('updated')
+        for row in csv_reader:
+            if len(row) > updated_index:
+                max_time = max(max_time, row[time_index])
+                max_updated = max(max_updated, row[updated_index])
+                row_count += 1
+    return max_time, max_updated, row_count
+
+
+def merge_catalog_delta(tgt_file_name_parm, delta_file_name_parm):
+    # the delta's rows by event id, as fetched
+    delta_rows = {}
+    with io.open(delta_file_name_parm, 'r', encoding='utf-8', newline='') as delta_file:
+        header_line = delta_file.readline()
+        if header_line != '':
+            id_index = next(csv.reader([header_line])).index('id')
+            for line in delta_file:
+                row = next(csv.reader([line]))
+                if len(row) > id_index:
+                    delta_rows[row[id_index]] = line
+
+    replaced_count = 0
+    merged_file_name = tgt_file_name_parm + '.merged'
+
+    # stream the catalog through, replacing revised
+    # events in place, then append the new events
+    with io.open(tgt_file_name_parm, 'r', encoding='utf-8', newline='') as tgt_file:
+        with io.open(merged_file_name, 'w', encoding='utf-8', newline='') as merged_file:
+            header_line = tgt_file.readline()
+            merged_file.write(header_line)
+            id_index = next(csv.reader([header_line])).index('id')
+            for line in tgt_file:
+                row = next(csv.reader([line]))
+                if len(row) > id_index and row[id_index] in delta_rows:
+                    line = delta_rows.pop(row[id_index])
+                    replaced_count += 1
+                merged_file.write(line)
+            for line in delta_rows.values():
+                merged_file.write(line)
+
+    os.replace(merged_file_name, tgt_file_name_parm)
+
+    return replaced_count, len(delta_rows)
+
+
+class CatalogFetcher(object):
+    """
+    Fetches the ANSS ComCat catalog from the FDSN event web service, date
+    window by date window, as configured by QuakeRequester.py's options:
+    into a journaled target file (fetch_catalog, sync_catalog), or as
+    batches of lines for a pipeline (fetch_line_batches).  The target
+    file is CSV whatever the format requested, the windows of the other
+    formats being converted as they stream in.
+    """
+
+    def __init__(self, args, http_client=None):
+        self.args = args
+        # one keep-alive connection pool,
+        # request rate and retry policy
+        # shared by every request
+        if http_client is None:
+            http_client = HttpClient(pool_size=getattr(args, 'concurrency', 1),
+                                     connect_timeout=args.connect_timeout,
+                                     read_timeout=args.read_timeout,
+                                     max_retries=args.max_retries,
+                                     backoff_seconds=args.backoff_seconds,
+                                     requests_per_second=args.requests_per_second)
+        self.http_client = http_client
+
+        # the format of the windows' bodies, converted
+        # to CSV rows unless they're only counts
+        self.window_format = getattr(args, 'format', 'csv') if getattr(args, 'method', 'query') == 'query' else None
+
+        # the quadtree levels every window is
+        # tiled to up front (0 for whole windows)
+        self.tile_levels = max(getattr(args, 'tile_levels', 0), 0)
+
+        # the target file's event id index,
+        # while fetching with --dedup Y
+        self.event_index = None
+
+    def get_base_url(self, method_parm,
+                     format_parm):
+        return get_service_url(self.args.base_url, method_parm, format_parm, self.args.min_depth, self.args.max_depth, self.args.min_magnitude, self.args.max_magnitude)
+
+    def get_window_tiles(self, window_bgn_date, window_end_date, window_iteration_type, bbox=None):
+        # the window's tiles, each one fetched on its own,
+        # or the window itself unless it's tiled up front
+        if bbox is None and self.tile_levels > 0:
+            return [(window_bgn_date, window_end_date, window_iteration_type, tile)
+                    for tile in get_bbox_tiles(world_bbox, self.tile_levels)]
+        return [(window_bgn_date, window_end_date, window_iteration_type, bbox)]
+
+    def write_window_lines(self, tgt_file, lines, bbox, first_pass):
+        # writes a window's (or tile's) lines to the target file,
+        # without the rows on the tile's far edges, nor those of
+        # the events already in the file when deduplicating
+        lines = get_tile_lines(lines, bbox)
+        if self.event_index is not None:
+            lines = self.event_index.iter_new_lines(lines)
+        try:
+            return write_window(tgt_file, lines, first_pass)
+        except Exception:
+            if self.event_index is not None:
+                self.event_index.rollback()
+            raise
+
+    def record_window(self, tgt_file, journal, url, window_bgn_date, window_end_date, window_iteration_type, byte_count, sha1_digest, row_count,
+                      seconds, bbox=None, last_tile=True):
+        # checkpoints a written window (or tile) and
+        # reports its duplicates and any gap before it
+        gap = journal.get_gap(window_bgn_date)
+        journal.record(tgt_file, window_bgn_date, window_end_date, window_iteration_type, byte_count, sha1_digest, row_count, bbox, last_tile)
+        message = ''
+        if self.event_index is not None:
+            dropped_count, superseded_count = self.event_index.commit(tgt_file.tell())
+            message = ', {:,} duplicates dropped, {:,} superseded'.format(dropped_count, superseded_count)
+        print_window_summary(url, row_count, byte_count, seconds, message)
+        if gap is not None:
+            print_window_gap(*gap)
+
+    def fetch_window(self, url):
+        # returns whether the response was ok,
+        # and its decoded content or the exception
+        try:
+            response = self.http_client.get(url)
+            return response.ok, response.content.decode('utf-8')
+        except Exception as e:
+            return False, e
+
+    def spool_window(self, url):
+        # returns whether the response was ok, and
+        # a temporary file the body was streamed into,
+        # or the decoded error content or the exception
+        bgn_time = time()
+        try:
+            with self.http_client.get(url, stream=True) as response:
+                if not response.ok:
+                    return False, response.content.decode('utf-8'), time() - bgn_time
+                # (spooled in memory until it grows past 1 MB)
+                spool_file = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+                try:
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        spool_file.write(chunk)
+                        self.http_client.add_bytes(len(chunk))
+                except Exception:
+                    spool_file.close()
+                    raise
+                spool_file.seek(0)
+                return True, spool_file, time() - bgn_time
+        except Exception as e:
+            return False, e, time() - bgn_time
+
+    def get_window_count(self, url, attempts=5):
+        # the count endpoint's plain text integer
+        for attempt in range(attempts):
+            ok, content = self.fetch_window(url)
+            if ok:
+                try:
+                    return int(content.strip())
+                except ValueError:
+                    pass
+            print('Bad count response. Got:', content)
+        raise RuntimeError('No count obtained after %d attempts: %s' % (attempts, url))
+
+    def plan_windows(self, count_base_url, bgn_date_parm, end_date_parm, iteration_type_parm):
+        # windows are sized to hold no more than
+        # this many events, leaving some headroom
+        target_rows = int(max_rows_per_query * self.args.plan_fill_ratio)
+
+        # start from the iteration type's windows
+        windows = []
+        cur_bgn_date = bgn_date_parm
+        while cur_bgn_date <= end_date_parm:
+            end_date_parm_window = min(get_window_end_date(cur_bgn_date, iteration_type_parm), end_date_parm)
+            windows.append((cur_bgn_date, end_date_parm_window, None))
+            cur_bgn_date = end_date_parm_window + timedelta(days=1)
+
+        # count every window, splitting the
+        # ones holding too many events in half,
+        # and the days doing so into tiles,
+        # and counting the parts in turn
+        counted_windows = []
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as executor:
+            while len(windows) > 0:
+                urls = [get_window_url(count_base_url, window_bgn_date, window_end_date, bbox) for window_bgn_date, window_end_date, bbox in windows]
+                counts = list(executor.map(self.get_window_count, urls))
+                next_windows = []
+                for (window_bgn_date, window_end_date, bbox), url, count in zip(windows, urls, counts):
+                    print('%s: %d' % (url, count))
+                    if count > target_rows and window_end_date > window_bgn_date and bbox is None:
+                        next_windows.extend((sub_bgn_date, sub_end_date, None) for sub_bgn_date, sub_end_date in split_window(window_bgn_date, window_end_date))
+                    elif count > target_rows:
+                        next_windows.extend((window_bgn_date, window_end_date, sub_bbox) for sub_bbox in split_tile(bbox))
+                    else:
+                        counted_windows.append((window_bgn_date, window_end_date, count, bbox))
+                windows = next_windows
+
+        # merge adjacent windows for as long as
+        # their events still fit, a day's tiles
+        # being kept apart, one after another
+        planned_windows = []
+        for window_bgn_date, window_end_date, count, bbox in sorted(counted_windows, key=lambda window: window[:2]):
+            if len(planned_windows) > 0 and bbox is None and planned_windows[-1][3] is None and planned_windows[-1][2] + count <= target_rows:
+                planned_windows[-1] = (planned_windows[-1][0], window_end_date, planned_windows[-1][2] + count, None)
+            else:
+                planned_windows.append((window_bgn_date, window_end_date, count, bbox))
+
+        return planned_windows
+
+    def give_up_on_window(self, url, failures):
+        # the client has already retried each request,
+        # so a window failing this often is left for
+        # a later run to resume from the journal
+        if failures > self.args.max_retries:
+            raise RuntimeError('Giving up on a window after %d failures, rerun with --tgt_file_append Y to resume: %s' % (failures, url))
+
+    def fetch_windows_serially(self, tgt_file, journal, base_url_parm, bgn_date_parm, end_date_parm, iteration_type_parm, first_pass):
+
+        cur_bgn_date = bgn_date_parm
+        iteration_type = iteration_type_parm
+        # the tiles of the current window still to
+        # be fetched, the next one last (just None
+        # for a window fetched whole)
+        tiles = None
+        failures = 0
+        while cur_bgn_date <= end_date_parm:
+            end_date_parm_window = get_window_end_date(cur_bgn_date, iteration_type)
+            if tiles is None:
+                tiles = [tile[3] for tile in reversed(self.get_window_tiles(cur_bgn_date, end_date_parm_window, iteration_type))]
+            bbox = tiles[-1]
+            url = get_window_url(base_url_parm, cur_bgn_date, end_date_parm_window, bbox)
+            bgn_time = time()
+            failed = False
+            try:
+                with self.http_client.get(url, stream=True) as response:
+                    if response.ok:
+                        # written as it arrives, never held whole
+                        if self.window_format in (None, 'csv'):
+                            first_pass, byte_count, sha1_digest, row_count = self.write_window_lines(tgt_file, response.iter_lines(chunk_size=64 * 1024), bbox, first_pass)
+                            self.http_client.add_bytes(byte_count)
+                        else:
+                            # (the raw stream, decompressed, being
+                            # parsed as it's read, its bytes counted)
+                            response.raw.decode_content = True
+                            first_pass, byte_count, sha1_digest, row_count = self.write_window_lines(tgt_file, get_window_lines(response.raw, self.window_format), bbox, first_pass)
+                            self.http_client.add_bytes(response.raw.tell())
+                        tiles.pop()
+                        self.record_window(tgt_file, journal, url, cur_bgn_date, end_date_parm_window, iteration_type, byte_count, sha1_digest, row_count,
+                                           time() - bgn_time, bbox, len(tiles) == 0)
+                        if len(tiles) == 0:
+                            cur_bgn_date = end_date_parm_window + timedelta(days=1)
+                            tiles = None
+                        failures = 0
+                    else:
+                        print(url)
+                        retry_reason = get_window_retry_reason(response.content.decode('utf-8'))
+                        metrics.inc('window_retries_total', reason=retry_reason)
+                        if retry_reason == 'search_limit':
+                            if bbox is None and iteration_type != 'days':
+                                iteration_type = get_next_smaller_iteration_type(iteration_type)
+                                tiles = None
+                            else:
+                                # a day (or a tile) still holding too
+                                # many events is split into quadrants
+                                tiles.pop()
+                                tiles.extend(reversed(split_tile(bbox)))
+                        else:
+                            # an error the client has already retried (or
+                            # didn't retry, e.g. a 4xx), as a failure
+                            failed = True
+
+            except Exception as e:
+                print(url)
+                print('Bad response. Got an error code:', e)
+                metrics.inc('window_retries_total', reason='error')
+                failed = True
+
+            if failed:
+                failures += 1
+                self.give_up_on_window(url, failures)
+                self.http_client.backoff(failures)
+
+            sleep(self.args.sleep_seconds)
+
+    def fetch_windows_concurrently(self, tgt_file, journal, base_url_parm, bgn_date_parm, end_date_parm, iteration_type_parm, first_pass, planned_windows=None):
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as executor:
+
+            def submit_window(window_bgn_date, window_end_date, window_iteration_type, bbox):
+                url = get_window_url(base_url_parm, window_bgn_date, window_end_date, bbox)
+                return window_bgn_date, window_end_date, window_iteration_type, bbox, url, executor.submit(self.spool_window, url)
+
+            # windows (or their tiles) in chronological order, each
+            # one's request already submitted to the thread pool
+            windows = deque()
+
+            # the latest window's tiles not yet submitted
+            pending_tiles = deque()
+
+            def is_last_tile(window_bgn_date, window_end_date, bbox):
+                # whether no other tile of the window is
+                # still to be written, in flight or not
+                if bbox is None:
+                    return True
+                next_windows = planned_windows[plan_index:plan_index + 1] if planned_windows is not None else []
+                for window in chain(windows, pending_tiles, next_windows):
+                    if window[0] == window_bgn_date and window[1] == window_end_date:
+                        return False
+                return True
+
+            # failures by window url
+            window_failures = {}
+
+            cur_bgn_date = bgn_date_parm
+            iteration_type = iteration_type_parm
+            plan_index = 0
+            while True:
+                # keep the pool busy with the windows that
+                # follow, either planned up front or stepping
+                # along by the current iteration type
+                while len(windows) < self.args.concurrency:
+                    if len(pending_tiles) > 0:
+                        windows.append(submit_window(*pending_tiles.popleft()))
+                    elif planned_windows is not None:
+                        if plan_index >= len(planned_windows):
+                            break
+                        pending_tiles.extend(self.get_window_tiles(planned_windows[plan_index][0], planned_windows[plan_index][1], None, planned_windows[plan_index][3]))
+                        plan_index += 1
+                    elif cur_bgn_date <= end_date_parm:
+                        end_date_parm_window = get_window_end_date(cur_bgn_date, iteration_type)
+                        pending_tiles.extend(self.get_window_tiles(cur_bgn_date, end_date_parm_window, iteration_type))
+                        cur_bgn_date = end_date_parm_window + timedelta(days=1)
+                    else:
+                        break
+
+                if len(windows) == 0:
+                    break
+
+                # the earliest window is always
+                # the next one written to the file
+                window_bgn_date, window_end_date, window_iteration_type, bbox, url, future = windows.popleft()
+                ok, content, seconds = future.result()
+                if ok:
+                    # copied from its spool file in order
+                    with content as spool_file:
+                        first_pass, byte_count, sha1_digest, row_count = self.write_window_lines(tgt_file, get_window_lines(spool_file, self.window_format), bbox, first_pass)
+                    self.record_window(tgt_file, journal, url, window_bgn_date, window_end_date, window_iteration_type, byte_count, sha1_digest, row_count,
+                                       seconds, bbox, is_last_tile(window_bgn_date, window_end_date, bbox))
+                elif isinstance(content, Exception):
+                    print(url)
+                    print('Bad response. Got an error code:', content)
+                    metrics.inc('window_retries_total', reason='error')
+                    window_failures[url] = window_failures.get(url, 0) + 1
+                    self.give_up_on_window(url, window_failures[url])
+                    self.http_client.backoff(window_failures[url])
+                    # retry the same window
+                    windows.appendleft(submit_window(window_bgn_date, window_end_date, window_iteration_type, bbox))
+                else:
+                    print(url)
+                    retry_reason = get_window_retry_reason(content)
+                    metrics.inc('window_retries_total', reason=retry_reason)
+                    if retry_reason != 'search_limit':
+                        # an error the client has already retried (or
+                        # didn't retry, e.g. a 4xx), as a failure, the
+                        # same window retried after backing off
+                        window_failures[url] = window_failures.get(url, 0) + 1
+                        self.give_up_on_window(url, window_failures[url])
+                        self.http_client.backoff(window_failures[url])
+                        windows.appendleft(submit_window(window_bgn_date, window_end_date, window_iteration_type, bbox))
+                    elif bbox is not None or window_bgn_date == window_end_date:
+                        # a day (or a tile) still holding too many events
+                        # is split into quadrants, ahead of the windows
+                        # already in flight
+                        for sub_bbox in reversed(split_tile(bbox)):
+                            windows.appendleft(submit_window(window_bgn_date, window_end_date, window_iteration_type, sub_bbox))
+                    elif window_iteration_type is None:
+                        # a planned window that turned out to be too big
+                        # (e.g. events added since it was counted) is halved
+                        for sub_bgn_date, sub_end_date in reversed(split_window(window_bgn_date, window_end_date)):
+                            windows.appendleft(submit_window(sub_bgn_date, sub_end_date, None, None))
+                    else:
+                        # (windows planned before an earlier
+                        # step down don't step down again)
+                        if window_iteration_type == iteration_type:
+                            iteration_type = get_next_smaller_iteration_type(iteration_type)
+                        # re-plan the window with the (possibly) smaller
+                        # iteration type, ahead of the windows already in flight,
+                        # no further than a serial pass would have gone
+                        sub_windows = []
+                        sub_bgn_date = window_bgn_date
+                        while sub_bgn_date <= window_end_date and sub_bgn_date <= end_date_parm:
+                            sub_end_date = min(get_window_end_date(sub_bgn_date, iteration_type), window_end_date)
+                            sub_windows.append((sub_bgn_date, sub_end_date))
+                            sub_bgn_date = sub_end_date + timedelta(days=1)
+                        for sub_bgn_date, sub_end_date in reversed(sub_windows):
+                            windows.appendleft(submit_window(sub_bgn_date, sub_end_date, iteration_type, None))
+
+    def fetch_catalog(self, tgt_file_name_parm, url_filter_parm='', end_date_parm=None):
+        # the checkpoint journal of completed windows
+        journal = WindowJournal(tgt_file_name_parm)
+        journal_entries = journal.load() if self.args.tgt_file_append == 'Y' else []
+
+        bgn_date = datetime.strptime(self.args.bgn_date, '%Y-%m-%d')
+        end_date = end_date_parm if end_date_parm is not None else datetime.strptime(self.args.end_date, '%Y-%m-%d')
+        iteration_type = self.args.iteration_type
+        first_pass = True
+
+        if len(journal_entries) > 0:
+            # resume after the last intact window,
+            # with the iteration type it had reached
+            last_entry = journal_entries[-1]
+            bgn_date = datetime.strptime(last_entry['end_date'], '%Y-%m-%d') + timedelta(days=1)
+            if last_entry['iteration_type'] is not None:
+                iteration_type = last_entry['iteration_type']
+            first_pass = last_entry['offset'] == 0
+            print('Resuming at %s after %d checkpointed windows' % (bgn_date.strftime('%Y-%m-%d'), len(journal_entries)))
+        elif self.args.tgt_file_append == 'Y':
+            print('No checkpoint journal to resume from: %s' % journal.journal_file_name)
+
+        # open the target file for write, or for
+        # update when resuming from the journal
+        with io.open(tgt_file_name_parm, 'r+b' if len(journal_entries) > 0 else 'wb') as tgt_file:
+
+            # drop any partially written window
+            if len(journal_entries) > 0:
+                tgt_file.truncate(journal_entries[-1]['offset'])
+                tgt_file.seek(0, io.SEEK_END)
+
+            journal.open(journal_entries, bgn_date)
+
+            if getattr(self.args, 'dedup', 'N') == 'Y':
+                # the index of the event ids already in the
+                # target file, reused or rebuilt from it
+                self.event_index = EventIndex(tgt_file_name_parm + '.ids', getattr(self.args, 'dedup_memory_mb', 64))
+                self.event_index.open(tgt_file_name_parm, tgt_file.tell())
+
+            base_url = self.get_base_url(self.args.method, self.args.format) + url_filter_parm
+
+            if self.args.plan_windows == 'Y':
+                # size the windows from event counts
+                # before fetching any of them
+                if self.args.plan_file_path is not None and os.path.exists(self.args.plan_file_path):
+                    planned_windows = load_window_plan(self.args.plan_file_path)
+                    print('Loaded a plan of %d windows: %s' % (len(planned_windows), self.args.plan_file_path))
+                else:
+                    planned_windows = self.plan_windows(self.get_base_url('count', None) + url_filter_parm, bgn_date, end_date, iteration_type)
+                    print('Planned %d windows' % len(planned_windows))
+                    if self.args.plan_file_path is not None:
+                        save_window_plan(self.args.plan_file_path, planned_windows)
+                # (skipping the windows already checkpointed)
+                planned_windows = [planned_window for planned_window in planned_windows if planned_window[0] >= bgn_date]
+                self.fetch_windows_concurrently(tgt_file, journal, base_url, bgn_date, end_date, iteration_type, first_pass, planned_windows)
+            elif self.args.concurrency > 1:
+                # several windows in flight at once,
+                # still written in chronological order
+                self.fetch_windows_concurrently(tgt_file, journal, base_url, bgn_date, end_date, iteration_type, first_pass)
+            else:
+                self.fetch_windows_serially(tgt_file, journal, base_url, bgn_date, end_date, iteration_type, first_pass)
+
+            # any days after the last window
+            # that no window covered
+            gap = journal.get_gap(end_date + timedelta(days=1))
+            if gap is not None:
+                print_window_gap(*gap)
+
+            journal.close()
+            tgt_file.close()
+
+        if self.event_index is not None:
+            if self.event_index.superseded_count > 0:
+                # remove the rows superseded by newer versions,
+                # the journal rewritten to match the file
+                journal.open(self.event_index.compact(tgt_file_name_parm, journal.entries))
+                journal.close()
+            print(self.event_index.get_message())
+            self.event_index.close()
+            self.event_index = None
+
+    def sync_catalog(self, tgt_file_name_parm):
+        max_time, max_updated, row_count = read_high_water_marks(tgt_file_name_parm)
+        end_date = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        if row_count == 0:
+            # no events to sync from, so the catalog is
+            # fetched whole, from --bgn_date through today
+            print('No events in the catalog to sync, fetching it whole through %s: %s' % (end_date.strftime('%Y-%m-%d'), tgt_file_name_parm))
+            self.fetch_catalog(tgt_file_name_parm, '', end_date)
+            return
+        print('Catalog of {:,} events, latest time: {}, latest update: {}'.format(row_count, max_time, max_updated))
+
+        # fetch just the events added or revised since the latest
+        # event or update, whichever is earlier (an event newer than
+        # the catalog may have been updated before its latest update),
+        # from --bgn_date through today, into a delta file
+        updated_after = min(max_time, max_updated)
+        print('Fetching the events updated after %s, through %s' % (updated_after, end_date.strftime('%Y-%m-%d')))
+        delta_file_name = tgt_file_name_parm + '.delta'
+        self.fetch_catalog(delta_file_name, '&updatedafter=%s' % updated_after.rstrip('Z'), end_date)
+
+        replaced_count, added_count = merge_catalog_delta(tgt_file_name_parm, delta_file_name)
+        print('Merged delta: {:,} events revised, {:,} events added'.format(replaced_count, added_count))
+
+        # the catalog's checkpoint journal no longer
+        # matches its bytes, nor is the delta needed
+        for file_name in (delta_file_name, delta_file_name + '.journal', delta_file_name + '.ids', tgt_file_name_parm + '.journal', tgt_file_name_parm + '.ids'):
+            if os.path.exists(file_name):
+                os.remove(file_name)
+
+    def fetch_line_batches(self, base_url_parm, bgn_date_parm, end_date_parm, iteration_type_parm, batch_lines):
+        """
+        Steps through the date windows (or their tiles), streaming each one's
+        response and yielding its decoded lines in batches as they arrive,
+        the first window's header line first, later windows' headers dropped.
+        """
+        first_pass = True
+        cur_bgn_date = bgn_date_parm
+        iteration_type = iteration_type_parm
+        # the current window's tiles still to be
+        # fetched, the next one last, as serially
+        tiles = None
+        failures = 0
+        # the lines of the current window already
+        # yielded, skipped when it has to be refetched
+        passed_lines = 0
+        while cur_bgn_date <= end_date_parm:
+            end_date_parm_window = get_window_end_date(cur_bgn_date, iteration_type)
+            if tiles is None:
+                tiles = [tile[3] for tile in reversed(self.get_window_tiles(cur_bgn_date, end_date_parm_window, iteration_type))]
+            bbox = tiles[-1]
+            url = get_window_url(base_url_parm, cur_bgn_date, end_date_parm_window, bbox)
+            bgn_time = time()
+            try:
+                with self.http_client.get(url, stream=True) as response:
+                    if not response.ok:
+                        print(url)
+                        content = response.content.decode('utf-8')
+                        if get_window_retry_reason(content) == 'search_limit':
+                            metrics.inc('window_retries_total', reason='search_limit')
+                            if bbox is None and iteration_type != 'days':
+                                iteration_type = get_next_smaller_iteration_type(iteration_type)
+                                tiles = None
+                            else:
+                                tiles.pop()
+                                tiles.extend(reversed(split_tile(bbox)))
+                            continue
+                        raise RuntimeError('HTTP %d: %s' % (response.status_code, content.strip()))
+
+                    lines = []
+                    line_number = 0
+                    byte_count = 0
+                    for line in get_tile_lines(response.iter_lines(chunk_size=64 * 1024), bbox):
+                        byte_count += len(line) + 1
+                        if line.strip() == b'':
+                            continue
+                        line_number += 1
+                        if line_number == 1 and not first_pass:
+                            continue
+                        if line_number <= passed_lines:
+                            continue
+                        lines.append(line.decode('utf-8'))
+                        if len(lines) >= batch_lines:
+                            yield lines
+                            lines = []
+                            passed_lines = line_number
+                            first_pass = False
+                    if len(lines) > 0:
+                        yield lines
+                        first_pass = False
+                    self.http_client.add_bytes(byte_count)
+
+                print_window_summary(url, max(line_number - 1, 0), byte_count, time() - bgn_time)
+                tiles.pop()
+                if len(tiles) == 0:
+                    cur_bgn_date = end_date_parm_window + timedelta(days=1)
+                    tiles = None
+                passed_lines = 0
+                failures = 0
+
+            except Exception as e:
+                print(url)
+                print('Bad response. Got an error code:', e)
+                metrics.inc('window_retries_total', reason='error')
+                failures += 1
+                # the client has already retried each request
+                if failures > self.args.max_retries:
+                    raise RuntimeError('Giving up on a window after %d failures: %s' % (failures, url))
+                self.http_client.backoff(failures)
+
+    def close(self):
+        self.http_client.close()
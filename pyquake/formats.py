@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+
+# ========================================================================
+#
+# Copyright © 2016 Khepry Quixote
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ========================================================================
+
+import codecs
+import csv
+import io
+import json
+import re
+
+from datetime import datetime, timedelta
+from xml.etree.ElementTree import iterparse
+
+# the columns of an ANSS ComCat CSV response,
+# the rows of every other format converted to them
+comcat_fieldnames = ['time', 'latitude', 'longitude', 'depth', 'mag', 'magType', 'nst', 'gap', 'dmin', 'rms', 'net', 'id',
+                     'updated', 'place', 'type', 'horizontalError', 'depthError', 'magError', 'magNst', 'status',
+                     'locationSource', 'magSource']
+
+# the FDSN event web service formats read as rows
+# (the service's xml being QuakeML too)
+format_choices = ('csv', 'geojson', 'quakeml', 'text', 'xml')
+
+quakeml_namespaces = {'q': 'http://quakeml.org/xmlns/bed/1.2',
+                      'catalog': 'http://anss.org/xmlns/catalog/0.1'}
+
+epoch = datetime(1970, 1, 1)
+
+
+def normalize_comcat_time(value):
+    # 2019-12-31T23:59:59.999Z, as the CSV format has it,
+    # from however many fractional digits (or none) and
+    # with or without the trailing Z
+    if value is None or value == '':
+        return ''
+    if len(value) == 24 and value[19] == '.' and value[23] == 'Z':
+        return value
+    head, _, fraction = value.rstrip('Z').partition('.')
+    return '%s.%sZ' % (head, (fraction + '000')[:3])
+
+
+def format_epoch_ms(value):
+    # 2019-12-31T23:59:59.999Z, from the milliseconds
+    # since the epoch (negative before 1970)
+    if value is None:
+        return ''
+    seconds, ms = divmod(int(value), 1000)
+    return (epoch + timedelta(seconds=seconds)).strftime('%Y-%m-%dT%H:%M:%S') + '.%03dZ' % ms
+
+
+def parse_epoch_ms(value):
+    # the inverse of format_epoch_ms
+    when = datetime.strptime(normalize_comcat_time(value), '%Y-%m-%dT%H:%M:%S.%fZ')
+    return (when - epoch) // timedelta(milliseconds=1)
+
+
+def format_number(value):
+    # a number as the CSV format writes it,
+    # without trailing zeros or exponent
+    return ('%.6f' % value).rstrip('0').rstrip('.')
+
+
+def format_meters_as_km(value):
+    if value is None or value == '':
+        return ''
+    return format_number(float(value) / 1000.0)
+
+
+def format_json_value(value):
+    if value is None:
+        return ''
+    return str(value)
+
+
+def get_preferred_element(elements, public_id):
+    # the element with the preferred publicID,
+    # else the first, else None
+    for element in elements:
+        if element.get('publicID') == public_id:
+            return element
+    return elements[0] if len(elements) > 0 else None
+
+
+def get_quakeml_row(event):
+    """
+    The ComCat CSV row of a QuakeML event element, from its preferred
+    origin and magnitude (the first ones when none is preferred), as the
+    service's own CSV format has it.
+    """
+    ns = quakeml_namespaces
+    origin = get_preferred_element(event.findall('q:origin', ns), event.findtext('q:preferredOriginID', None, ns))
+    magnitude = get_preferred_element(event.findall('q:magnitude', ns), event.findtext('q:preferredMagnitudeID', None, ns))
+
+    place = ''
+    for description in event.findall('q:description', ns):
+        if description.findtext('q:type', '', ns) == 'earthquake name' or place == '':
+            place = description.findtext('q:text', '', ns)
+
+    event_source = event.get('{%s}eventsource' % ns['catalog'], event.get('{%s}datasource' % ns['catalog'], ''))
+    event_id = event.get('{%s}eventid' % ns['catalog'], '')
+
+    row = dict.fromkeys(comcat_fieldnames, '')
+    row['net'] = event_source
+    row['id'] = event_source + event_id if event_id != '' else event.get('publicID', '')
+    row['updated'] = normalize_comcat_time(event.findtext('q:creationInfo/q:creationTime', '', ns))
+    row['place'] = place
+    row['type'] = event.findtext('q:type', '', ns)
+
+    if origin is not None:
+        row['time'] = normalize_comcat_time(origin.findtext('q:time/q:value', '', ns))
+        row['latitude'] = origin.findtext('q:latitude/q:value', '', ns)
+        row['longitude'] = origin.findtext('q:longitude/q:value', '', ns)
+        # (QuakeML's depths and uncertainties
+        # are in meters, the CSV's kilometers)
+        row['depth'] = format_meters_as_km(origin.findtext('q:depth/q:value', '', ns))
+        row['depthError'] = format_meters_as_km(origin.findtext('q:depth/q:uncertainty', '', ns))
+        row['horizontalError'] = format_meters_as_km(origin.findtext('q:originUncertainty/q:horizontalUncertainty', '', ns))
+        row['nst'] = origin.findtext('q:quality/q:usedStationCount', None, ns) or origin.findtext('q:quality/q:usedPhaseCount', '', ns)
+        row['gap'] = origin.findtext('q:quality/q:azimuthalGap', '', ns)
+        row['dmin'] = origin.findtext('q:quality/q:minimumDistance', '', ns)
+        row['rms'] = origin.findtext('q:quality/q:standardError', '', ns)
+        evaluation_mode = origin.findtext('q:evaluationMode', '', ns)
+        row['status'] = {'manual': 'reviewed', 'automatic': 'automatic'}.get(evaluation_mode, evaluation_mode)
+        row['locationSource'] = origin.get('{%s}datasource' % ns['catalog'], '')
+
+    if magnitude is not None:
+        row['mag'] = magnitude.findtext('q:mag/q:value', '', ns)
+        row['magError'] = magnitude.findtext('q:mag/q:uncertainty', '', ns)
+        row['magType'] = magnitude.findtext('q:type', '', ns)
+        row['magNst'] = magnitude.findtext('q:stationCount', '', ns)
+        row['magSource'] = magnitude.get('{%s}datasource' % ns['catalog'], '')
+
+    return [row[fieldname] for fieldname in comcat_fieldnames]
+
+
+def iter_quakeml_rows(src_file):
+    """
+    Yields the rows of a QuakeML (or the service's xml) document read from
+    the binary src_file, event by event, each event's element being dropped
+    once its row is yielded, so a document of any size is parsed in the
+    memory of a single event rather than loaded whole.
+    """
+    event_tag = '{%s}event' % quakeml_namespaces['q']
+    parents = []
+    for action, element in iterparse(src_file, events=('start', 'end')):
+        if action == 'start':
+            parents.append(element)
+            continue
+        parents.pop()
+        if element.tag == event_tag:
+            yield get_quakeml_row(element)
+            # (the eventParameters element
+            # otherwise holds every event)
+            if len(parents) > 0:
+                parents[-1].remove(element)
+            element.clear()
+
+
+def iter_json_array(src_file, key, chunk_size=64 * 1024):
+    """
+    Yields the items of the array under key in a JSON object read from the
+    binary src_file, one at a time, holding no more of the document than
+    an item and a chunk of chunk_size bytes.  The items are expected to be
+    objects or arrays, as GeoJSON's features are, and key not to appear as
+    a key before the array.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    json_decoder = json.JSONDecoder()
+    key_pattern = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+    buffer = ''
+    eof = False
+
+    def read_chunk():
+        chunk = src_file.read(chunk_size)
+        return decoder.decode(chunk, final=len(chunk) == 0), len(chunk) == 0
+
+    # skip ahead to the array, keeping enough of
+    # each chunk for a key split across two of them
+    while True:
+        match = key_pattern.search(buffer)
+        if match is not None:
+            buffer = buffer[match.end():]
+            break
+        if eof:
+            return
+        text, eof = read_chunk()
+        buffer = buffer[-(len(key) + 64):] + text
+
+    position = 0
+    while True:
+        # skip the whitespace and commas between items
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if position < len(buffer) and buffer[position] == ']':
+            return
+        try:
+            if position >= len(buffer):
+                raise ValueError('Incomplete JSON array')
+            item, end = json_decoder.raw_decode(buffer, position)
+        except ValueError:
+            # an item split across chunks
+            if eof:
+                raise
+            text, eof = read_chunk()
+            buffer = buffer[position:] + text
+            position = 0
+            continue
+        yield item
+        position = end
+        # drop the items already yielded
+        if position > chunk_size:
+            buffer = buffer[position:]
+            position = 0
+
+
+def get_geojson_row(feature):
+    # the ComCat CSV row of a GeoJSON feature, the
+    # columns the format lacks being left empty
+    properties = feature.get('properties') or {}
+    coordinates = (feature.get('geometry') or {}).get('coordinates') or [None, None, None]
+    row = dict.fromkeys(comcat_fieldnames, '')
+    row['time'] = format_epoch_ms(properties.get('time'))
+    row['latitude'] = format_json_value(coordinates[1])
+    row['longitude'] = format_json_value(coordinates[0])
+    row['depth'] = format_json_value(coordinates[2] if len(coordinates) > 2 else None)
+    row['id'] = format_json_value(feature.get('id'))
+    row['updated'] = format_epoch_ms(properties.get('updated'))
+    for fieldname in ('mag', 'magType', 'nst', 'gap', 'dmin', 'rms', 'net', 'place', 'type', 'status'):
+        row[fieldname] = format_json_value(properties.get(fieldname))
+    return [row[fieldname] for fieldname in comcat_fieldnames]
+
+
+def iter_geojson_rows(src_file, chunk_size=64 * 1024):
+    """
+    Yields the rows of a GeoJSON FeatureCollection read from the binary
+    src_file, feature by feature, without loading the document whole.
+    """
+    for feature in iter_json_array(src_file, 'features', chunk_size):
+        yield get_geojson_row(feature)
+
+
+# the FDSN text format's columns, and the
+# ComCat CSV columns they're converted to
+text_columns = {'EventID': 'id', 'Time': 'time', 'Latitude': 'latitude', 'Longitude': 'longitude', 'Depth/km': 'depth',
+                'Author': 'locationSource', 'Catalog': 'net', 'MagType': 'magType', 'Magnitude': 'mag',
+                'MagAuthor': 'magSource', 'EventLocationName': 'place', 'EventType': 'type'}
+
+
+def iter_text_rows(src_file):
+    """
+    Yields the rows of the FDSN pipe-delimited text format read from the
+    binary src_file, line by line, its columns located by its #-prefixed
+    header line.
+    """
+    positions = None
+    # (binary lines, as HTTP response
+    # streams and spool files give them)
+    for line in src_file:
+        line = line.decode('utf-8').rstrip('\r\n')
+        if line.strip() == '':
+            continue
+        values = line.split('|')
+        if line.startswith('#'):
+            values[0] = values[0][1:]
+            positions = [(comcat_fieldnames.index(text_columns[name.strip()]), position)
+                         for position, name in enumerate(values) if name.strip() in text_columns]
+            continue
+        if positions is None:
+            raise ValueError('The text format\'s header line is missing')
+        row = [''] * len(comcat_fieldnames)
+        for index, position in positions:
+            if position < len(values):
+                row[index] = values[position].strip()
+        row[0] = normalize_comcat_time(row[0])
+        yield row
+
+
+def iter_format_rows(src_file, format_parm):
+    """
+    Yields the ComCat CSV header row and then the rows of the binary
+    src_file in one of the formats other than CSV, as they're parsed.
+    """
+    if format_parm in ('quakeml', 'xml'):
+        rows = iter_quakeml_rows(src_file)
+    elif format_parm == 'geojson':
+        rows = iter_geojson_rows(src_file)
+    elif format_parm == 'text':
+        rows = iter_text_rows(src_file)
+    else:
+        raise ValueError('Rows can\'t be read from the %s format' % format_parm)
+    yield list(comcat_fieldnames)
+    for row in rows:
+        yield row
+
+
+def iter_csv_lines(rows):
+    # the rows as encoded CSV lines,
+    # e.g. to write to a CSV target file
+    out_file = io.StringIO()
+    csv_writer = csv.writer(out_file, lineterminator='\n')
+    for row in rows:
+        csv_writer.writerow(row)
+        yield out_file.getvalue().encode('utf-8')
+        out_file.seek(0)
+        out_file.truncate()
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+# ========================================================================
+#
+# Copyright © 2016 Khepry Quixote
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ========================================================================
+
+from .admin import AdminIndex, admin_keys
+from .cache import GeoCodeCache
+from .index import GeoIndex
+
+# a failed search's values
+empty_result = {'cc': '', 'admin1': '', 'admin2': '', 'name': ''}
+
+# the --geocode-engine choices: the nearest populated place's
+# values, or those of the admin polygon holding the point
+engine_choices = ('kdtree', 'polygon')
+
+
+class Geocoder(object):
+    """
+    Reverse geocoder holding its loaded K-D tree, either the memory-mapped
+    index or reverse_geocoder's own, and optionally a geocode cache, so a
+    long-lived process pays for loading them once rather than per file.
+
+    With an admin index (the polygon engine) the cc, admin1 and admin2
+    values are those of the admin polygon holding each point, the K-D
+    tree's nearest place only supplying the name.
+    """
+
+    def __init__(self, geocode_index_file_path=None, geocode_cache=None, admin_index=None):
+        self.geo_index = None
+        if geocode_index_file_path is not None:
+            self.geo_index = GeoIndex(geocode_index_file_path)
+        self.geocode_cache = geocode_cache
+        self.admin_index = admin_index
+
+    @classmethod
+    def from_args(cls, args):
+        # the geocoder configured by the scripts'
+        # --geocode-* and --admin-* options
+        admin_index = None
+        if args.geocode_engine == 'polygon':
+            admin_index = AdminIndex.from_file(args.admin_file_path,
+                                               (args.admin_cc_field, args.admin_admin1_field, args.admin_admin2_field))
+        geocode_cache = None
+        if args.geocode_cache == 'Y':
+            geocode_cache = GeoCodeCache(precision=args.geocode_cache_precision,
+                                         max_entries=args.geocode_cache_size,
+                                         db_file_path=args.geocode_cache_file_path,
+                                         db_table_name='admin_geocodes' if admin_index is not None else 'geocodes',
+                                         db_source=admin_index.source if admin_index is not None else None)
+        return cls(args.geocode_index_file_path, geocode_cache, admin_index)
+
+    def search_nearest(self, coordinates_list):
+        # search for the coordinates
+        # with a single K-D tree query, returning
+        # the cc, admin1, admin2, and name values,
+        # from the memory-mapped index if there is one
+        if self.geo_index is not None:
+            return self.geo_index.query(coordinates_list)
+        # otherwise using a mode 1 (single-threaded) search
+        import reverse_geocoder as rg
+        return rg.search(coordinates_list, mode=1)  # default mode = 2
+
+    def search_coordinates(self, coordinates_list):
+        results = self.search_nearest(coordinates_list)
+        if self.admin_index is None:
+            return results
+        # the admin polygons' values over the nearest places'
+        return [dict(result, **dict(zip(admin_keys, admin_values)))
+                for result, admin_values in zip(results, self.admin_index.query(coordinates_list))]
+
+    def search(self, coordinates_list):
+        # through the geocode cache if there is one
+        if self.geocode_cache is not None:
+            return self.geocode_cache.search(coordinates_list, self.search_coordinates)
+        return self.search_coordinates(coordinates_list)
+
+    def warm(self):
+        # load the K-D tree ahead of the first rows
+        # (and before any worker processes are forked)
+        self.search_coordinates([(0.0, 0.0)])
+
+    def geocode_rows(self, pending_rows, row_transform):
+        """
+        Geocodes a batch of (row number, record, coordinates), setting
+        each record's cc, admin1, admin2 and name values in place.
+        """
+        # nothing to do for an empty batch
+        if len(pending_rows) == 0:
+            return
+
+        results = self.search([coordinates for row_number, record, coordinates in pending_rows])
+
+        # if results obtained
+        if results is not None:
+            # result-by-result
+            for (row_number, record, coordinates), result in zip(pending_rows, results):
+                # map result values
+                # to the row values
+                row_transform.set_result(record, result)
+        else:
+            for row_number, record, coordinates in pending_rows:
+                # map empty values
+                # to the row values
+                row_transform.set_result(record, empty_result)
+
+    def get_message(self):
+        if self.geocode_cache is not None:
+            return self.geocode_cache.get_message()
+        return None
+
+    def close_cache(self):
+        # flush and close the cache's connection, by
+        # the thread that searched, its connection's owner
+        if self.geocode_cache is not None:
+            self.geocode_cache.close()
+
+    def close(self):
+        self.close_cache()
+        if self.geo_index is not None:
+            self.geo_index.close()
+            self.geo_index = None
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+# ========================================================================
+#
+# Copyright © 2016 Khepry Quixote
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ========================================================================
+
+import random
+import requests
+import threading
+
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+from time import monotonic, sleep
+
+from .metrics import metrics
+
+# responses worth retrying, the
+# server being busy or briefly down
+retry_status_codes = (429, 500, 502, 503, 504)
+
+
+class RateLimiter(object):
+    """
+    Spaces out the starts of requests issued by any number of
+    threads so that, together, they stay under a requests/second rate.
+    """
+
+    def __init__(self, requests_per_second):
+        self.interval_seconds = 1.0 / requests_per_second if requests_per_second > 0 else 0.0
+        self.lock = threading.Lock()
+        self.next_time = monotonic()
+
+    def wait(self):
+        # reserve the next start time slot
+        with self.lock:
+            now = monotonic()
+            wait_seconds = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval_seconds
+        if wait_seconds > 0:
+            sleep(wait_seconds)
+
+
+def get_retry_after_seconds(response):
+    # the Retry-After header's delay, given
+    # either in seconds or as an HTTP date
+    retry_after = response.headers.get('Retry-After')
+    if retry_after is None:
+        return None
+    try:
+        return max(float(retry_after), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class HttpClient(object):
+    """
+    Shared HTTP client for the FDSN web service requests: a keep-alive
+    connection pool, connect/read timeouts, a request rate shared by all
+    threads, and retries with exponential backoff and jitter on connection
+    errors and busy (429/5xx) responses, honouring their Retry-After.
+
+    Requests, retries, bytes and latencies are tallied for a summary.
+    """
+
+    def __init__(self, pool_size=10, connect_timeout=10.0, read_timeout=120.0, max_retries=5,
+                 backoff_seconds=1.0, max_backoff_seconds=60.0, requests_per_second=0.0):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max(max_retries, 0)
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.rate_limiter = RateLimiter(requests_per_second)
+
+        # (retries are handled here rather than by the
+        # adapter, so they're paced by the rate limiter)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max(pool_size, 1), pool_maxsize=max(pool_size, 1), max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.retry_count = 0
+        self.failure_count = 0
+        self.byte_count = 0
+        self.latency_seconds = 0.0
+        self.max_latency_seconds = 0.0
+
+    def get_backoff_seconds(self, attempt, retry_after_seconds=None):
+        # full jitter over an exponentially growing ceiling,
+        # unless the server said how long, though no longer
+        # than the ceiling, whatever the server says
+        if retry_after_seconds is not None:
+            return min(retry_after_seconds, self.max_backoff_seconds)
+        return random.uniform(0, min(self.max_backoff_seconds, self.backoff_seconds * 2 ** attempt))
+
+    def backoff(self, attempt, retry_after_seconds=None):
+        sleep(self.get_backoff_seconds(attempt, retry_after_seconds))
+
+    def record(self, latency_seconds, byte_count=0, retried=False, failed=False):
+        with self.lock:
+            self.request_count += 1
+            self.retry_count += 1 if retried else 0
+            self.failure_count += 1 if failed else 0
+            self.byte_count += byte_count
+            self.latency_seconds += latency_seconds
+            self.max_latency_seconds = max(self.max_latency_seconds, latency_seconds)
+        outcome = 'failed' if failed else 'ok'
+        metrics.observe('http_request_seconds', latency_seconds, outcome=outcome)
+        metrics.inc('http_requests_total', outcome=outcome)
+        if retried:
+            metrics.inc('http_retries_total')
+        if byte_count > 0:
+            metrics.inc('http_bytes_total', byte_count)
+
+    def add_bytes(self, byte_count):
+        # bytes read from a streamed response
+        with self.lock:
+            self.byte_count += byte_count
+        metrics.inc('http_bytes_total', byte_count)
+
+    def get(self, url, stream=False):
+        """
+        GET the url, retrying connection errors and busy responses.
+
+        Returns the last response, ok or not, once it is no longer worth
+        retrying; raises the last exception when every attempt failed.
+        A streamed response's body is left for the caller to read, and
+        to report via add_bytes.
+        """
+        attempt = 0
+        while True:
+            self.rate_limiter.wait()
+            bgn_time = monotonic()
+            try:
+                response = self.session.get(url, stream=stream, timeout=(self.connect_timeout, self.read_timeout))
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.record(monotonic() - bgn_time, retried=attempt > 0, failed=True)
+                if attempt >= self.max_retries:
+                    raise
+                print('Retrying after an error:', e)
+                self.backoff(attempt)
+                attempt += 1
+                continue
+
+            byte_count = 0 if stream else len(response.content)
+            retry = response.status_code in retry_status_codes and attempt < self.max_retries
+            self.record(monotonic() - bgn_time, byte_count, retried=attempt > 0, failed=retry)
+            if not retry:
+                return response
+
+            print('Retrying after HTTP %d: %s' % (response.status_code, url))
+            retry_after_seconds = get_retry_after_seconds(response)
+            response.close()
+            self.backoff(attempt, retry_after_seconds)
+            attempt += 1
+
+    def get_message(self):
+        mean_latency_seconds = self.latency_seconds / self.request_count if self.request_count > 0 else 0.0
+        return 'HTTP: {:,} requests, {:,} retries, {:,} failures, {:,} bytes, latency {:,.3f} seconds mean, {:,.3f} seconds max'.format(
+            self.request_count, self.retry_count, self.failure_count, self.byte_count, mean_latency_seconds, self.max_latency_seconds)
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+# ========================================================================
+#
+# Copyright © 2016 Khepry Quixote
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ========================================================================
+
+import csv
+import io
+import json
+import mmap
+import os
+import struct
+import sys
+
+import numpy as np
+import scipy
+
+from scipy.spatial import cKDTree
+
+# index file signature, format version
+# and the byte alignment of its sections
+index_magic = b'QKGEOIDX'
+index_version = 1
+index_alignment = 64
+
+# the reverse_geocoder cities file columns,
+# every one of which is returned per result
+rg_columns = ['lat', 'lon', 'name', 'admin1', 'admin2', 'cc']
+
+
+def get_rg_file_path():
+    # the cities file shipped with (or
+    # extracted by) the reverse_geocoder package
+    import reverse_geocoder as rg
+    rg_file_path = os.path.join(os.path.dirname(rg.__file__), rg.RG_FILE)
+    if not os.path.exists(rg_file_path):
+        # have reverse_geocoder download and extract it
+        rg.RGeocoder(mode=1, verbose=True)
+    return rg_file_path
+
+
+def build_index(index_file_path, rg_file_path=None):
+    if rg_file_path is None:
+        rg_file_path = get_rg_file_path()
+
+    # load the cities file exactly as
+    # reverse_geocoder does, in file order
+    with io.open(rg_file_path, 'rt') as rg_file:
+        csv_reader = csv.DictReader(rg_file)
+        if csv_reader.fieldnames != rg_columns:
+            raise csv.Error('Cities file must have a header containing the columns: %s' % ','.join(rg_columns))
+        locations = list(csv_reader)
+
+    # the K-D tree is built with reverse_geocoder's
+    # default parameters over the same points, so its
+    # structure and nearest neighbors are identical
+    points = np.array([(float(location['lat']), float(location['lon'])) for location in locations], dtype='<f8')
+    tree = cKDTree(points)
+    tree_buffer, tree_data, tree_n, tree_m, tree_leafsize, tree_maxes, tree_mins, tree_indices = tree.__getstate__()[:8]
+
+    sections = [('tree_buffer', np.frombuffer(tree_buffer.tobytes(), dtype='u1')),
+                ('points', np.ascontiguousarray(tree_data, dtype='<f8')),
+                ('maxes', np.ascontiguousarray(tree_maxes, dtype='<f8')),
+                ('mins', np.ascontiguousarray(tree_mins, dtype='<f8')),
+                ('indices', np.ascontiguousarray(tree_indices, dtype='<i8'))]
+
+    # each string column is a UTF-8 blob plus the
+    # offsets of every location's value within it
+    for column in rg_columns:
+        values = [location[column].encode('utf-8') for location in locations]
+        offsets = np.zeros(len(values) + 1, dtype='<u8')
+        offsets[1:] = np.cumsum([len(value) for value in values])
+        sections.append((column + '_offsets', offsets))
+        sections.append((column + '_blob', np.frombuffer(b''.join(values), dtype='u1')))
+
+    header = {'version': index_version,
+              'scipy_version': scipy.__version__,
+              'count': len(locations),
+              'tree_n': tree_n,
+              'tree_m': tree_m,
+              'tree_leafsize': tree_leafsize,
+              'sections': {}}
+
+    # lay the sections out after the header,
+    # each aligned for direct memory-mapping
+    def align(offset):
+        return (offset + index_alignment - 1) // index_alignment * index_alignment
+
+    # (the offsets are recomputed until the
+    # header's own length stops changing)
+    header_bytes = b''
+    while True:
+        offset = align(len(index_magic) + 4 + len(header_bytes))
+        for name, array in sections:
+            header['sections'][name] = {'offset': offset, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+            offset = align(offset + array.nbytes)
+        prev_header_length = len(header_bytes)
+        header_bytes = json.dumps(header, sort_keys=True).encode('utf-8')
+        if len(header_bytes) == prev_header_length:
+            break
+
+    with io.open(index_file_path, 'wb') as index_file:
+        index_file.write(index_magic)
+        index_file.write(struct.pack('<I', len(header_bytes)))
+        index_file.write(header_bytes)
+        for name, array in sections:
+            index_file.write(b'\0' * (header['sections'][name]['offset'] - index_file.tell()))
+            index_file.write(array.tobytes())
+
+    return len(locations)
+
+
+class GeoIndex(object):
+    """
+    Memory-mapped reverse-geocoding index built by build_index.
+
+    The points, the K-D tree's node buffer and the location columns are
+    mapped straight from the index file, so loading it costs milliseconds
+    and concurrent processes share the same pages.  Results are identical
+    to reverse_geocoder's mode 1 search.
+    """
+
+    def __init__(self, index_file_path):
+        self.index_file_path = index_file_path
+
+        with io.open(index_file_path, 'rb') as index_file:
+            self.index_mmap = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.index_mmap[:len(index_magic)] != index_magic:
+            raise ValueError('Not a geocoder index file: "%s"' % index_file_path)
+        header_length = struct.unpack_from('<I', self.index_mmap, len(index_magic))[0]
+        header_offset = len(index_magic) + 4
+        self.header = json.loads(self.index_mmap[header_offset:header_offset + header_length].decode('utf-8'))
+        if self.header['version'] != index_version:
+            raise ValueError('Unsupported geocoder index version %s: "%s"' % (self.header['version'], index_file_path))
+
+        self.arrays = {}
+        for name, section in self.header['sections'].items():
+            dtype = np.dtype(section['dtype'])
+            count = int(np.prod(section['shape'])) if len(section['shape']) > 0 else 1
+            array = np.frombuffer(self.index_mmap, dtype=dtype, count=count, offset=section['offset'])
+            self.arrays[name] = array.reshape(section['shape'])
+
+        self.count = self.header['count']
+        self.tree = self.load_tree()
+
+    def load_tree(self):
+        points = self.arrays['points']
+
+        # restore the tree's nodes from the mapped buffer when
+        # it was built by the same scipy version, otherwise
+        # rebuild the tree over the mapped points
+        if self.header['scipy_version'] == scipy.__version__:
+            try:
+                tree = cKDTree.__new__(cKDTree)
+                tree.__setstate__((self.arrays['tree_buffer'].view('S1'), points,
+                                   self.header['tree_n'], self.header['tree_m'], self.header['tree_leafsize'],
+                                   self.arrays['maxes'], self.arrays['mins'], self.arrays['indices'], None, None))
+                return tree
+            except Exception as e:
+                sys.stderr.write('Rebuilding geocoder index tree: %s\n' % e)
+
+        return cKDTree(points, leafsize=self.header['tree_leafsize'], copy_data=False)
+
+    def get_value(self, column, index):
+        offsets = self.arrays[column + '_offsets']
+        return self.arrays[column + '_blob'][offsets[index]:offsets[index + 1]].tobytes().decode('utf-8')
+
+    def get_location(self, index):
+        return {column: self.get_value(column, index) for column in rg_columns}
+
+    def query(self, coordinates_list):
+        # nearest location for each (latitude, longitude) tuple
+        _, indices = self.tree.query(coordinates_list, k=1)
+        return [self.get_location(index) for index in np.atleast_1d(indices)]
+
+    def close(self):
+        self.tree = None
+        self.arrays = {}
+        self.index_mmap.close()
+
@@ -0,0 +1,443 @@
+# -*- coding: utf-8 -*-
+
+# ========================================================================
+#
+# Copyright © 2016 Khepry Quixote
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ========================================================================
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+
+from collections import Counter
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter, time
+
+# the prefix of the Prometheus metric names
+metric_prefix = 'pyquake_'
+
+# latency histogram bucket upper bounds, in seconds
+latency_buckets = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+profile_choices = ('none', 'cprofile', 'sample')
+
+
+def get_metric_key(name, labels):
+    return name, tuple(sorted(labels.items())) if labels else ()
+
+
+def format_metric(name, label_items, extra_label_items=()):
+    # name{label="value",...}
+    label_items = tuple(label_items) + tuple(extra_label_items)
+    if len(label_items) == 0:
+        return name
+    return '%s{%s}' % (name, ','.join('%s="%s"' % (label, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                                      for label, value in label_items))
+
+
+def format_bucket_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+
+class StageTimer(object):
+    """
+    Times the block it's used around as one of a Metrics registry's
+    stages (a class rather than a generator, costing less per batch).
+    """
+
+    __slots__ = ('metrics', 'stage', 'bgn_time')
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.bgn_time = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.add_stage_seconds(self.stage, perf_counter() - self.bgn_time)
+        return False
+
+
+class Metrics(object):
+    """
+    A run's counters, gauges and histograms, each keyed by a name and
+    labels, safe to update from any thread.  The hot loops update them a
+    batch at a time rather than a row at a time, and per-stage seconds
+    accumulate under stage_seconds_total{stage=...}, so a summary shows
+    where the time goes.  Collectors, called before each report, set the
+    gauges that are cheaper to read than to keep up to date.
+
+    A forked worker process's registry is a copy: it's reset when the
+    worker starts on its share, and its snapshot merged into the parent's.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.collectors = []
+        self.bgn_time = time()
+        # each stage's keys, looked up
+        # rather than built for every batch
+        self.stage_keys = {}
+
+    def inc(self, name, value=1, **labels):
+        key = get_metric_key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        key = get_metric_key(name, labels)
+        with self.lock:
+            self.gauges[key] = value
+
+    def observe(self, name, value, buckets=latency_buckets, **labels):
+        key = get_metric_key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                # bucket bounds, counts (the last
+                # one unbounded), sum and count
+                histogram = self.histograms[key] = [tuple(buckets), [0] * (len(buckets) + 1), 0.0, 0]
+            position = 0
+            while position < len(histogram[0]) and value > histogram[0][position]:
+                position += 1
+            histogram[1][position] += 1
+            histogram[2] += value
+            histogram[3] += 1
+
+    def add_stage_seconds(self, stage, seconds, calls=1):
+        keys = self.stage_keys.get(stage) or self.get_stage_keys(stage)
+        with self.lock:
+            counters = self.counters
+            counters[keys[0]] = counters.get(keys[0], 0) + seconds
+            counters[keys[1]] = counters.get(keys[1], 0) + calls
+
+    def stage(self, stage):
+        # times the block as a stage
+        return StageTimer(self, stage)
+
+    def add_batch(self, stage_seconds, counts):
+        """
+        Adds a batch's (stage, seconds) and its (key, value) counter
+        increments, keyed as by get_metric_key, all under the one lock.
+        """
+        stage_keys = [(self.stage_keys.get(stage) or self.get_stage_keys(stage), seconds) for stage, seconds in stage_seconds]
+        with self.lock:
+            counters = self.counters
+            for (key, calls_key), seconds in stage_keys:
+                counters[key] = counters.get(key, 0) + seconds
+                counters[calls_key] = counters.get(calls_key, 0) + 1
+            for key, value in counts:
+                if value != 0:
+                    counters[key] = counters.get(key, 0) + value
+
+    def get_stage_keys(self, stage):
+        keys = self.stage_keys[stage] = (get_metric_key('stage_seconds_total', {'stage': stage}),
+                                         get_metric_key('stage_calls_total', {'stage': stage}))
+        return keys
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def collect(self):
+        for collector in self.collectors:
+            collector(self)
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.gauges = {}
+            self.histograms = {}
+
+    def snapshot(self):
+        # a picklable copy, e.g. for
+        # a worker process to hand back
+        with self.lock:
+            return {'counters': dict(self.counters),
+                    'gauges': dict(self.gauges),
+                    'histograms': {key: [histogram[0], list(histogram[1]), histogram[2], histogram[3]]
+                                   for key, histogram in self.histograms.items()}}
+
+    def merge(self, snapshot):
+        # add another registry's counters and
+        # histograms (its gauges being its own)
+        with self.lock:
+            for key, value in snapshot['counters'].items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, (buckets, counts, total, count) in snapshot['histograms'].items():
+                histogram = self.histograms.get(key)
+                if histogram is None or histogram[0] != buckets:
+                    self.histograms[key] = [buckets, list(counts), total, count]
+                else:
+                    histogram[1] = [mine + theirs for mine, theirs in zip(histogram[1], counts)]
+                    histogram[2] += total
+                    histogram[3] += count
+
+    def get_counter(self, name, **labels):
+        with self.lock:
+            return self.counters.get(get_metric_key(name, labels), 0)
+
+    def get_stats(self):
+        # a JSON-serializable summary, the metrics
+        # keyed as their Prometheus series are named
+        snapshot = self.snapshot()
+        stats = {'time': datetime.now().isoformat(timespec='seconds'),
+                 'elapsed_seconds': round(time() - self.bgn_time, 3)}
+        for (name, label_items), value in sorted(snapshot['counters'].items()):
+            stats[format_metric(name, label_items)] = round(value, 6) if isinstance(value, float) else value
+        for (name, label_items), value in sorted(snapshot['gauges'].items()):
+            stats[format_metric(name, label_items)] = value
+        for (name, label_items), (buckets, counts, total, count) in sorted(snapshot['histograms'].items()):
+            # cumulative, as Prometheus buckets are, and
+            # as [upper bound, count] pairs kept in order
+            cumulative_counts = []
+            cumulative = 0
+            for bound, bucket_count in zip(tuple(buckets) + (float('inf'),), counts):
+                cumulative += bucket_count
+                cumulative_counts.append([format_bucket_bound(bound), cumulative])
+            stats[format_metric(name, label_items)] = {'count': count, 'sum': round(total, 6), 'buckets': cumulative_counts}
+        return stats
+
+    def get_prometheus_text(self):
+        # the Prometheus text exposition format
+        snapshot = self.snapshot()
+        lines = []
+        for metric_type, series in (('counter', snapshot['counters']), ('gauge', snapshot['gauges'])):
+            previous_name = None
+            for (name, label_items), value in sorted(series.items()):
+                if name != previous_name:
+                    lines.append('# TYPE %s%s %s' % (metric_prefix, name, metric_type))
+                    previous_name = name
+                lines.append('%s %s' % (format_metric(metric_prefix + name, label_items), repr(value)))
+        previous_name = None
+        for (name, label_items), (buckets, counts, total, count) in sorted(snapshot['histograms'].items()):
+            if name != previous_name:
+                lines.append('# TYPE %s%s histogram' % (metric_prefix, name))
+                previous_name = name
+            cumulative = 0
+            for bound, bucket_count in zip(tuple(buckets) + (float('inf'),), counts):
+                cumulative += bucket_count
+                lines.append('%s %d' % (format_metric(metric_prefix + name + '_bucket', label_items, (('le', format_bucket_bound(bound)),)), cumulative))
+            lines.append('%s %s' % (format_metric(metric_prefix + name + '_sum', label_items), repr(total)))
+            lines.append('%s %d' % (format_metric(metric_prefix + name + '_count', label_items), count))
+        return '\n'.join(lines) + '\n'
+
+    def get_message(self):
+        # where the time went, stage by stage
+        with self.lock:
+            stage_seconds = [(dict(label_items)['stage'], value) for (name, label_items), value in self.counters.items()
+                             if name == 'stage_seconds_total']
+        if len(stage_seconds) == 0:
+            return None
+        total_seconds = sum(seconds for stage, seconds in stage_seconds)
+        return 'stages: ' + ', '.join('{} {:,.2f}s ({:.0f}%)'.format(stage, seconds, seconds / total_seconds * 100.0 if total_seconds > 0 else 0.0)
+                                      for stage, seconds in sorted(stage_seconds, key=lambda stage_second: -stage_second[1]))
+
+
+# the process's registry, as updated by the
+# pyquake modules and reported by the scripts
+metrics = Metrics()
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        self.server.metrics.collect()
+        body = self.server.metrics.get_prometheus_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MetricsReporter(object):
+    """
+    Reports a Metrics registry while a script runs: every interval_seconds
+    a JSON stats line, appended to stats_file_path or printed, and the
+    Prometheus text, rewritten to prometheus_file_path (e.g. for the node
+    exporter's textfile collector) and served at /metrics on
+    prometheus_port.  A last report is made on close.
+    """
+
+    def __init__(self, metrics, interval_seconds=0.0, stats_file_path=None, prometheus_file_path=None, prometheus_port=0):
+        self.metrics = metrics
+        self.interval_seconds = interval_seconds
+        self.stats_file_path = stats_file_path
+        self.prometheus_file_path = prometheus_file_path
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.server = None
+
+        if prometheus_port > 0:
+            self.server = ThreadingHTTPServer(('', prometheus_port), MetricsRequestHandler)
+            self.server.daemon_threads = True
+            self.server.metrics = metrics
+            threading.Thread(target=self.server.serve_forever, name='MetricsServer', daemon=True).start()
+            print('Serving metrics on: "http://%s:%d/metrics"' % (self.server.server_address[0] or 'localhost', self.server.server_address[1]))
+
+        # the Prometheus file is kept fresh
+        # even without periodic stats lines
+        report_seconds = interval_seconds if interval_seconds > 0 else (10.0 if prometheus_file_path is not None else 0.0)
+        if report_seconds > 0:
+            self.thread = threading.Thread(target=self.run, args=(report_seconds,), name='MetricsReporter', daemon=True)
+            self.thread.start()
+
+    @classmethod
+    def from_args(cls, args):
+        # the reporter configured by the scripts'
+        # --stats-* and --metrics-* options
+        return cls(metrics,
+                   interval_seconds=args.stats_seconds,
+                   stats_file_path=args.stats_file_path,
+                   prometheus_file_path=args.metrics_file_path,
+                   prometheus_port=args.metrics_port)
+
+    def run(self, report_seconds):
+        while not self.stop_event.wait(report_seconds):
+            self.report()
+
+    def report(self, final=False):
+        self.metrics.collect()
+        if self.interval_seconds > 0 or (final and self.stats_file_path is not None):
+            line = json.dumps(self.metrics.get_stats(), sort_keys=True)
+            if self.stats_file_path is not None:
+                with io.open(self.stats_file_path, 'a') as stats_file:
+                    stats_file.write(line + '\n')
+            else:
+                print(line)
+                sys.stdout.flush()
+        if self.prometheus_file_path is not None:
+            # written aside and then swapped in,
+            # so a scrape never reads half a file
+            tmp_file_path = self.prometheus_file_path + '.tmp'
+            with io.open(tmp_file_path, 'w') as prometheus_file:
+                prometheus_file.write(self.metrics.get_prometheus_text())
+            os.replace(tmp_file_path, self.prometheus_file_path)
+
+    def close(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.report(final=True)
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+class Profiler(object):
+    """
+    Profiles the block it's used around: cProfile, tracing every call on
+    the calling thread, or a sampling profile of all the threads' stacks
+    every sample_seconds, cheap enough to leave on and covering the stage
+    and indexer threads too.  The cProfile statistics are saved for
+    pstats or snakeviz, the samples as folded stacks for flamegraph.pl or
+    speedscope, and the top functions printed either way.
+    """
+
+    def __init__(self, mode='none', file_path=None, sample_seconds=0.005, top=25):
+        self.mode = mode
+        self.file_path = file_path
+        self.sample_seconds = sample_seconds
+        self.top = top
+        self.profile = None
+        self.samples = Counter()
+        self.sample_count = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    @classmethod
+    def from_args(cls, args, pgm_name):
+        # the profiler configured by the
+        # scripts' --profile options
+        file_path = args.profile_file_path
+        if file_path is None and args.profile != 'none':
+            file_path = os.path.splitext(pgm_name)[0] + ('.prof' if args.profile == 'cprofile' else '.folded')
+        return cls(args.profile, file_path)
+
+    def __enter__(self):
+        if self.mode == 'cprofile':
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        elif self.mode == 'sample':
+            self.thread = threading.Thread(target=self.sample, name='Profiler', daemon=True)
+            self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.mode == 'cprofile':
+            self.profile.disable()
+            self.profile.dump_stats(self.file_path)
+            print('Profile saved to: "%s", the top %d functions by cumulative time:' % (self.file_path, self.top))
+            pstats.Stats(self.profile).sort_stats('cumulative').print_stats(self.top)
+        elif self.mode == 'sample':
+            self.stop_event.set()
+            self.thread.join()
+            self.save_samples()
+        return False
+
+    def sample(self):
+        own_thread_id = threading.get_ident()
+        while not self.stop_event.wait(self.sample_seconds):
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('%s:%s:%d' % (os.path.basename(code.co_filename), code.co_name, code.co_firstlineno))
+                    frame = frame.f_back
+                stack.append(thread_names.get(thread_id, str(thread_id)))
+                self.samples[';'.join(reversed(stack))] += 1
+            self.sample_count += 1
+
+    def save_samples(self):
+        with io.open(self.file_path, 'w') as folded_file:
+            for stack, count in sorted(self.samples.items()):
+                folded_file.write('%s %d\n' % (stack, count))
+
+        # the functions on the most stacks sampled, and
+        # those most often running (at the top of a stack),
+        # as shares of all the threads' stacks sampled
+        total_counts = Counter()
+        self_counts = Counter()
+        for stack, count in self.samples.items():
+            frames = stack.split(';')
+            for frame in set(frames[1:]):
+                total_counts[frame] += count
+            self_counts[frames[-1]] += count
+        stack_count = max(sum(self.samples.values()), 1)
+        print('Profile of {:,} samples ({:,} thread stacks) saved to: "{}", the top {:d} functions:'.format(
+            self.sample_count, stack_count, self.file_path, self.top))
+        print('{:>8} {:>8}  {}'.format('self', 'total', 'function'))
+        for frame, count in self_counts.most_common(self.top):
+            print('{:>7.1f}% {:>7.1f}%  {}'.format(count * 100.0 / stack_count, total_counts[frame] * 100.0 / stack_count, frame))
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+# ========================================================================
+#
+# Copyright © 2016 Khepry Quixote
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ========================================================================
+
+import csv
+import io
+
+from .elastic import BulkIndexer, create_load_index, finish_load_index, get_quake_doc
+
+
+def open_out_file(out_file_path, encoding, args):
+    # Parquet is written as binary
+    if args.out_format == 'parquet':
+        return io.open(out_file_path, 'wb')
+    return io.open(out_file_path, 'w', newline='', encoding=encoding)
+
+
+def open_row_writer(out_file, fieldnames, args):
+    # the target file's row writer,
+    # CSV or a typed Parquet schema
+    if args.out_format == 'parquet':
+        from .parquet import ParquetRowWriter
+        return ParquetRowWriter(out_file, fieldnames, args.dtg_parse_pattern, args.out_date_ymd_separator, args.out_row_group_rows)
+    return csv.writer(out_file, delimiter=args.out_delimiter, quotechar=args.out_quotechar, quoting=args.out_quotemode_enm)
+
+
+class RowOutput(object):
+    """
+    Output of the geocoded rows: the target file's CSV or Parquet writer
+    and, given an ElasticSearch client, a fresh versioned index the rows
+    are bulk indexed into, its alias being swapped to it by finish.  A
+    load that fails is aborted, deleting the index rather than leaving it
+    behind without refreshes or replicas.
+    """
+
+    def __init__(self, out_file, fieldnames, args, es=None, write_header=True):
+        self.fieldnames = fieldnames
+        self.args = args
+        self.es = es
+        self.es_indexer = None
+        self.es_load_index_name = None
+        self.out_count = 0
+
+        # instantiate the CSV (or Parquet) writer object
+        self.row_writer = open_row_writer(out_file, fieldnames, args)
+
+        # output the header row
+        if write_header and args.out_header_row == 'Y' and args.out_format == 'csv':
+            self.row_writer.writerow(fieldnames)
+
+        if es is not None:
+            # load a fresh versioned index, the alias
+            # still pointing at the previous one meanwhile
+            self.es_load_index_name = create_load_index(es, args.es_index_name, fieldnames, args.out_date_ymd_separator)
+            print('Loading ElasticSearch index: %s' % self.es_load_index_name)
+            # index in the background as rows are output
+            self.es_indexer = BulkIndexer(es, self.es_load_index_name,
+                                          chunk_docs=args.es_bulk_docs,
+                                          chunk_bytes=args.es_bulk_bytes,
+                                          threads=args.es_bulk_threads,
+                                          queue_size=args.es_bulk_queue_size,
+                                          max_retries=args.es_bulk_retries)
+
+    def write_rows(self, pending_rows, row_transform):
+        # row-by-row, in original source order
+        for row_number, record, coordinates in pending_rows:
+            self.row_writer.writerow(record)
+            self.out_count += 1
+            if self.es_indexer is not None:
+                # queued for the bulk indexer's threads,
+                # identified by the ComCat event id
+                doc = get_quake_doc(row_transform.get_dict(record), coordinates[0], coordinates[1], self.args.out_es_null_value)
+                self.es_indexer.add(doc.get('Event_ID') or self.out_count, doc)
+
+    def close(self):
+        # write the last row group
+        # and the Parquet footer
+        if self.args.out_format == 'parquet':
+            try:
+                self.row_writer.close()
+            except BaseException:
+                self.abort()
+                raise
+
+    def finish(self):
+        # wait for the last bulk requests, then
+        # swap the alias to the loaded index
+        # unless some documents failed to load
+        if self.es_indexer is None:
+            return
+        args = self.args
+        try:
+            self.es_indexer.close()
+        except Exception:
+            self.abort()
+            raise
+        if self.es_indexer.failed_docs > 0:
+            print('ElasticSearch alias "{}" not swapped, {:,} documents failed to load'.format(args.es_index_name, self.es_indexer.failed_docs))
+            self.abort()
+        else:
+            old_index_names = finish_load_index(self.es, self.es_load_index_name, args.es_index_name,
+                                                replicas=args.es_replicas,
+                                                refresh_interval=args.es_refresh_interval,
+                                                keep_old_indices=args.es_keep_old_indices == 'Y')
+            print('ElasticSearch alias "%s" swapped to: %s, from: %s' % (args.es_index_name, self.es_load_index_name, ', '.join(old_index_names) or 'none'))
+
+    def abort(self):
+        # stop indexing and delete the load index,
+        # the alias still pointing at the previous one
+        if self.es_indexer is None:
+            return
+        self.es_indexer.abort()
+        try:
+            self.es.indices.delete(index=self.es_load_index_name, ignore=[404])
+            print('ElasticSearch load index deleted: %s' % self.es_load_index_name)
+        except Exception as e:
+            print('ElasticSearch load index not deleted: %s, %s' % (self.es_load_index_name, e))
+
+    def get_message(self):
+        if self.es_indexer is not None:
+            return self.es_indexer.get_message()
+        return None
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+# ========================================================================
+#
+# Copyright © 2016 Khepry Quixote
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ========================================================================
+
+import datetime
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .rows import parse_comcat_dtgs
+
+# column types of the geocoded catalog, any other
+# column is kept as a string (the DTGs are to the
+# second, as the rows reformat them for output,
+# though Parquet stores them as milliseconds,
+# its coarsest unit)
+timestamp_type = pa.timestamp('s', tz='UTC')
+category_type = pa.dictionary(pa.int32(), pa.string())
+
+column_types = {
+    'Event_DTG': timestamp_type,
+    'Updated_DTG': timestamp_type,
+    'latitude': pa.float32(),
+    'longitude': pa.float32(),
+    'depth': pa.float32(),
+    'mag': pa.float32(),
+    'gap': pa.float32(),
+    'dmin': pa.float32(),
+    'rms': pa.float32(),
+    'horizontalError': pa.float32(),
+    'depthError': pa.float32(),
+    'magError': pa.float32(),
+    'nst': pa.int32(),
+    'magNst': pa.int32(),
+    'Event_Year': pa.int16(),
+    'Event_Month': pa.int8(),
+    'Event_Day': pa.int8(),
+    'Event_Hour': pa.int8(),
+    'Event_Min': pa.int8(),
+    'Event_Sec': pa.int8(),
+    'magInt': pa.int8(),
+    'magType': category_type,
+    'net': category_type,
+    'type': category_type,
+    'status': category_type,
+    'locationSource': category_type,
+    'magSource': category_type,
+    'cc': category_type,
+    'admin1': category_type,
+    'admin2': category_type,
+    'name': category_type,
+}
+for mag_bin in range(10):
+    column_types['mag%d' % mag_bin] = pa.int8()
+
+
+def get_schema(fieldnames):
+    return pa.schema([pa.field(fieldname, column_types.get(fieldname, pa.string())) for fieldname in fieldnames])
+
+
+def to_float(value):
+    # numbers, or None for empty
+    # strings and null values
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_int(value):
+    value = to_float(value)
+    return int(value) if value is not None else None
+
+
+def to_string(value):
+    return str(value) if value is not None else None
+
+
+class ParquetRowWriter(object):
+    """
+    Writes geocoded rows, given as lists in field name order like
+    csv.writer's, to a Parquet file with a typed schema: UTC timestamps,
+    float32 coordinates and measurements, small integers for the date parts
+    and magnitude bins, and dictionary-encoded (categorical) strings for
+    the repetitive columns.
+
+    Rows are buffered by column and written a row group at a time.
+    """
+
+    def __init__(self, out_file, fieldnames, dtg_parse_pattern, ymd_separator='-', row_group_rows=100000):
+        self.fieldnames = list(fieldnames)
+        self.dtg_parse_pattern = dtg_parse_pattern
+        self.ymd_separator = ymd_separator
+        self.row_group_rows = max(row_group_rows, 1)
+        self.schema = get_schema(self.fieldnames)
+        self.parquet_writer = pq.ParquetWriter(out_file, self.schema)
+
+        # each column's value converter
+        self.converters = []
+        for field in self.schema:
+            if field.type == timestamp_type:
+                self.converters.append(None)
+            elif pa.types.is_floating(field.type):
+                self.converters.append(to_float)
+            elif pa.types.is_integer(field.type):
+                self.converters.append(to_int)
+            else:
+                self.converters.append(to_string)
+
+        self.columns = [[] for _ in self.fieldnames]
+        self.row_count = 0
+
+    def to_timestamps(self, column):
+        # the DTGs as reformatted for output (or as found
+        # in the source file) parsed as a batch, any others
+        # by the DTG pattern, or else left null
+        dtgs = parse_comcat_dtgs(column, self.ymd_separator)
+        for position in np.flatnonzero(np.isnat(dtgs)):
+            value = column[position]
+            if isinstance(value, str) and value.strip() != '':
+                try:
+                    dtgs[position] = np.datetime64(datetime.datetime.strptime(value.strip(), self.dtg_parse_pattern), 's')
+                except ValueError:
+                    pass
+        return pa.array(dtgs, type=timestamp_type, from_pandas=True)
+
+    def writerow(self, record):
+        for column, value in zip(self.columns, record):
+            column.append(value)
+        self.row_count += 1
+        if self.row_count >= self.row_group_rows:
+            self.write_row_group()
+
+    def write_row_group(self):
+        if self.row_count == 0:
+            return
+        arrays = []
+        for column, converter, field in zip(self.columns, self.converters, self.schema):
+            if field.type == timestamp_type:
+                arrays.append(self.to_timestamps(column))
+            elif pa.types.is_dictionary(field.type):
+                arrays.append(pa.array([converter(value) for value in column], type=pa.string()).dictionary_encode())
+            else:
+                arrays.append(pa.array([converter(value) for value in column], type=field.type))
+        self.parquet_writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+        self.columns = [[] for _ in self.fieldnames]
+        self.row_count = 0
+
+    def write_file(self, parquet_file_path):
+        # append the row groups of another (e.g.
+        # a worker's shard) file of the same schema
+        self.write_row_group()
+        parquet_file = pq.ParquetFile(parquet_file_path)
+        for row_group in range(parquet_file.num_row_groups):
+            self.parquet_writer.write_table(parquet_file.read_row_group(row_group).cast(self.schema))
+
+    def close(self):
+        self.write_row_group()
+        self.parquet_writer.close()
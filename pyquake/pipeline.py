@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+
+# ========================================================================
+#
+# Copyright © 2016 Khepry Quixote
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ========================================================================
+
+import csv
+import queue
+import sys
+import threading
+
+from time import perf_counter, time
+
+from .metrics import metrics
+from .output import RowOutput
+from .rows import RowTransform, get_out_fieldnames
+
+# marks the end of a stage's items
+end_of_stream = object()
+
+
+class PipelineStopped(Exception):
+    """
+    Raised within a stage when another stage has failed.
+    """
+    pass
+
+
+class Pipeline(object):
+    """
+    Runs a source and the stages following it each in its own thread,
+    every stage handing its items (batches of rows) to the next through a
+    bounded queue, so a slow stage holds back the ones before it rather
+    than letting batches pile up in memory.  The last stage's items are
+    yielded to whoever iterates over the pipeline, i.e. the sink.
+
+    A source is called without arguments, any other stage with an
+    iterator over the previous stage's items; both return an iterable.
+    The first stage to fail stops them all, its exception being raised
+    to the sink.
+
+    The time each stage spends waiting on its queues is kept apart from
+    its busy time, so the metrics show the bottleneck: busy throughout,
+    while the stages around it wait.
+    """
+
+    def __init__(self, queue_size=4, poll_seconds=0.5):
+        self.queue_size = max(queue_size, 1)
+        self.poll_seconds = poll_seconds
+        self.stages = []
+        self.queues = []
+        self.threads = []
+        self.stop_event = threading.Event()
+        self.exceptions = []
+
+    def add_stage(self, name, stage):
+        self.stages.append((name, stage))
+
+    def put(self, out_queue, item, name):
+        # wait for room on the queue,
+        # unless the pipeline is stopping
+        bgn_time = perf_counter()
+        while not self.stop_event.is_set():
+            try:
+                out_queue.put(item, timeout=self.poll_seconds)
+                metrics.inc('pipeline_wait_seconds_total', perf_counter() - bgn_time, stage=name, queue='out')
+                return
+            except queue.Full:
+                pass
+        raise PipelineStopped()
+
+    def get_items(self, in_queue, name):
+        # the previous stage's items, until its end of
+        # stream, unless the pipeline is stopping
+        while True:
+            bgn_time = perf_counter()
+            try:
+                item = in_queue.get(timeout=self.poll_seconds)
+            except queue.Empty:
+                metrics.inc('pipeline_wait_seconds_total', perf_counter() - bgn_time, stage=name, queue='in')
+                if self.stop_event.is_set():
+                    raise PipelineStopped()
+                continue
+            metrics.inc('pipeline_wait_seconds_total', perf_counter() - bgn_time, stage=name, queue='in')
+            if item is end_of_stream:
+                return
+            yield item
+
+    def run_stage(self, name, stage, in_queue, out_queue):
+        bgn_time = perf_counter()
+        try:
+            items = stage() if in_queue is None else stage(self.get_items(in_queue, name))
+            for item in items:
+                self.put(out_queue, item, name)
+            self.put(out_queue, end_of_stream, name)
+        except PipelineStopped:
+            pass
+        except Exception as e:
+            sys.stderr.write('Pipeline stage %s failed: %s\n' % (name, e))
+            self.exceptions.append((name, e))
+            self.stop_event.set()
+        finally:
+            # the stage's time, less its waits
+            wait_seconds = metrics.get_counter('pipeline_wait_seconds_total', stage=name, queue='in') + \
+                metrics.get_counter('pipeline_wait_seconds_total', stage=name, queue='out')
+            metrics.inc('pipeline_busy_seconds_total', max(perf_counter() - bgn_time - wait_seconds, 0.0), stage=name)
+
+    def __iter__(self):
+        in_queue = None
+        for name, stage in self.stages:
+            out_queue = queue.Queue(maxsize=self.queue_size)
+            thread = threading.Thread(target=self.run_stage, args=(name, stage, in_queue, out_queue), name=name, daemon=True)
+            thread.start()
+            self.queues.append(out_queue)
+            self.threads.append(thread)
+            in_queue = out_queue
+
+        try:
+            for item in self.get_items(in_queue, 'output'):
+                yield item
+        except PipelineStopped:
+            pass
+        finally:
+            # the sink's failing (or giving
+            # up early) stops the stages too
+            if len(self.exceptions) == 0 and any(thread.is_alive() for thread in self.threads):
+                self.stop_event.set()
+            for thread in self.threads:
+                thread.join()
+
+        if len(self.exceptions) > 0:
+            name, e = self.exceptions[0]
+            raise RuntimeError('Pipeline stage %s failed: %s' % (name, e)) from e
+
+    def get_message(self):
+        # the batches waiting between the stages,
+        # the bottleneck's queue being the emptiest
+        # after it and the fullest before it
+        return 'queued: ' + ', '.join('%s %d/%d' % (name, out_queue.qsize(), self.queue_size)
+                                      for (name, stage), out_queue in zip(self.stages, self.queues))
+
+    def collect_metrics(self, metrics):
+        # the batches queued after each stage
+        for (name, stage), out_queue in zip(self.stages, self.queues):
+            metrics.set_gauge('pipeline_queued_batches', out_queue.qsize(), stage=name)
+
+
+class RowNormalizer(object):
+    """
+    The normalize stage: parses each batch of lines, the first being the
+    header from which the output columns and the row transform are set
+    up, then normalizes the rows, yielding batches of the (row number,
+    record, coordinates) of the rows with valid DTGs.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.src_fieldnames = None
+        self.fieldnames = None
+        self.row_transform = None
+        self.row_count = 0
+
+    def __call__(self, line_batches):
+        for lines in line_batches:
+            pending_rows = []
+            row_count = self.row_count
+            bgn_time = perf_counter()
+            # (ComCat CSV rows never contain
+            # embedded line breaks)
+            for src_row in csv.reader(lines):
+                # skip blank lines
+                if not src_row:
+                    continue
+
+                if self.row_transform is None:
+                    # rename some and append various
+                    # deriviative fields to field names list
+                    self.src_fieldnames = src_row
+                    self.fieldnames = get_out_fieldnames(src_row)
+                    self.row_transform = RowTransform(self.fieldnames, len(src_row), self.args)
+                    continue
+
+                self.row_count += 1
+                record = self.row_transform.get_record(src_row)
+                coordinates = self.row_transform(record)
+
+                # only output rows with valid DTGs
+                if coordinates is not None:
+                    pending_rows.append((self.row_count, record, coordinates))
+
+            metrics.add_stage_seconds('transform', perf_counter() - bgn_time)
+            metrics.inc('rows_read_total', self.row_count - row_count)
+            if len(pending_rows) < self.row_count - row_count:
+                metrics.inc('rows_dropped_total', self.row_count - row_count - len(pending_rows), reason='invalid_dtg')
+
+            # (the header's empty batch lets the sink
+            # set up its output before any rows arrive)
+            yield pending_rows
+
+
+class BatchGeocoder(object):
+    """
+    The geocode stage: reverse-geocodes each batch of rows with a single
+    K-D tree query, through the geocoder's cache if it has one, whose last
+    geocodes are flushed, and connection closed, by the stage's thread.
+    """
+
+    def __init__(self, row_normalizer, geocoder):
+        self.row_normalizer = row_normalizer
+        self.geocoder = geocoder
+
+    def __call__(self, row_batches):
+        try:
+            for pending_rows in row_batches:
+                with metrics.stage('geocode'):
+                    self.geocoder.geocode_rows(pending_rows, self.row_normalizer.row_transform)
+                yield pending_rows
+        finally:
+            self.geocoder.close_cache()
+
+
+def output_row_batches(pipeline, row_normalizer, out_file, args, es=None, geocoder=None):
+    """
+    The sink: outputs the pipeline's batches of geocoded rows as they
+    arrive, flushing each batch and reporting progress every
+    args.flush_rows rows.  Returns the row output, whose close and finish
+    remain to be called.
+    """
+    bgn_time = time()
+    next_message_count = args.flush_rows
+    row_output = None
+
+    # a failed load's index is deleted
+    try:
+        for pending_rows in pipeline:
+
+            if row_output is None:
+                # the header has been read, so the
+                # output columns are known by now
+                row_output = RowOutput(out_file, row_normalizer.fieldnames, args, es)
+
+            # each batch is flushed as it's
+            # output, seconds after it was fetched
+            with metrics.stage('write'):
+                row_output.write_rows(pending_rows, row_normalizer.row_transform)
+                if args.out_format == 'csv':
+                    out_file.flush()
+            metrics.inc('rows_output_total', len(pending_rows))
+
+            if row_output.out_count >= next_message_count:
+                next_message_count = (row_output.out_count // args.flush_rows + 1) * args.flush_rows
+                seconds = time() - bgn_time
+                message = "Output: {:,} rows in {:,.0f} seconds @ {:,.0f} records/second".format(
+                    row_output.out_count, seconds, row_output.out_count / seconds if seconds > 0 else 0)
+                for other_message in (pipeline.get_message(), geocoder.get_message() if geocoder is not None else None, row_output.get_message()):
+                    if other_message is not None:
+                        message += ', ' + other_message
+                print(message)
+    except BaseException:
+        if row_output is not None:
+            row_output.abort()
+        raise
+
+    return row_output
@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+
+# ========================================================================
+#
+# Copyright © 2016 Khepry Quixote
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ========================================================================
+
+import datetime
+
+import numpy as np
+
+from time import perf_counter
+
+# source columns renamed for output
+renamed_fieldnames = [('time', 'Event_DTG'), ('id', 'Event_ID'), ('updated', 'Updated_DTG')]
+
+# derivative columns appended to the
+# output columns, unless already there
+derived_fieldnames = ['Event_Year', 'Event_Month', 'Event_Day', 'Event_Hour', 'Event_Min', 'Event_Sec',
+                      'cc', 'admin1', 'admin2', 'name',
+                      'magInt', 'mag0', 'mag1', 'mag2', 'mag3', 'mag4', 'mag5', 'mag6', 'mag7', 'mag8', 'mag9']
+
+# the DTG pattern of reformatted ComCat DTGs,
+# parsed by fixed offsets rather than strptime
+default_dtg_parse_pattern = '%Y-%m-%d %H:%M:%S'
+
+# the one-hot magnitude bins, by integer magnitude
+mag_bins = tuple(tuple(1 if mag_bin == magInt else 0 for mag_bin in range(10)) for magInt in range(10))
+no_mag_bins = (0,) * 10
+
+
+def get_out_fieldnames(src_fieldnames):
+    fieldnames = list(src_fieldnames)
+    for src_fieldname, out_fieldname in renamed_fieldnames:
+        if src_fieldname in fieldnames:
+            fieldnames[fieldnames.index(src_fieldname)] = out_fieldname
+    present_fieldnames = set(fieldnames)
+    for fieldname in derived_fieldnames:
+        if fieldname not in present_fieldnames:
+            fieldnames.append(fieldname)
+    return fieldnames
+
+
+def is_comcat_dtg_form(value, ymd_separator='-'):
+    # digits and separators at their fixed offsets, followed
+    # by nothing, a Z or a fraction of a second and any Z
+    if len(value) < 19 or value[4] != ymd_separator or value[7] != ymd_separator or value[10] not in 'T ' or value[13] != ':' or value[16] != ':':
+        return False
+    digits = value[:4] + value[5:7] + value[8:10] + value[11:13] + value[14:16] + value[17:19]
+    if not (digits.isdigit() and digits.isascii()):
+        return False
+    tail = value[19:]
+    if tail.endswith('Z'):
+        tail = tail[:-1]
+    return tail == '' or (tail[0] == '.' and tail[1:].isdigit() and tail.isascii())
+
+
+def parse_comcat_dtg(value, ymd_separator='-'):
+    """
+    Parses a ComCat ISO-8601 DTG, e.g. 2019-12-31T23:59:59.130Z, by its
+    fixed offsets, ignoring any fraction of a second and the Z, and
+    accepting a space in place of the T.  Returns a datetime, or None.
+    """
+    if not is_comcat_dtg_form(value, ymd_separator):
+        return None
+    if ymd_separator != '-':
+        value = value.replace(ymd_separator, '-')
+    try:
+        return datetime.datetime.fromisoformat(value[:19])
+    except ValueError:
+        return None
+
+
+def parse_comcat_dtgs(values, ymd_separator='-'):
+    """
+    Batch variant of parse_comcat_dtg, parsed by numpy in a single pass
+    into a datetime64[s] array holding NaT for any value that isn't a DTG.
+    The values are checked as parse_comcat_dtg checks them, so the two
+    agree on every value.
+    """
+    dtgs = []
+    for value in values:
+        if isinstance(value, str) and is_comcat_dtg_form(value, ymd_separator):
+            dtgs.append(value[:19] if ymd_separator == '-' else value[:19].replace(ymd_separator, '-'))
+        else:
+            dtgs.append('NaT')
+    try:
+        return np.array(dtgs, dtype='datetime64[s]')
+    except ValueError:
+        # a malformed value among them,
+        # so parse them one by one
+        return np.array([np.datetime64(parse_comcat_dtg(value) or 'NaT', 's') for value in dtgs], dtype='datetime64[s]')
+
+
+def format_comcat_dtg(value, src_ymd_separator, out_ymd_separator):
+    # YYYY-MM-DD HH:MM:SS, more suitable for
+    # importation into databases, from a DTG
+    # already known to parse
+    return value[:10].replace(src_ymd_separator, out_ymd_separator) + ' ' + value[11:19]
+
+
+def reformat_dtg(value, src_ymd_separator, out_ymd_separator):
+    # reformat a ComCat DTG, leaving any other value as is
+    value = value.strip()
+    if parse_comcat_dtg(value, src_ymd_separator) is not None:
+        return format_comcat_dtg(value, src_ymd_separator, out_ymd_separator)
+    return value
+
+
+def get_datetime_value(value, pattern, null_value):
+    value = value.strip()
+    try:
+        value = datetime.datetime.strptime(value, pattern)
+    except ValueError:
+        value = null_value
+    return value
+
+
+def get_float_value(value, null_value):
+    value = value.strip()
+    if value != '':
+        try:
+            rtn_value = float(value)
+        except:
+            rtn_value = null_value
+    else:
+        rtn_value = null_value
+    return rtn_value
+
+
+def get_int_value(value, null_value):
+    value = value.strip()
+    if value != '':
+        try:
+            rtn_value = int(float(value))
+        except:
+            rtn_value = null_value
+    else:
+        rtn_value = null_value
+    return rtn_value
+
+
+def get_magnitude_values(value, null_value):
+    mag = 0
+    magInt = 0
+    mags = [0] * 10
+
+    value = value.strip()
+
+    if value != '':
+        try:
+            mag = float(value)
+            if mag < 0:
+                mag = 0.0
+            magInt = int(mag)
+            mags[magInt] = 1
+        except:
+            pass
+
+    return mag, magInt, mags
+
+
+def normalize_dict_row(row, args):
+    """
+    The former per-row dictionary transform, kept as the
+    reference the row transform is benchmarked and checked against.
+    """
+    # tweak column to null
+    # if it's not a valid date-time stamp
+    row['Event_DTG'] = reformat_dtg(row['Event_DTG'], args.src_date_ymd_separator, args.out_date_ymd_separator)
+    row['Updated_DTG'] = reformat_dtg(row['Updated_DTG'], args.src_date_ymd_separator, args.out_date_ymd_separator)
+    event_dtg = get_datetime_value(row['Event_DTG'], args.dtg_parse_pattern, args.out_db_null_value)
+    # only output rows with valid DTGs
+    if event_dtg == args.out_db_null_value:
+        return None
+
+    row['Event_Year'] = event_dtg.year
+    row['Event_Month'] = event_dtg.month
+    row['Event_Day'] = event_dtg.day
+    row['Event_Hour'] = event_dtg.hour
+    row['Event_Min'] = event_dtg.minute
+    row['Event_Sec'] = event_dtg.second
+
+    row['depth'] = get_float_value(row['depth'], args.out_db_null_value)
+    row['nst'] = get_int_value(row['nst'], args.out_db_null_value)
+    row['gap'] = get_float_value(row['gap'], args.out_db_null_value)
+    row['dmin'] = get_float_value(row['dmin'], args.out_db_null_value)
+
+    row['mag'], row['magInt'], mags = get_magnitude_values(row['mag'], args.out_db_null_value)
+    for mag_bin in range(10):
+        row['mag%d' % mag_bin] = mags[mag_bin]
+
+    row.pop('DateTime', None)
+
+    latitude = float(row['latitude'])
+    longitude = float(row['longitude'])
+
+    row['latitude'] = get_float_value(row['latitude'], args.out_db_null_value)
+    row['longitude'] = get_float_value(row['longitude'], args.out_db_null_value)
+
+    return latitude, longitude
+
+
+class RowTransform(object):
+    """
+    Positional row transform: the column indexes are resolved once from
+    the output field names, and each row, a list in output column order,
+    is normalized in place without any per-row dictionary.
+    """
+
+    __slots__ = ('fieldnames', 'width', 'src_width', 'null_value', 'dtg_parse_pattern', 'custom_dtg_parse_pattern',
+                 'src_date_ymd_separator', 'out_date_ymd_separator',
+                 'event_dtg', 'updated_dtg', 'event_year', 'latitude', 'longitude',
+                 'depth', 'nst', 'gap', 'dmin', 'mag', 'mag_int', 'mag_bins', 'date_time',
+                 'cc', 'admin1', 'admin2', 'name')
+
+    def __init__(self, fieldnames, src_width, args):
+        self.fieldnames = list(fieldnames)
+        self.width = len(self.fieldnames)
+        self.src_width = src_width
+        self.null_value = args.out_db_null_value
+        self.dtg_parse_pattern = args.dtg_parse_pattern
+        self.custom_dtg_parse_pattern = args.dtg_parse_pattern != default_dtg_parse_pattern
+        self.src_date_ymd_separator = args.src_date_ymd_separator
+        self.out_date_ymd_separator = args.out_date_ymd_separator
+
+        index = {fieldname: position for position, fieldname in reversed(list(enumerate(self.fieldnames)))}
+        self.event_dtg = index['Event_DTG']
+        self.updated_dtg = index['Updated_DTG']
+        self.event_year = [index[fieldname] for fieldname in ('Event_Year', 'Event_Month', 'Event_Day', 'Event_Hour', 'Event_Min', 'Event_Sec')]
+        self.latitude = index['latitude']
+        self.longitude = index['longitude']
+        self.depth = index['depth']
+        self.nst = index['nst']
+        self.gap = index['gap']
+        self.dmin = index['dmin']
+        self.mag = index['mag']
+        self.mag_int = index['magInt']
+        self.mag_bins = [index['mag%d' % mag_bin] for mag_bin in range(10)]
+        self.date_time = index.get('DateTime')
+        self.cc = index['cc']
+        self.admin1 = index['admin1']
+        self.admin2 = index['admin2']
+        self.name = index['name']
+
+    def get_record(self, src_row):
+        # the source values, padded out
+        # with the derivative columns
+        if len(src_row) > self.src_width:
+            del src_row[self.src_width:]
+        src_row.extend([''] * (self.width - len(src_row)))
+        return src_row
+
+    def __call__(self, record):
+        """
+        Normalizes the record in place, returning its (latitude,
+        longitude) or None if it's not a valid date-time stamp.
+        """
+        null_value = self.null_value
+        src_date_ymd_separator = self.src_date_ymd_separator
+
+        value = record[self.updated_dtg].strip()
+        if parse_comcat_dtg(value, src_date_ymd_separator) is not None:
+            record[self.updated_dtg] = format_comcat_dtg(value, src_date_ymd_separator, self.out_date_ymd_separator)
+
+        value = record[self.event_dtg].strip()
+        event_dtg = parse_comcat_dtg(value, src_date_ymd_separator)
+        if event_dtg is not None:
+            record[self.event_dtg] = format_comcat_dtg(value, src_date_ymd_separator, self.out_date_ymd_separator)
+
+        # a custom pattern parses the (reformatted) DTG
+        if self.custom_dtg_parse_pattern:
+            try:
+                event_dtg = datetime.datetime.strptime(record[self.event_dtg].strip(), self.dtg_parse_pattern)
+            except ValueError:
+                event_dtg = None
+
+        # only output rows with valid DTGs
+        if event_dtg is None:
+            return None
+
+        year, month, day, hour, minute, second = self.event_year
+        record[year] = event_dtg.year
+        record[month] = event_dtg.month
+        record[day] = event_dtg.day
+        record[hour] = event_dtg.hour
+        record[minute] = event_dtg.minute
+        record[second] = event_dtg.second
+
+        record[self.depth] = get_float_value(record[self.depth], null_value)
+        record[self.nst] = get_int_value(record[self.nst], null_value)
+        record[self.gap] = get_float_value(record[self.gap], null_value)
+        record[self.dmin] = get_float_value(record[self.dmin], null_value)
+
+        mag = 0
+        magInt = 0
+        bins = no_mag_bins
+        value = record[self.mag].strip()
+        if value != '':
+            try:
+                mag = float(value)
+                if mag < 0:
+                    mag = 0.0
+                magInt = int(mag)
+                bins = mag_bins[magInt]
+            except:
+                pass
+        record[self.mag] = mag
+        record[self.mag_int] = magInt
+        for position, mag_bin in zip(self.mag_bins, bins):
+            record[position] = mag_bin
+
+        if self.date_time is not None:
+            record[self.date_time] = ''
+
+        # convert string lat/lon
+        # to floating-point values
+        latitude = float(record[self.latitude])
+        longitude = float(record[self.longitude])
+
+        record[self.latitude] = get_float_value(record[self.latitude], null_value)
+        record[self.longitude] = get_float_value(record[self.longitude], null_value)
+
+        return latitude, longitude
+
+    def set_result(self, record, result):
+        record[self.cc] = result['cc']
+        record[self.admin1] = result['admin1']
+        record[self.admin2] = result['admin2']
+        record[self.name] = result['name']
+
+    def get_dict(self, record):
+        return dict(zip(self.fieldnames, record))
+
+
+def time_transform(run_transform, repeat):
+    # the best of several timings
+    best_seconds = None
+    for _ in range(max(repeat, 1)):
+        bgn_time = perf_counter()
+        run_transform()
+        seconds = perf_counter() - bgn_time
+        best_seconds = seconds if best_seconds is None else min(best_seconds, seconds)
+    return best_seconds
+
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+
+# ========================================================================
+#
+# Copyright © 2016 Khepry Quixote
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ========================================================================
+
+import json
+import queue
+import threading
+
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic
+from urllib.parse import parse_qs, urlparse
+
+from .cache import result_keys
+from .geocoder import empty_result
+
+
+class LookupBatcher(object):
+    """
+    Gathers the lookups of concurrent callers into single geocoder
+    searches: a lookup waits at most batch_wait_seconds for others to join
+    it, up to max_batch_coordinates in all, and one thread searches the
+    whole batch with a single K-D tree query, handing each caller its
+    slice of the results.  That one thread is the geocoder's (and its
+    cache's) only user, so neither has to be thread-safe, and it closes
+    the cache before it finishes.
+    """
+
+    def __init__(self, geocoder, max_batch_coordinates=10000, batch_wait_seconds=0.002):
+        self.geocoder = geocoder
+        self.max_batch_coordinates = max(max_batch_coordinates, 1)
+        self.batch_wait_seconds = max(batch_wait_seconds, 0.0)
+        self.lookups = queue.Queue()
+
+        self.lock = threading.Lock()
+        self.lookup_count = 0
+        self.batch_count = 0
+        self.coordinate_count = 0
+        self.max_batch_size = 0
+        self.search_seconds = 0.0
+
+        self.thread = threading.Thread(target=self.run, name='LookupBatcher', daemon=True)
+        self.thread.start()
+
+    def lookup(self, coordinates_list, timeout=None):
+        # the (cc, admin1, admin2, name)
+        # of each (latitude, longitude)
+        if len(coordinates_list) == 0:
+            return []
+        future = Future()
+        self.lookups.put((coordinates_list, future))
+        return future.result(timeout)
+
+    def get_batch(self):
+        # the next lookup, plus those arriving
+        # within the wait that still fit the batch
+        lookup = self.lookups.get()
+        if lookup is None:
+            return None
+        batch = [lookup]
+        batch_size = len(lookup[0])
+        deadline = monotonic() + self.batch_wait_seconds
+        while batch_size < self.max_batch_coordinates:
+            wait_seconds = deadline - monotonic()
+            try:
+                lookup = self.lookups.get(timeout=wait_seconds) if wait_seconds > 0 else self.lookups.get_nowait()
+            except queue.Empty:
+                break
+            if lookup is None:
+                # leave the stop for the next batch
+                self.lookups.put(None)
+                break
+            batch.append(lookup)
+            batch_size += len(lookup[0])
+        return batch
+
+    def run(self):
+        try:
+            self.run_batches()
+        finally:
+            # the cache's connection is this thread's
+            self.geocoder.close_cache()
+
+    def run_batches(self):
+        while True:
+            batch = self.get_batch()
+            if batch is None:
+                return
+
+            coordinates_list = [coordinates for lookup_coordinates, future in batch for coordinates in lookup_coordinates]
+            bgn_time = monotonic()
+            try:
+                results = self.geocoder.search(coordinates_list)
+                if results is None:
+                    results = [empty_result] * len(coordinates_list)
+                results = [{result_key: result[result_key] for result_key in result_keys} for result in results]
+            except Exception as e:
+                for lookup_coordinates, future in batch:
+                    future.set_exception(e)
+                continue
+            seconds = monotonic() - bgn_time
+
+            with self.lock:
+                self.lookup_count += len(batch)
+                self.batch_count += 1
+                self.coordinate_count += len(coordinates_list)
+                self.max_batch_size = max(self.max_batch_size, len(coordinates_list))
+                self.search_seconds += seconds
+
+            offset = 0
+            for lookup_coordinates, future in batch:
+                future.set_result(results[offset:offset + len(lookup_coordinates)])
+                offset += len(lookup_coordinates)
+
+    def get_stats(self):
+        with self.lock:
+            return {'lookups': self.lookup_count,
+                    'batches': self.batch_count,
+                    'coordinates': self.coordinate_count,
+                    'mean_batch_size': round(self.coordinate_count / self.batch_count, 1) if self.batch_count > 0 else 0,
+                    'max_batch_size': self.max_batch_size,
+                    'search_seconds': round(self.search_seconds, 3),
+                    'queued_lookups': self.lookups.qsize()}
+
+    def close(self):
+        self.lookups.put(None)
+        self.thread.join()
+
+
+def get_coordinates(value):
+    # a [latitude, longitude] pair or a
+    # {"lat": ..., "lon": ...} object, checked
+    if isinstance(value, dict):
+        value = (value.get('lat', value.get('latitude')), value.get('lon', value.get('longitude')))
+    if not isinstance(value, (list, tuple)) or len(value) != 2:
+        raise ValueError('Not a [latitude, longitude] pair: %s' % json.dumps(value))
+    latitude, longitude = float(value[0]), float(value[1])
+    if not -90.0 <= latitude <= 90.0 or not -180.0 <= longitude <= 180.0:
+        raise ValueError('Coordinates out of range: %s' % json.dumps(value))
+    return latitude, longitude
+
+
+class GeocodeRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET /reverse?lat=..&lon=.. looks up a single coordinate, POST /reverse
+    with a JSON list of [latitude, longitude] pairs (or of {"lat", "lon"}
+    objects) looks up a batch, answering a list of results in the same
+    order, and GET /stats reports the batching so far.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    # the headers and body are separate writes
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def send_json(self, status, value):
+        body = json.dumps(value).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_lookup(self, coordinates_list, single=False):
+        # the geocoder's failure is the server's error
+        try:
+            results = self.server.batcher.lookup(coordinates_list)
+        except Exception as e:
+            self.send_json(500, {'error': 'Lookup failed: %s' % e})
+            return
+        self.send_json(200, results[0] if single else results)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/stats':
+            self.send_json(200, self.server.batcher.get_stats())
+        elif url.path == '/reverse':
+            query = {key: values[0] for key, values in parse_qs(url.query).items()}
+            try:
+                coordinates = get_coordinates((query.get('lat'), query.get('lon')))
+            except (TypeError, ValueError) as e:
+                self.send_json(400, {'error': str(e)})
+                return
+            self.send_lookup([coordinates], single=True)
+        else:
+            self.send_json(404, {'error': 'Not found: %s' % url.path})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if url.path != '/reverse':
+            self.send_json(404, {'error': 'Not found: %s' % url.path})
+            return
+        try:
+            values = json.loads(body.decode('utf-8'))
+            if isinstance(values, dict):
+                values = [values]
+            if not isinstance(values, list):
+                raise ValueError('Not a list of coordinates')
+            coordinates_list = [get_coordinates(value) for value in values]
+        except (TypeError, ValueError) as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        if len(coordinates_list) > self.server.max_request_coordinates:
+            self.send_json(413, {'error': 'More than %d coordinates' % self.server.max_request_coordinates})
+            return
+        self.send_lookup(coordinates_list)
+
+
+class GeocodeServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server answering reverse-geocoding lookups from a warm
+    geocoder, the lookups of concurrent requests batched together.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, server_address, geocoder, max_batch_coordinates=10000, batch_wait_seconds=0.002,
+                 max_request_coordinates=100000, verbose=False):
+        self.batcher = LookupBatcher(geocoder, max_batch_coordinates, batch_wait_seconds)
+        self.max_request_coordinates = max_request_coordinates
+        self.verbose = verbose
+        ThreadingHTTPServer.__init__(self, server_address, GeocodeRequestHandler)
+
+    def server_close(self):
+        ThreadingHTTPServer.server_close(self)
+        self.batcher.close()
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+
+# ========================================================================
+#
+# Copyright © 2016 Khepry Quixote
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ========================================================================
+
+import csv
+import io
+import json
+import random
+import threading
+
+from datetime import datetime, timedelta
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+from urllib.parse import parse_qs, urlparse
+from xml.sax.saxutils import escape, quoteattr
+
+from .formats import comcat_fieldnames, format_choices, format_number, parse_epoch_ms, quakeml_namespaces
+from .windows import max_rows_per_query
+
+# the columns the query parameters filter on
+time_index = comcat_fieldnames.index('time')
+latitude_index = comcat_fieldnames.index('latitude')
+longitude_index = comcat_fieldnames.index('longitude')
+depth_index = comcat_fieldnames.index('depth')
+mag_index = comcat_fieldnames.index('mag')
+updated_index = comcat_fieldnames.index('updated')
+
+
+def parse_fdsn_time(value):
+    # 2019-01-01, 2019-01-01T12:00:00 or 2019-01-01T12:00:00.000Z
+    value = value.rstrip('Z')
+    return datetime.fromisoformat(value if len(value) > 10 else value[:10] + 'T00:00:00')
+
+
+def format_fdsn_bound(value):
+    # in the events' own fixed-width format,
+    # so bounds compare as strings
+    return value.strftime('%Y-%m-%dT%H:%M:%S.') + '%03dZ' % (value.microsecond // 1000)
+
+
+def get_json_number(value, number_type=float):
+    return number_type(value) if value != '' else None
+
+
+def get_geojson_feature(event):
+    # the event as the service's GeoJSON has it
+    row = dict(zip(comcat_fieldnames, event))
+    return {'type': 'Feature',
+            'properties': {'mag': get_json_number(row['mag']),
+                           'place': row['place'],
+                           'time': parse_epoch_ms(row['time']),
+                           'updated': parse_epoch_ms(row['updated']),
+                           'tz': None,
+                           'status': row['status'],
+                           'tsunami': 0,
+                           'sig': int(max(float(row['mag'] or 0.0), 0.0) ** 2 * 20),
+                           'net': row['net'],
+                           'code': row['id'][len(row['net']):],
+                           'ids': ',%s,' % row['id'],
+                           'sources': ',%s,' % row['net'],
+                           'types': ',origin,phase-data,',
+                           'nst': get_json_number(row['nst'], int),
+                           'dmin': get_json_number(row['dmin']),
+                           'rms': get_json_number(row['rms']),
+                           'gap': get_json_number(row['gap']),
+                           'magType': row['magType'],
+                           'type': row['type'],
+                           'title': 'M %s - %s' % (row['mag'], row['place'])},
+            'geometry': {'type': 'Point', 'coordinates': [float(row['longitude']), float(row['latitude']), float(row['depth'])]},
+            'id': row['id']}
+
+
+def get_quakeml_value(tag, value, uncertainty=''):
+    if value == '':
+        return ''
+    return '<%s><value>%s</value>%s</%s>' % (tag, escape(value), '<uncertainty>%s</uncertainty>' % uncertainty if uncertainty != '' else '', tag)
+
+
+def get_quakeml_element(tag, value):
+    return '<%s>%s</%s>' % (tag, escape(value), tag) if value != '' else ''
+
+
+def get_km_as_meters(value):
+    return format_number(float(value) * 1000.0) if value != '' else ''
+
+
+def get_quakeml_event(event):
+    """
+    The event as the service's QuakeML has it.  A reviewed event's
+    automatic origin and magnitude precede its preferred ones, as
+    an event's several contributions do in the real catalog.
+    """
+    row = dict(zip(comcat_fieldnames, event))
+    public_id = 'quakeml:earthquake.usgs.gov/product/%s' % row['id']
+    origins = []
+    magnitudes = []
+    for suffix, evaluation_mode, offset in (('a', 'automatic', 0.05), ('', 'manual', 0.0)):
+        if suffix != '' and row['status'] == 'automatic':
+            continue
+        if suffix == '' and row['status'] == 'automatic':
+            evaluation_mode = 'automatic'
+        origins.append('<origin catalog:datasource=%s publicID=%s>%s%s%s%s%s%s%s</origin>' % (
+            quoteattr(row['locationSource']),
+            quoteattr('%s/origin%s' % (public_id, suffix)),
+            '<originUncertainty><horizontalUncertainty>%s</horizontalUncertainty></originUncertainty>' % get_km_as_meters(row['horizontalError'])
+            if row['horizontalError'] != '' else '',
+            get_quakeml_value('time', row['time']),
+            get_quakeml_value('longitude', format_number(float(row['longitude']) + offset) if offset != 0.0 else row['longitude']),
+            get_quakeml_value('latitude', format_number(float(row['latitude']) + offset) if offset != 0.0 else row['latitude']),
+            get_quakeml_value('depth', get_km_as_meters(row['depth']), get_km_as_meters(row['depthError'])),
+            '<quality>%s%s%s%s</quality>' % (get_quakeml_element('usedStationCount', row['nst']),
+                                             get_quakeml_element('standardError', row['rms']),
+                                             get_quakeml_element('azimuthalGap', row['gap']),
+                                             get_quakeml_element('minimumDistance', row['dmin'])),
+            get_quakeml_element('evaluationMode', evaluation_mode)))
+        magnitudes.append('<magnitude catalog:datasource=%s publicID=%s>%s%s%s</magnitude>' % (
+            quoteattr(row['magSource']),
+            quoteattr('%s/magnitude%s' % (public_id, suffix)),
+            get_quakeml_value('mag', format_number(float(row['mag']) - offset) if offset != 0.0 and row['mag'] != '' else row['mag'], row['magError']),
+            get_quakeml_element('type', row['magType']),
+            get_quakeml_element('stationCount', row['magNst'])))
+    return ('<event catalog:datasource=%s catalog:eventsource=%s catalog:eventid=%s publicID=%s>'
+            '<description><type>earthquake name</type><text>%s</text></description>%s%s'
+            '<preferredOriginID>%s</preferredOriginID><preferredMagnitudeID>%s</preferredMagnitudeID>%s'
+            '<creationInfo><agencyID>%s</agencyID><creationTime>%s</creationTime></creationInfo></event>\n') % (
+        quoteattr(row['net']), quoteattr(row['net']), quoteattr(row['id'][len(row['net']):]), quoteattr(public_id),
+        escape(row['place']), ''.join(origins), ''.join(magnitudes),
+        escape(public_id + '/origin'), escape(public_id + '/magnitude'), get_quakeml_element('type', row['type']),
+        escape(row['net']), escape(row['updated']))
+
+
+def format_events(events, format_parm):
+    """
+    The events as a response body in the format requested, and its
+    content type, mimicking the service's csv, geojson, quakeml (or
+    xml) and text formats.
+    """
+    if format_parm == 'geojson':
+        body = {'type': 'FeatureCollection',
+                'metadata': {'generated': parse_epoch_ms(format_fdsn_bound(datetime.utcnow())), 'url': 'stub', 'title': 'USGS Earthquakes',
+                             'status': 200, 'api': '1.10.3', 'count': len(events)},
+                'features': [get_geojson_feature(event) for event in events]}
+        return json.dumps(body), 'application/json'
+    if format_parm in ('quakeml', 'xml'):
+        return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<q:quakeml xmlns="%s" xmlns:catalog="%s" xmlns:q="http://quakeml.org/xmlns/quakeml/1.2">\n'
+                '<eventParameters publicID="quakeml:earthquake.usgs.gov/fdsnws/event/1/query">\n%s'
+                '<creationInfo><creationTime>%s</creationTime></creationInfo></eventParameters></q:quakeml>\n') % (
+            quakeml_namespaces['q'], quakeml_namespaces['catalog'], ''.join(get_quakeml_event(event) for event in events),
+            format_fdsn_bound(datetime.utcnow())), 'application/xml'
+    if format_parm == 'text':
+        lines = ['#EventID|Time|Latitude|Longitude|Depth/km|Author|Catalog|Contributor|ContributorID|MagType|Magnitude|MagAuthor|EventLocationName|EventType\n']
+        for event in events:
+            row = dict(zip(comcat_fieldnames, event))
+            lines.append('|'.join((row['id'], row['time'].rstrip('Z'), row['latitude'], row['longitude'], row['depth'], row['locationSource'],
+                                   row['net'], row['net'], row['id'], row['magType'], row['mag'], row['magSource'], row['place'],
+                                   row['type'])) + '\n')
+        return ''.join(lines), 'text/plain'
+    out_file = io.StringIO()
+    csv_writer = csv.writer(out_file, lineterminator='\n')
+    csv_writer.writerow(comcat_fieldnames)
+    csv_writer.writerows(events)
+    return out_file.getvalue(), 'text/csv'
+
+
+class StubFdsnRequestHandler(BaseHTTPRequestHandler):
+    """
+    Answers the FDSN event web service's count and query methods from a
+    synthetic catalog: starttime and endtime (both inclusive), updatedafter,
+    minmagnitude, maxmagnitude, mindepth and maxdepth are honoured, and a
+    query matching more than the search limit is refused with the same
+    400 response the real service gives.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def send_text(self, status, text, content_type='text/plain'):
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if status == 503:
+            self.send_header('Retry-After', '1')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def get_events(self, query):
+        bgn_time = parse_fdsn_time(query['starttime'])
+        end_time = parse_fdsn_time(query['endtime']) if 'endtime' in query else datetime.utcnow()
+        bgn_bound, end_bound = format_fdsn_bound(bgn_time), format_fdsn_bound(end_time)
+        updated_bound = format_fdsn_bound(parse_fdsn_time(query['updatedafter'])) if 'updatedafter' in query else None
+        min_mag = float(query['minmagnitude']) if 'minmagnitude' in query else None
+        max_mag = float(query['maxmagnitude']) if 'maxmagnitude' in query else None
+        min_depth = float(query.get('mindepth', -100))
+        max_depth = float(query.get('maxdepth', 1000))
+        # (the service's bounding box includes its edges)
+        min_lat = float(query.get('minlatitude', -90))
+        max_lat = float(query.get('maxlatitude', 90))
+        min_lon = float(query.get('minlongitude', -180))
+        max_lon = float(query.get('maxlongitude', 180))
+        bbox_filtered = (min_lat, max_lat, min_lon, max_lon) != (-90, 90, -180, 180)
+
+        # newest first, as the real service orders them
+        events = []
+        day = end_time.replace(hour=0, minute=0, second=0, microsecond=0)
+        while day >= bgn_time.replace(hour=0, minute=0, second=0, microsecond=0):
+            for event in self.server.get_day_events(day):
+                if not bgn_bound <= event[time_index] <= end_bound:
+                    continue
+                if updated_bound is not None and event[updated_index] <= updated_bound:
+                    continue
+                if min_mag is not None or max_mag is not None:
+                    if event[mag_index] == '':
+                        continue
+                    mag = float(event[mag_index])
+                    if (min_mag is not None and mag < min_mag) or (max_mag is not None and mag > max_mag):
+                        continue
+                if not min_depth <= float(event[depth_index]) <= max_depth:
+                    continue
+                if bbox_filtered:
+                    if not min_lat <= float(event[latitude_index]) <= max_lat:
+                        continue
+                    if not min_lon <= float(event[longitude_index]) <= max_lon:
+                        continue
+                events.append(event)
+            day -= timedelta(days=1)
+        return events
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        method = url.path.rstrip('/').rsplit('/', 1)[-1]
+
+        if self.server.latency_seconds > 0:
+            sleep(self.server.latency_seconds)
+
+        if method not in ('count', 'query'):
+            self.send_text(404, 'Error 404: Not Found\n')
+            return
+        if self.server.get_error():
+            self.send_text(503, 'Error 503: Service Unavailable\n')
+            return
+        if query.get('format', 'csv') not in format_choices and method == 'query':
+            self.send_text(400, 'Error 400: Bad Request\n\nThe stub only serves format=%s.\n' % ', '.join(format_choices))
+            return
+        try:
+            events = self.get_events(query)
+        except (KeyError, ValueError) as e:
+            self.send_text(400, 'Error 400: Bad Request\n\nBad parameter: %s\n' % e)
+            return
+
+        if method == 'count':
+            self.send_text(200, '%d\n' % len(events))
+        elif len(events) > self.server.search_limit:
+            self.send_text(400, 'Error 400: Bad Request\n\n%d matching events exceeds search limit of %d. '
+                                'Modify the search to match fewer events.\n' % (len(events), self.server.search_limit))
+        else:
+            body, content_type = format_events(events, query.get('format', 'csv'))
+            self.server.add_rows(len(events))
+            self.send_text(200, body, content_type)
+
+
+class StubFdsnServer(ThreadingHTTPServer):
+    """
+    Threaded stand-in for the FDSN event web service, serving a synthetic
+    catalog with a configurable search limit, response latency and rate of
+    503 Service Unavailable errors, so the fetchers can be exercised and
+    benchmarked without going near earthquake.usgs.gov.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, server_address, catalog, search_limit=max_rows_per_query, latency_seconds=0.0, error_rate=0.0,
+                 seed=0, verbose=False):
+        self.catalog = catalog
+        self.search_limit = search_limit
+        self.latency_seconds = latency_seconds
+        self.error_rate = error_rate
+        self.verbose = verbose
+        self.get_day_events = lru_cache(maxsize=4096)(catalog.get_day_events)
+
+        self.lock = threading.Lock()
+        self.error_random = random.Random(seed)
+        self.request_count = 0
+        self.error_count = 0
+        self.row_count = 0
+        ThreadingHTTPServer.__init__(self, server_address, StubFdsnRequestHandler)
+
+    def get_error(self):
+        # whether to fail this request
+        with self.lock:
+            self.request_count += 1
+            error = self.error_random.random() < self.error_rate
+            if error:
+                self.error_count += 1
+        return error
+
+    def add_rows(self, row_count):
+        with self.lock:
+            self.row_count += row_count
+
+    def get_message(self):
+        with self.lock:
+            return 'Stub FDSN server: {:,} requests, {:,} errors injected, {:,} rows served'.format(
+                self.request_count, self.error_count, self.row_count)
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+
+# ========================================================================
+#
+# Copyright © 2016 Khepry Quixote
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ========================================================================
+
+import csv
+import io
+import json
+import math
+import multiprocessing
+import random
+
+from datetime import timedelta
+from itertools import accumulate
+
+from .formats import comcat_fieldnames
+
+# seismically active areas the synthetic events cluster
+# around: latitude, longitude, spread in degrees, relative
+# weight, network and the place the events are located from
+default_clusters = (
+    (36.1, -97.5, 0.6, 12.0, 'ok', 'Guthrie, Oklahoma'),
+    (35.7, -117.5, 0.4, 10.0, 'ci', 'Ridgecrest, CA'),
+    (37.8, -122.2, 0.5, 6.0, 'nc', 'Berkeley, CA'),
+    (38.8, -122.8, 0.1, 6.0, 'nc', 'The Geysers, CA'),
+    (61.2, -150.0, 1.5, 12.0, 'ak', 'Anchorage, Alaska'),
+    (19.4, -155.3, 0.3, 8.0, 'hv', 'Volcano, Hawaii'),
+    (44.6, -110.7, 0.3, 4.0, 'uu', 'West Yellowstone, Montana'),
+    (18.0, -66.8, 0.5, 4.0, 'pr', 'Guanica, Puerto Rico'),
+    (38.3, 142.4, 1.5, 6.0, 'us', 'Ishinomaki, Japan'),
+    (-33.4, -70.6, 1.5, 4.0, 'us', 'Santiago, Chile'),
+    (-6.0, 105.0, 2.0, 4.0, 'us', 'Labuan, Indonesia'),
+    (38.5, 39.0, 1.0, 2.0, 'us', 'Elazig, Turkey'),
+    (42.5, 13.2, 0.5, 2.0, 'us', 'Amatrice, Italy'),
+    (28.0, 84.5, 1.0, 2.0, 'us', 'Gorkha, Nepal'),
+    (17.0, -99.0, 1.5, 3.0, 'us', 'Acapulco, Mexico'),
+)
+
+# events drawn from anywhere, rather than a cluster
+background_ratio = 0.03
+
+compass_points = ('N', 'NNE', 'NE', 'ENE', 'E', 'ESE', 'SE', 'SSE', 'S', 'SSW', 'SW', 'WSW', 'W', 'WNW', 'NW', 'NNW')
+
+
+def format_comcat_time(day_prefix, day_ms):
+    # 2019-12-31T23:59:59.999Z, from the day's
+    # 2019-12-31T prefix and the milliseconds into it
+    seconds, ms = divmod(day_ms, 1000)
+    minutes, seconds = divmod(seconds, 60)
+    return '%s%02d:%02d:%02d.%03dZ' % (day_prefix, minutes // 60, minutes % 60, seconds, ms)
+
+
+class SyntheticCatalog(object):
+    """
+    Deterministic synthetic ANSS ComCat catalog: each day's events are drawn
+    from a generator seeded by the catalog's seed and the day, so any date
+    window holds the same events however it was requested.  Events cluster
+    around seismically active areas, their magnitudes following the
+    Gutenberg-Richter law (b = 1) and a few days being aftershock sequences
+    ten times busier than the rest, as the real catalog's are.
+    """
+
+    def __init__(self, events_per_day=80.0, seed=0, clusters=default_clusters, burst_ratio=0.02):
+        self.events_per_day = max(events_per_day, 0.0)
+        self.seed = seed
+        self.clusters = clusters
+        self.cluster_cum_weights = list(accumulate(cluster[3] for cluster in clusters))
+        self.burst_ratio = burst_ratio
+
+    def get_day_events(self, day):
+        # the day's events as ComCat rows, newest first
+        rng = random.Random('%d:%s' % (self.seed, day.strftime('%Y-%m-%d')))
+        burst = rng.random() < self.burst_ratio
+        event_count = int(rng.uniform(0.5, 1.5) * self.events_per_day * (10 if burst else 1) + 0.5)
+        burst_cluster = rng.choices(self.clusters, cum_weights=self.cluster_cum_weights)[0] if burst else None
+        day_prefix = day.strftime('%Y-%m-%dT')
+        next_day_prefix = (day + timedelta(days=1)).strftime('%Y-%m-%dT')
+        day_key = day.strftime('%Y%m%d')
+
+        events = []
+        for event_number in range(event_count):
+            day_ms = int(rng.random() * 86400000)
+            events.append((day_ms, self.get_event(rng, day_prefix, next_day_prefix, day_key, event_number, day_ms, burst_cluster)))
+        events.sort(key=lambda event: event[0], reverse=True)
+        return [event[1] for event in events]
+
+    def get_event(self, rng, day_prefix, next_day_prefix, day_key, event_number, day_ms, burst_cluster):
+        if burst_cluster is not None and rng.random() < 0.9:
+            cluster = burst_cluster
+        elif rng.random() < background_ratio:
+            cluster = None
+        else:
+            cluster = rng.choices(self.clusters, cum_weights=self.cluster_cum_weights)[0]
+
+        if cluster is None:
+            latitude = math.degrees(math.asin(rng.uniform(-1.0, 1.0)))
+            longitude = rng.uniform(-180.0, 180.0)
+            net, place = 'us', 'Synthetic Ocean'
+        else:
+            latitude = min(max(rng.gauss(cluster[0], cluster[2]), -90.0), 90.0)
+            longitude = (rng.gauss(cluster[1], cluster[2]) + 180.0) % 360.0 - 180.0
+            net, place = cluster[4], '%dkm %s of %s' % (1 + int(rng.random() * 59), rng.choice(compass_points), cluster[5])
+
+        # Gutenberg-Richter, b = 1, above a 0.5 completeness magnitude
+        mag = min(0.5 + rng.expovariate(math.log(10.0)), 9.5)
+        mag_type = 'ml' if mag < 4.0 else ('mb' if mag < 6.0 else 'mww')
+        depth = rng.expovariate(1.0 / 12.0) if mag < 6.0 else rng.uniform(10.0, 70.0)
+        # revised up to a day or so later
+        updated_ms = day_ms + min(int(rng.expovariate(1.0 / 600.0) * 60000), 86399999)
+        if updated_ms < 86400000:
+            updated = format_comcat_time(day_prefix, updated_ms)
+        else:
+            updated = format_comcat_time(next_day_prefix, updated_ms - 86400000)
+        automatic = rng.random() < 0.1
+
+        return [format_comcat_time(day_prefix, day_ms),
+                '%.4f' % latitude,
+                '%.4f' % longitude,
+                '%.2f' % depth,
+                '%.1f' % mag if rng.random() > 0.02 else '',
+                mag_type,
+                str(3 + int(rng.random() * 117)) if rng.random() > 0.3 else '',
+                str(20 + int(rng.random() * 280)) if rng.random() > 0.2 else '',
+                '%.3f' % rng.uniform(0.0, 3.0) if rng.random() > 0.3 else '',
+                '%.2f' % rng.uniform(0.01, 1.5),
+                net,
+                '%s%s%04d' % (net, day_key, event_number),
+                updated,
+                place,
+                'earthquake' if rng.random() > 0.03 else 'quarry blast',
+                '%.2f' % rng.uniform(0.1, 10.0) if rng.random() > 0.3 else '',
+                '%.2f' % rng.uniform(0.1, 5.0) if rng.random() > 0.3 else '',
+                '%.3f' % rng.uniform(0.01, 0.5) if rng.random() > 0.4 else '',
+                str(1 + int(rng.random() * 59)) if rng.random() > 0.4 else '',
+                'automatic' if automatic else 'reviewed',
+                net,
+                net]
+
+    def iter_day_events(self, bgn_date, max_rows=0, workers=1):
+        # each day's events from bgn_date on, until max_rows
+        # (0 means unlimited), drawn by workers processes
+        # a batch of days at a time when more than one
+        pool = multiprocessing.Pool(workers) if workers > 1 else None
+        batch_days = workers * 16 if pool is not None else 1
+        try:
+            day = bgn_date
+            row_count = 0
+            while max_rows <= 0 or row_count < max_rows:
+                days = [day + timedelta(days=day_offset) for day_offset in range(batch_days)]
+                day += timedelta(days=batch_days)
+                days_events = pool.map(self.get_day_events, days) if pool is not None else [self.get_day_events(days[0])]
+                for events_day, events in zip(days, days_events):
+                    if max_rows > 0:
+                        events = events[:max_rows - row_count]
+                    row_count += len(events)
+                    yield events_day, events
+                    if 0 < max_rows <= row_count:
+                        break
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+
+def write_catalog_csv(out_file_path, row_count, bgn_date, catalog, flush_rows=0, workers=1):
+    # a ComCat CSV file of row_count events, streamed
+    # out day by day, each day's newest first
+    out_count = 0
+    with io.open(out_file_path, 'w', encoding='utf-8', newline='') as out_file:
+        csv_writer = csv.writer(out_file, lineterminator='\n')
+        csv_writer.writerow(comcat_fieldnames)
+        for day, events in catalog.iter_day_events(bgn_date, row_count, workers):
+            csv_writer.writerows(events)
+            if flush_rows > 0 and (out_count + len(events)) // flush_rows > out_count // flush_rows:
+                print('Generated: {:,} rows through {}'.format(out_count + len(events), day.strftime('%Y-%m-%d')))
+            out_count += len(events)
+    return out_count
+
+
+def iter_admin_features(cell_degrees=5.0, cell_vertices=32, seed=0, land_ratio=0.7, cells_per_admin1=3, admin1s_per_country=2):
+    """
+    Yields the GeoJSON features of a synthetic world of admin polygons: a
+    grid of cells, each an admin2, grouped into admin1s and those into
+    countries, their borders the jittered lines of a finer lattice shared
+    by neighboring cells, so the polygons tile the land without gaps or
+    overlaps.  Cells left out (1 - land_ratio of them) are the ocean.
+    """
+    import numpy as np
+
+    rng = np.random.RandomState(seed)
+    columns, rows = int(round(360.0 / cell_degrees)), int(round(180.0 / cell_degrees))
+    step = cell_degrees / cell_vertices
+    lattice_columns, lattice_rows = columns * cell_vertices + 1, rows * cell_vertices + 1
+
+    # each lattice point jittered by up to a third of the step,
+    # those along the world's edges kept on them
+    lons = -180.0 + step * np.arange(lattice_columns)[np.newaxis, :] + rng.uniform(-step / 3, step / 3, (lattice_rows, lattice_columns))
+    lats = -90.0 + step * np.arange(lattice_rows)[:, np.newaxis] + rng.uniform(-step / 3, step / 3, (lattice_rows, lattice_columns))
+    lons[:, 0], lons[:, -1] = -180.0, 180.0
+    lats[0, :], lats[-1, :] = -90.0, 90.0
+    land = rng.uniform(size=(rows, columns)) < land_ratio
+
+    for row in range(rows):
+        for column in range(columns):
+            if not land[row, column]:
+                continue
+            # the cell's border, counter-clockwise from its southwest corner
+            r0, c0, n = row * cell_vertices, column * cell_vertices, cell_vertices
+            ring_rows = [r0] * n + list(range(r0, r0 + n)) + [r0 + n] * n + list(range(r0 + n, r0, -1))
+            ring_columns = list(range(c0, c0 + n)) + [c0 + n] * n + list(range(c0 + n, c0, -1)) + [c0] * n
+            ring = [[round(float(lons[r, c]), 6), round(float(lats[r, c]), 6)] for r, c in zip(ring_rows, ring_columns)]
+            ring.append(ring[0])
+            admin1_row, admin1_column = row // cells_per_admin1, column // cells_per_admin1
+            country_row, country_column = admin1_row // admin1s_per_country, admin1_column // admin1s_per_country
+            yield {'type': 'Feature',
+                   'properties': {'cc': 'C%02d%02d' % (country_row, country_column),
+                                  'admin1': 'Admin1 %d-%d' % (admin1_row, admin1_column),
+                                  'admin2': 'Admin2 %d-%d' % (row, column)},
+                   'geometry': {'type': 'Polygon', 'coordinates': [ring]}}
+
+
+def write_admin_geojson(out_file_path, cell_degrees=5.0, cell_vertices=32, seed=0):
+    # a GeoJSON FeatureCollection of synthetic admin
+    # polygons, streamed out a feature per line
+    out_count = 0
+    with io.open(out_file_path, 'w', encoding='utf-8', newline='') as out_file:
+        out_file.write('{"type": "FeatureCollection", "features": [\n')
+        for feature in iter_admin_features(cell_degrees, cell_vertices, seed):
+            out_file.write((',\n' if out_count > 0 else '') + json.dumps(feature, separators=(',', ':')))
+            out_count += 1
+        out_file.write('\n]}\n')
+    return out_count
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+# ========================================================================
+#
+# Copyright © 2016 Khepry Quixote
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ========================================================================
+
+import sys
+
+from datetime import datetime, timedelta
+from monthdelta import monthdelta
+
+# the FDSN event web service's
+# limit on events per query
+max_rows_per_query = 20000
+
+# the whole globe, as a (min latitude, max latitude,
+# min longitude, max longitude) bounding box
+world_bbox = (-90.0, 90.0, -180.0, 180.0)
+
+# the catalog's coordinates have four decimal places,
+# so a tile any smaller can't separate its events
+min_tile_degrees = 0.0001
+
+
+def get_next_smaller_iteration_type(interval):
+    if interval == 'years':
+        interval = 'months'
+    elif interval == 'months':
+        interval = 'weeks'
+    elif interval == 'weeks':
+        interval = 'days'
+    return interval
+
+
+def get_next_end_date(cur_date_parm,
+                      iteration_type_parm):
+    date_time = cur_date_parm
+    next_end_date = None
+    try:
+        if iteration_type_parm == 'days':
+            date_time += timedelta(days=1)
+            next_end_date = date_time
+        elif iteration_type_parm == 'weeks':
+            date_time += timedelta(weeks=1)
+            next_end_date = date_time
+        elif iteration_type_parm == 'months':
+            date_time += monthdelta(months=1)
+            next_end_date = date_time
+        elif iteration_type_parm == 'years':
+            date_time += monthdelta(months=12)
+            next_end_date = date_time
+        else:
+            date_time += timedelta(days=1)
+            next_end_date = (date_time + timedelta(days=1))
+    except Exception as e:
+        sys.stderr.write('Exception: %s' % e)
+
+    return next_end_date
+
+
+def get_next_dates_list(bgn_date_parm,
+                        max_date_parm,
+                        iteration_type,
+                        how_many_iterations):
+    bgn_end_dates_list = []
+    date_time = bgn_date_parm
+    for i in range(0, how_many_iterations):
+        bgn_date_parm = date_time.strftime('%Y-%m-%d')
+        try:
+            if iteration_type == 'days':
+                date_time += timedelta(days=1)
+                end_date = (date_time + timedelta(days=1)).strftime('%Y-%m-%d')
+            elif iteration_type == 'weeks':
+                date_time += timedelta(weeks=1)
+                end_date = date_time.strftime('%Y-%m-%d')
+            elif iteration_type == 'months':
+                date_time += monthdelta(months=1)
+                end_date = date_time.strftime('%Y-%m-%d')
+            elif iteration_type == 'years':
+                date_time += monthdelta(months=12)
+                end_date = date_time.strftime('%Y-%m-%d')
+            else:
+                date_time += timedelta(days=1)
+                end_date = (date_time + timedelta(days=1)).strftime('%Y-%m-%d')
+            if datetime.strptime(end_date, '%Y-%m-%d') < max_date_parm:
+                bgn_end_dates_list.append((bgn_date_parm, end_date))
+            else:
+                bgn_end_dates_list.append((bgn_date_parm, max_date_parm.strftime('%Y-%m-%d')))
+                break
+        except Exception as e:
+            sys.stderr.write('Exception: %s' % e)
+    return bgn_end_dates_list
+
+
+def get_window_end_date(cur_date_parm,
+                        iteration_type_parm):
+    # the window ends the day before
+    # the next window would begin
+    return get_next_end_date(cur_date_parm, iteration_type_parm) - timedelta(days=1)
+
+
+def get_service_url(service_url_parm,
+                    method_parm,
+                    format_parm,
+                    min_depth_parm,
+                    max_depth_parm,
+                    min_magnitude_parm=None,
+                    max_magnitude_parm=None):
+    base_url = service_url_parm if service_url_parm.endswith('/') else service_url_parm + '/'
+    base_url += 'count?' if method_parm == 'count' else 'query?'
+    base_url += 'format=%s&' % format_parm if format_parm is not None else ''
+    # (fractional magnitudes and depths sent as they are)
+    base_url += 'mindepth=%g' % min_depth_parm
+    base_url += '&maxdepth=%g' % max_depth_parm
+    base_url += '&minmagnitude=%g' % min_magnitude_parm if min_magnitude_parm is not None else ''
+    base_url += '&maxmagnitude=%g' % max_magnitude_parm if max_magnitude_parm is not None else ''
+    return base_url
+
+
+def split_window(bgn_date_parm,
+                 end_date_parm):
+    # split a window's days into two halves
+    days = (end_date_parm - bgn_date_parm).days + 1
+    if days < 2:
+        return [(bgn_date_parm, end_date_parm)]
+    mid_date = bgn_date_parm + timedelta(days=days // 2)
+    return [(bgn_date_parm, mid_date - timedelta(days=1)), (mid_date, end_date_parm)]
+
+
+def split_bbox(bbox_parm):
+    # split a bounding box into its four quadrants,
+    # south-west, south-east, north-west and north-east
+    # (halving keeps the edges exact binary fractions)
+    min_lat, max_lat, min_lon, max_lon = bbox_parm
+    mid_lat = (min_lat + max_lat) / 2.0
+    mid_lon = (min_lon + max_lon) / 2.0
+    return [(min_lat, mid_lat, min_lon, mid_lon), (min_lat, mid_lat, mid_lon, max_lon),
+            (mid_lat, max_lat, min_lon, mid_lon), (mid_lat, max_lat, mid_lon, max_lon)]
+
+
+def split_tile(bbox_parm):
+    # split a window's tile (the whole globe when it
+    # isn't tiled yet) into its quadrants, as long as
+    # they can still separate the catalog's events
+    bbox = world_bbox if bbox_parm is None else bbox_parm
+    if bbox[1] - bbox[0] < min_tile_degrees * 2:
+        raise RuntimeError('Too many events in too small a tile to split any further: %r' % (bbox,))
+    return split_bbox(bbox)
+
+
+def get_bbox_tiles(bbox_parm,
+                   levels):
+    # a bounding box's quadtree tiles,
+    # four for each level, in order
+    tiles = [bbox_parm]
+    for level in range(levels):
+        tiles = [sub_bbox for bbox in tiles for sub_bbox in split_bbox(bbox)]
+    return tiles
+
+
+def is_in_tile(latitude,
+               longitude,
+               bbox_parm):
+    # the service's bounding boxes include all four edges,
+    # so an event on the edge between two tiles is returned
+    # for both: a tile keeps its south and west edges, and
+    # its north and east edges only at the pole and the
+    # antimeridian, each event belonging to just one tile
+    min_lat, max_lat, min_lon, max_lon = bbox_parm
+    if not (min_lat <= latitude < max_lat or latitude == max_lat == world_bbox[1]):
+        return False
+    return min_lon <= longitude < max_lon or longitude == max_lon == world_bbox[3]
+
+
+def get_window_url(base_url_parm,
+                   bgn_date_parm,
+                   end_date_parm,
+                   bbox_parm=None):
+    # the window's days whole, the service's end time being
+    # inclusive and a bare date its midnight (the event times
+    # have millisecond precision)
+    url = '%s&starttime=%s&endtime=%sT23:59:59.999' % (base_url_parm, bgn_date_parm.strftime('%Y-%m-%d'), end_date_parm.strftime('%Y-%m-%d'))
+    if bbox_parm is not None:
+        # (repr round-trips the edges exactly)
+        url += '&minlatitude=%r&maxlatitude=%r&minlongitude=%r&maxlongitude=%r' % bbox_parm
+    return url
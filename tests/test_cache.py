@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+# ========================================================================
+#
+# Copyright © 2016 Khepry Quixote
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ========================================================================
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from pyquake.admin import AdminIndex, admin_keys
+from pyquake.cache import GeoCodeCache
+
+
+def write_admin_file(file_path, cc):
+    # a single polygon around the origin
+    ring = [[-1.0, -1.0], [1.0, -1.0], [1.0, 1.0], [-1.0, 1.0], [-1.0, -1.0]]
+    feature = {'type': 'Feature', 'properties': {'cc': cc, 'admin1': 'A1', 'admin2': 'A2'},
+               'geometry': {'type': 'Polygon', 'coordinates': [ring]}}
+    with open(file_path, 'w') as admin_file:
+        json.dump({'type': 'FeatureCollection', 'features': [feature]}, admin_file)
+
+
+class GeoCodeCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp(prefix='test_cache_')
+        self.db_file_path = os.path.join(self.tmp_path, 'geocodes.db')
+        self.admin_file_path = os.path.join(self.tmp_path, 'admin.geojson')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+    def search_admin(self, coordinates_list):
+        # a cache over the admin file's polygons,
+        # returning the results and the disk hits
+        admin_index = AdminIndex.from_file(self.admin_file_path)
+        geocode_cache = GeoCodeCache(db_file_path=self.db_file_path, db_table_name='admin_geocodes', db_source=admin_index.source)
+
+        def search_function(coordinates):
+            return [dict(zip(admin_keys, admin_values), name='') for admin_values in admin_index.query(coordinates)]
+
+        results = geocode_cache.search(coordinates_list, search_function)
+        geocode_cache.close()
+        return [result['cc'] for result in results], geocode_cache.db_hits
+
+    def test_reuses_same_source(self):
+        write_admin_file(self.admin_file_path, 'AA')
+        self.assertEqual(self.search_admin([(0.5, 0.5), (5.0, 5.0)]), (['AA', ''], 0))
+        self.assertEqual(self.search_admin([(0.5, 0.5), (5.0, 5.0)]), (['AA', ''], 2))
+
+    def test_clears_changed_source(self):
+        write_admin_file(self.admin_file_path, 'AA')
+        self.assertEqual(self.search_admin([(0.5, 0.5)]), (['AA'], 0))
+        # rewritten, with a later modification time
+        write_admin_file(self.admin_file_path, 'BBB')
+        file_stat = os.stat(self.admin_file_path)
+        os.utime(self.admin_file_path, ns=(file_stat.st_atime_ns, file_stat.st_mtime_ns + 10 ** 9))
+        self.assertEqual(self.search_admin([(0.5, 0.5)]), (['BBB'], 0))
+        self.assertEqual(self.search_admin([(0.5, 0.5)]), (['BBB'], 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
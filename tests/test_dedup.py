@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+
+# ========================================================================
+#
+# Copyright © 2016 Khepry Quixote
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ========================================================================
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from datetime import datetime, timedelta
+
+from pyquake.dedup import EventIndex
+from pyquake.fetcher import WindowJournal, write_window
+
+header_line = b'time,id,updated,mag'
+
+
+def get_lines(*events):
+    # a window's CSV lines, the header line first,
+    # of (id, updated) events, updated being a day
+    return [header_line] + [('2019-01-01T00:00:00.000Z,%s,2019-01-%02dT00:00:00.000Z,2.5' % (event_id, updated)).encode('utf-8')
+                            for event_id, updated in events]
+
+
+def get_events(tgt_file_name):
+    # the (id, updated) events of the target file's rows
+    with io.open(tgt_file_name, 'rb') as tgt_file:
+        lines = tgt_file.read().decode('utf-8').splitlines()
+    assert lines[0] == header_line.decode('utf-8')
+    return [(line.split(',')[1], int(line.split(',')[2][8:10])) for line in lines[1:]]
+
+
+class FailingLines(object):
+    """
+    A window's lines, the connection failing after some of them.
+    """
+
+    def __init__(self, lines, fail_after):
+        self.lines = lines
+        self.fail_after = fail_after
+
+    def __iter__(self):
+        for line_number, line in enumerate(self.lines):
+            if line_number == self.fail_after:
+                raise ConnectionError('connection reset')
+            yield line
+
+
+class EventIndexTest(unittest.TestCase):
+    """
+    The deduplication of the windows fetched into a target file, each
+    written and checkpointed as CatalogFetcher.fetch_catalog does.
+    """
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp(prefix='test_dedup_')
+        self.tgt_file_name = os.path.join(self.tmp_path, 'catalog.csv')
+        self.window_bgn_date = datetime(2019, 1, 1)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+    def open_catalog(self, resume=False, batch_rows=2):
+        # the target file, its journal and its index, resumed
+        # from the journal's intact entries or started afresh
+        journal = WindowJournal(self.tgt_file_name)
+        entries = journal.load() if resume else []
+        tgt_file = io.open(self.tgt_file_name, 'r+b' if len(entries) > 0 else 'wb')
+        if len(entries) > 0:
+            tgt_file.truncate(entries[-1]['offset'])
+            tgt_file.seek(0, io.SEEK_END)
+        journal.open(entries)
+        event_index = EventIndex(self.tgt_file_name + '.ids', batch_rows=batch_rows)
+        event_index.open(self.tgt_file_name, tgt_file.tell())
+        return tgt_file, journal, event_index
+
+    def write_window(self, tgt_file, journal, event_index, lines):
+        # the window's new lines written and checkpointed, or
+        # the index rolled back if it isn't written whole
+        first_pass = tgt_file.tell() == 0
+        try:
+            first_pass, byte_count, sha1_digest, row_count = write_window(tgt_file, event_index.iter_new_lines(lines), first_pass)
+        except Exception:
+            event_index.rollback()
+            raise
+        journal.record(tgt_file, self.window_bgn_date, self.window_bgn_date, 'days', byte_count, sha1_digest, row_count)
+        self.window_bgn_date += timedelta(days=1)
+        return event_index.commit(tgt_file.tell())
+
+    def close_catalog(self, tgt_file, journal, event_index):
+        # compacted as fetch_catalog leaves it
+        journal.close()
+        tgt_file.close()
+        if event_index.superseded_count > 0:
+            journal.open(event_index.compact(self.tgt_file_name, journal.entries))
+            journal.close()
+        event_index.close()
+
+    def test_drops_older_and_same_versions(self):
+        tgt_file, journal, event_index = self.open_catalog()
+        self.assertEqual(self.write_window(tgt_file, journal, event_index, get_lines(('a', 2), ('b', 1))), (0, 0))
+        # (the same version twice within a window too)
+        self.assertEqual(self.write_window(tgt_file, journal, event_index, get_lines(('a', 1), ('b', 1), ('c', 1), ('c', 1))), (3, 0))
+        self.close_catalog(tgt_file, journal, event_index)
+        self.assertEqual(get_events(self.tgt_file_name), [('a', 2), ('b', 1), ('c', 1)])
+        self.assertEqual((event_index.dropped_count, event_index.removed_count), (3, 0))
+        self.assertEqual([entry['rows'] for entry in journal.entries], [2, 1])
+
+    def test_newer_version_supersedes(self):
+        tgt_file, journal, event_index = self.open_catalog()
+        self.write_window(tgt_file, journal, event_index, get_lines(('a', 1), ('b', 1), ('c', 1)))
+        # within the window as well as across windows
+        self.assertEqual(self.write_window(tgt_file, journal, event_index, get_lines(('d', 1), ('a', 2), ('d', 3), ('e', 1))), (0, 2))
+        self.write_window(tgt_file, journal, event_index, get_lines(('c', 2), ('f', 1)))
+        self.close_catalog(tgt_file, journal, event_index)
+        self.assertEqual(get_events(self.tgt_file_name), [('b', 1), ('a', 2), ('d', 3), ('e', 1), ('c', 2), ('f', 1)])
+        self.assertEqual(event_index.removed_count, 3)
+
+        # the compacted file's journal entries are intact,
+        # their rows, offsets and SHA-1s rewritten to match
+        entries = WindowJournal(self.tgt_file_name).load()
+        self.assertEqual([entry['rows'] for entry in entries], [1, 3, 2])
+        self.assertEqual(entries[-1]['offset'], os.path.getsize(self.tgt_file_name))
+        for entry, next_entry in zip(entries, entries[1:]):
+            self.assertEqual(entry['offset'], next_entry['bgn_offset'])
+
+    def test_resumes_after_compaction(self):
+        tgt_file, journal, event_index = self.open_catalog()
+        self.write_window(tgt_file, journal, event_index, get_lines(('a', 1), ('b', 1)))
+        self.write_window(tgt_file, journal, event_index, get_lines(('a', 2), ('c', 1)))
+        self.close_catalog(tgt_file, journal, event_index)
+
+        # resumed after both windows, the compacted
+        # file's index being reused rather than rebuilt
+        tgt_file, journal, event_index = self.open_catalog(resume=True)
+        self.assertEqual(len(journal.entries), 2)
+        self.assertEqual(tgt_file.tell(), os.path.getsize(self.tgt_file_name))
+        self.assertEqual((event_index.row_count, event_index.superseded_count), (3, 0))
+        self.assertEqual(self.write_window(tgt_file, journal, event_index, get_lines(('a', 2), ('b', 3), ('d', 1))), (1, 1))
+        self.close_catalog(tgt_file, journal, event_index)
+        self.assertEqual(get_events(self.tgt_file_name), [('a', 2), ('c', 1), ('b', 3), ('d', 1)])
+        self.assertEqual(len(WindowJournal(self.tgt_file_name).load()), 3)
+
+    def test_rebuilds_from_file(self):
+        tgt_file, journal, event_index = self.open_catalog()
+        self.write_window(tgt_file, journal, event_index, get_lines(('a', 1), ('b', 2)))
+        self.write_window(tgt_file, journal, event_index, get_lines(('c', 1)))
+        journal.close()
+        tgt_file.close()
+        event_index.close()
+
+        # without the index, it's rebuilt from the file's rows,
+        # as is an index committed at another offset
+        os.remove(self.tgt_file_name + '.ids')
+        tgt_file, journal, event_index = self.open_catalog(resume=True)
+        self.assertEqual(event_index.row_count, 3)
+        self.assertEqual(self.write_window(tgt_file, journal, event_index, get_lines(('a', 1), ('b', 3), ('c', 1))), (2, 1))
+        self.close_catalog(tgt_file, journal, event_index)
+        self.assertEqual(get_events(self.tgt_file_name), [('a', 1), ('c', 1), ('b', 3)])
+
+    def test_rebuilds_duplicates_in_file(self):
+        # a file fetched without deduplicating, its
+        # older versions superseded whatever their order
+        with io.open(self.tgt_file_name, 'wb') as tgt_file:
+            write_window(tgt_file, get_lines(('a', 1), ('b', 2), ('a', 2), ('b', 1), ('c', 1), ('c', 1)), True)
+            offset = tgt_file.tell()
+        event_index = EventIndex(self.tgt_file_name + '.ids', batch_rows=2)
+        event_index.open(self.tgt_file_name, offset)
+        self.assertEqual((event_index.row_count, event_index.superseded_count), (6, 3))
+        event_index.compact(self.tgt_file_name, [])
+        event_index.close()
+        self.assertEqual(get_events(self.tgt_file_name), [('b', 2), ('a', 2), ('c', 1)])
+
+    def test_rollback(self):
+        tgt_file, journal, event_index = self.open_catalog()
+        self.write_window(tgt_file, journal, event_index, get_lines(('a', 1)))
+        offset = tgt_file.tell()
+
+        # a window failing after a batch of its rows was indexed
+        lines = get_lines(('b', 1), ('c', 1), ('a', 2), ('d', 1))
+        with self.assertRaises(ConnectionError):
+            self.write_window(tgt_file, journal, event_index, FailingLines(lines, 4))
+        self.assertEqual(tgt_file.tell(), offset)
+        self.assertEqual((event_index.row_count, event_index.window_superseded_count), (1, 0))
+
+        # refetched whole, its rows aren't taken for duplicates
+        self.assertEqual(self.write_window(tgt_file, journal, event_index, lines), (0, 1))
+        self.close_catalog(tgt_file, journal, event_index)
+        self.assertEqual(get_events(self.tgt_file_name), [('b', 1), ('c', 1), ('a', 2), ('d', 1)])
+        self.assertEqual(len(WindowJournal(self.tgt_file_name).load()), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
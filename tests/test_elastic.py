@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+
+# ========================================================================
+#
+# Copyright © 2016 Khepry Quixote
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ========================================================================
+
+import fnmatch
+import json
+import threading
+import unittest
+
+from pyquake.elastic import BulkIndexer, finish_load_index
+
+
+class MockBulkClient(object):
+    """
+    Stand-in for the ElasticSearch client's bulk method, recording each
+    request's document ids and answering each document with the status
+    the statuses function gives it (200 unless told otherwise), or
+    failing the first failed_requests requests outright.
+    """
+
+    def __init__(self, statuses=None, failed_requests=0):
+        self.statuses = statuses or (lambda doc_id, attempt: 200)
+        self.failed_requests = failed_requests
+        self.requests = []
+        self.attempts = {}
+        self.lock = threading.Lock()
+
+    def bulk(self, body):
+        with self.lock:
+            if self.failed_requests > 0:
+                self.failed_requests -= 1
+                raise ConnectionError('connection refused')
+            lines = body.decode('utf-8').splitlines()
+            doc_ids = [json.loads(line)['index']['_id'] for line in lines[::2]]
+            self.requests.append(doc_ids)
+            items = []
+            for doc_id in doc_ids:
+                attempt = self.attempts.get(doc_id, 0)
+                self.attempts[doc_id] = attempt + 1
+                items.append({'index': {'_id': doc_id, 'status': self.statuses(doc_id, attempt)}})
+            return {'errors': any(item['index']['status'] >= 300 for item in items), 'items': items}
+
+
+class MockIndicesClient(object):
+    """
+    Stand-in for the ElasticSearch client's indices methods used in
+    swapping an alias, holding each index's aliases.
+    """
+
+    def __init__(self, index_aliases):
+        self.index_aliases = index_aliases
+
+    def put_settings(self, index, body):
+        pass
+
+    def refresh(self, index):
+        pass
+
+    def exists(self, index):
+        return index in self.index_aliases
+
+    def exists_alias(self, name):
+        return any(name in aliases for aliases in self.index_aliases.values())
+
+    def get_alias(self, index='*', name='*'):
+        return {index_name: {'aliases': {alias: {} for alias in aliases if fnmatch.fnmatch(alias, name)}}
+                for index_name, aliases in self.index_aliases.items()
+                if fnmatch.fnmatch(index_name, index) and (name == '*' or name in aliases)}
+
+    def update_aliases(self, body):
+        for action in body['actions']:
+            for action_name, params in action.items():
+                if action_name == 'add':
+                    self.index_aliases[params['index']].add(params['alias'])
+                elif action_name == 'remove':
+                    self.index_aliases[params['index']].discard(params['alias'])
+
+    def delete(self, index, ignore=None):
+        del self.index_aliases[index]
+
+
+class MockClient(object):
+
+    def __init__(self, index_aliases):
+        self.indices = MockIndicesClient(index_aliases)
+
+
+class BulkIndexerTest(unittest.TestCase):
+
+    def index_docs(self, es, doc_count, **indexer_args):
+        indexer_args.setdefault('backoff_seconds', 0.0)
+        indexer = BulkIndexer(es, 'quakes-test', **indexer_args)
+        for doc_id in range(doc_count):
+            indexer.add(doc_id, {'id': doc_id, 'place': 'somewhere'})
+        indexer.close()
+        return indexer
+
+    def test_batches_by_docs(self):
+        es = MockBulkClient()
+        indexer = self.index_docs(es, 10, chunk_docs=3, threads=2)
+        self.assertEqual(sorted(len(doc_ids) for doc_ids in es.requests), [1, 3, 3, 3])
+        self.assertEqual(sorted(doc_id for doc_ids in es.requests for doc_id in doc_ids), list(range(10)))
+        self.assertEqual((indexer.docs, indexer.indexed_docs, indexer.batches), (10, 10, 4))
+        self.assertEqual((indexer.retried_docs, indexer.failed_docs), (0, 0))
+
+    def test_batches_by_bytes(self):
+        # room for two documents' actions a request
+        es = MockBulkClient()
+        doc_bytes = len(self.index_docs(es, 0, threads=1).get_action(0, {'id': 0, 'place': 'somewhere'}))
+        indexer = self.index_docs(es, 5, chunk_docs=100, chunk_bytes=doc_bytes * 2 + 1, threads=1)
+        self.assertEqual(es.requests, [[0, 1], [2, 3], [4]])
+        self.assertEqual(indexer.indexed_docs, 5)
+
+    def test_retries_too_many_requests(self):
+        # odd documents rejected twice, then indexed
+        es = MockBulkClient(statuses=lambda doc_id, attempt: 429 if doc_id % 2 == 1 and attempt < 2 else 201)
+        indexer = self.index_docs(es, 10, chunk_docs=5, threads=1, max_retries=3)
+        self.assertEqual(es.requests[:3], [[0, 1, 2, 3, 4], [1, 3], [1, 3]])
+        self.assertEqual(indexer.indexed_docs, 10)
+        self.assertEqual(indexer.retried_docs, 10)
+        self.assertEqual(indexer.failed_docs, 0)
+        self.assertEqual(indexer.batches, 6)
+
+    def test_counts_failed_docs(self):
+        # a mapping error isn't retried, and
+        # rejections outlasting the retries fail
+        es = MockBulkClient(statuses=lambda doc_id, attempt: {3: 400, 7: 429}.get(doc_id, 201))
+        indexer = self.index_docs(es, 10, chunk_docs=10, threads=1, max_retries=2)
+        self.assertEqual(es.attempts[3], 1)
+        self.assertEqual(es.attempts[7], 3)
+        self.assertEqual(indexer.indexed_docs, 8)
+        self.assertEqual(indexer.retried_docs, 2)
+        self.assertEqual(indexer.failed_docs, 2)
+        self.assertIn('8 of 10 docs', indexer.get_message())
+        self.assertIn('2 failed', indexer.get_message())
+
+    def test_retries_failed_requests(self):
+        es = MockBulkClient(failed_requests=2)
+        indexer = self.index_docs(es, 4, chunk_docs=4, threads=1, max_retries=2)
+        self.assertEqual(es.requests, [[0, 1, 2, 3]])
+        self.assertEqual(indexer.indexed_docs, 4)
+
+        # requests failing past the retries fail the indexing
+        es = MockBulkClient(failed_requests=3)
+        with self.assertRaises(RuntimeError):
+            self.index_docs(es, 4, chunk_docs=4, threads=1, max_retries=2)
+        self.assertEqual(es.requests, [])
+
+
+class FinishLoadIndexTest(unittest.TestCase):
+
+    def test_deletes_stale_load_indices(self):
+        # a failed load's index is deleted with the
+        # alias's previous one, other indices are kept
+        index_aliases = {'quakes-20190101000000000000': {'quakes'},
+                         'quakes-20190102000000000000': set(),
+                         'quakes-20190103000000000000': set(),
+                         'quakes-archive-20190101000000000000': set(),
+                         'quakes-archive': set()}
+        es = MockClient(index_aliases)
+        old_index_names = finish_load_index(es, 'quakes-20190103000000000000', 'quakes')
+        self.assertEqual(old_index_names, ['quakes-20190101000000000000'])
+        self.assertEqual(index_aliases, {'quakes-20190103000000000000': {'quakes'},
+                                         'quakes-archive-20190101000000000000': set(),
+                                         'quakes-archive': set()})
+
+    def test_keeps_old_indices(self):
+        index_aliases = {'quakes-20190101000000000000': {'quakes'},
+                         'quakes-20190102000000000000': set(),
+                         'quakes-20190103000000000000': set()}
+        es = MockClient(index_aliases)
+        finish_load_index(es, 'quakes-20190103000000000000', 'quakes', keep_old_indices=True)
+        self.assertEqual(sorted(index_aliases), ['quakes-20190101000000000000', 'quakes-20190102000000000000', 'quakes-20190103000000000000'])
+        self.assertEqual(index_aliases['quakes-20190103000000000000'], {'quakes'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+
+# ========================================================================
+#
+# Copyright © 2016 Khepry Quixote
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ========================================================================
+
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+from datetime import datetime, timedelta
+from time import sleep
+
+from pyquake.fetcher import merge_catalog_delta
+from pyquake.stub_fdsn import StubFdsnServer
+from pyquake.synthetic import SyntheticCatalog
+
+repo_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# a run that hasn't finished by
+# then is taken to be stuck retrying
+run_timeout_seconds = 120
+
+
+class CatalogFetcherTest(unittest.TestCase):
+    """
+    QuakeRequester.py's serial and concurrent fetches against the stub FDSN
+    event web service, served from a thread of the test process.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = StubFdsnServer(('127.0.0.1', 0), SyntheticCatalog(events_per_day=100.0, seed=0))
+        cls.server_thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.server_thread.start()
+        cls.base_url = 'http://127.0.0.1:%d/fdsnws/event/1/' % cls.server.server_address[1]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.search_limit = 20000
+        self.server.error_rate = 0.0
+        self.server.latency_seconds = 0.0
+        self.tgt_path = tempfile.mkdtemp(prefix='test_fetcher_')
+
+    def tearDown(self):
+        shutil.rmtree(self.tgt_path, ignore_errors=True)
+
+    def get_command(self, tgt_file_basename, *requester_args):
+        return [sys.executable, os.path.join(repo_path, 'QuakeRequester.py'),
+                   '--base_url', self.base_url,
+                   '--bgn_date', '2019-01-01',
+                   '--end_date', '2019-03-31',
+                   '--iteration_type', 'months',
+                   '--sleep_seconds', '0',
+                   '--requests_per_second', '0',
+                   '--backoff_seconds', '0.01',
+                   '--tgt_path', self.tgt_path,
+                   '--tgt_file_basename', tgt_file_basename] + list(requester_args)
+
+    def run_requester(self, tgt_file_basename, *requester_args):
+        # QuakeRequester.py's exit code and output,
+        # and the target file's lines, if any
+        command = self.get_command(tgt_file_basename, *requester_args)
+        process = subprocess.run(command, cwd=self.tgt_path, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                 universal_newlines=True, timeout=run_timeout_seconds)
+        tgt_file_name = os.path.join(self.tgt_path, tgt_file_basename + '.csv')
+        lines = None
+        if os.path.exists(tgt_file_name):
+            with io.open(tgt_file_name, 'r', encoding='utf-8', newline='') as tgt_file:
+                lines = tgt_file.readlines()
+        return process.returncode, process.stdout, lines
+
+    def test_concurrent_matches_serial(self):
+        returncode, output, serial_lines = self.run_requester('serial')
+        self.assertEqual(returncode, 0, output)
+        returncode, output, concurrent_lines = self.run_requester('concurrent', '--concurrency', '4')
+        self.assertEqual(returncode, 0, output)
+        # (written in chronological order, however they arrive)
+        self.assertGreater(len(serial_lines), 1)
+        self.assertEqual(serial_lines, concurrent_lines)
+
+    def test_search_limit_steps_down(self):
+        returncode, output, whole_lines = self.run_requester('whole')
+        self.assertEqual(returncode, 0, output)
+
+        # months of some 3,000 events stepping down to
+        # weeks, and days of some 100 events to tiles
+        for search_limit, first_url in ((1000, '&starttime=2019-01-01&endtime=2019-01-07T23:59:59.999:'),
+                                        (60, '&starttime=2019-01-01&endtime=2019-01-01T23:59:59.999&minlatitude=')):
+            self.server.search_limit = search_limit
+            for concurrency in ('1', '4'):
+                tgt_file_basename = 'limit_%d_%s' % (search_limit, concurrency)
+                returncode, output, lines = self.run_requester(tgt_file_basename, '--concurrency', concurrency)
+                self.assertEqual(returncode, 0, output)
+                self.assertIn(first_url, output, tgt_file_basename)
+                self.assertEqual(lines[0], whole_lines[0])
+                self.assertEqual(sorted(lines[1:]), sorted(whole_lines[1:]), tgt_file_basename)
+
+    def test_min_magnitude(self):
+        # a fractional magnitude floor isn't truncated
+        returncode, output, lines = self.run_requester('min_magnitude', '--min_magnitude', '2.5')
+        self.assertEqual(returncode, 0, output)
+        self.assertIn('&minmagnitude=2.5&', output)
+        mag_index = lines[0].rstrip('\r\n').split(',').index('mag')
+        mags = [float(line.split(',')[mag_index]) for line in lines[1:]]
+        self.assertGreater(len(mags), 0)
+        self.assertGreaterEqual(min(mags), 2.5)
+
+    def test_sync_empty_catalog(self):
+        # a catalog without events, or without even a header,
+        # is fetched whole rather than updated after nothing
+        bgn_date = (datetime.utcnow() - timedelta(days=2)).strftime('%Y-%m-%d')
+        returncode, output, whole_lines = self.run_requester('whole', '--bgn_date', bgn_date,
+                                                             '--end_date', datetime.utcnow().strftime('%Y-%m-%d'))
+        self.assertEqual(returncode, 0, output)
+        for tgt_file_basename, content in (('header', whole_lines[0]), ('empty', '')):
+            with io.open(os.path.join(self.tgt_path, tgt_file_basename + '.csv'), 'w', encoding='utf-8', newline='') as tgt_file:
+                tgt_file.write(content)
+            returncode, output, lines = self.run_requester(tgt_file_basename, '--sync', 'Y', '--bgn_date', bgn_date)
+            self.assertEqual(returncode, 0, output)
+            self.assertIn('fetching it whole', output)
+            self.assertNotIn('updatedafter', output)
+            self.assertEqual(lines, whole_lines)
+
+    def test_resume(self):
+        returncode, output, whole_lines = self.run_requester('whole', '--iteration_type', 'days', '--end_date', '2019-01-20')
+        self.assertEqual(returncode, 0, output)
+
+        # killed some windows in
+        self.server.latency_seconds = 0.05
+        tgt_file_name = os.path.join(self.tgt_path, 'resumed.csv')
+        journal_file_name = tgt_file_name + '.journal'
+        process = subprocess.Popen(self.get_command('resumed', '--iteration_type', 'days', '--end_date', '2019-01-20'),
+                                   cwd=self.tgt_path, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            for _ in range(run_timeout_seconds * 10):
+                if os.path.exists(journal_file_name):
+                    with io.open(journal_file_name, 'r') as journal_file:
+                        if len(journal_file.readlines()) >= 6:
+                            break
+                sleep(0.1)
+        finally:
+            process.kill()
+            process.wait()
+        self.server.latency_seconds = 0.0
+        with io.open(journal_file_name, 'r') as journal_file:
+            entries = [json.loads(line) for line in journal_file if line.endswith('\n')]
+        self.assertLess(len(entries), 20)
+
+        # the last journaled window's bytes damaged, and
+        # a window left half written after it
+        with io.open(tgt_file_name, 'r+b') as tgt_file:
+            tgt_file.seek(entries[-1]['offset'] - 2)
+            tgt_file.write(b'X')
+            tgt_file.seek(0, io.SEEK_END)
+            tgt_file.write(b'2019-01-99T00:00:00.000Z,12.3')
+
+        # resumed from the window before the damaged one,
+        # neither refetching the windows before it, nor
+        # keeping the damaged and half written windows
+        returncode, output, lines = self.run_requester('resumed', '--iteration_type', 'days', '--end_date', '2019-01-20', '--tgt_file_append', 'Y')
+        self.assertEqual(returncode, 0, output)
+        resumed_date = datetime.strptime(entries[-2]['end_date'], '%Y-%m-%d') + timedelta(days=1)
+        self.assertIn('Resuming at %s after %d checkpointed windows' % (resumed_date.strftime('%Y-%m-%d'), len(entries) - 1), output)
+        self.assertNotIn('&starttime=2019-01-01&', output)
+        self.assertEqual(lines, whole_lines)
+
+    def test_errors_give_up(self):
+        # every request failing, the window is
+        # given up after --max_retries failures
+        self.server.error_rate = 1.0
+        for concurrency in ('1', '2'):
+            returncode, output, lines = self.run_requester('errors_%s' % concurrency, '--concurrency', concurrency, '--max_retries', '1')
+            self.assertNotEqual(returncode, 0, output)
+            self.assertIn('Giving up on a window after 2 failures', output)
+
+
+class MergeCatalogDeltaTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tgt_path = tempfile.mkdtemp(prefix='test_merge_')
+
+    def tearDown(self):
+        shutil.rmtree(self.tgt_path, ignore_errors=True)
+
+    def write_file(self, file_name, lines):
+        file_path = os.path.join(self.tgt_path, file_name)
+        with io.open(file_path, 'w', encoding='utf-8', newline='') as csv_file:
+            csv_file.writelines(line + '\n' for line in lines)
+        return file_path
+
+    def test_merge(self):
+        # revised events replaced in place, unchanged
+        # ones kept and new ones appended in order
+        header = 'time,id,updated,place'
+        tgt_file_path = self.write_file('catalog.csv', [header,
+                                                         '2019-01-01T00:00:00.000Z,a,2019-01-01T01:00:00.000Z,"Somewhere, CA"',
+                                                         '2019-01-02T00:00:00.000Z,b,2019-01-02T01:00:00.000Z,Elsewhere',
+                                                         '2019-01-03T00:00:00.000Z,c,2019-01-03T01:00:00.000Z,Nowhere'])
+        delta_file_path = self.write_file('catalog.csv.delta', [header,
+                                                                '2019-01-04T00:00:00.000Z,d,2019-01-04T01:00:00.000Z,Anywhere',
+                                                                '2019-01-02T00:00:00.000Z,b,2019-01-05T01:00:00.000Z,"Elsewhere, NV"',
+                                                                '2019-01-05T00:00:00.000Z,e,2019-01-05T01:00:00.000Z,Everywhere'])
+        self.assertEqual(merge_catalog_delta(tgt_file_path, delta_file_path), (1, 2))
+        with io.open(tgt_file_path, 'r', encoding='utf-8', newline='') as tgt_file:
+            self.assertEqual(tgt_file.read().splitlines(), [header,
+                                                            '2019-01-01T00:00:00.000Z,a,2019-01-01T01:00:00.000Z,"Somewhere, CA"',
+                                                            '2019-01-02T00:00:00.000Z,b,2019-01-05T01:00:00.000Z,"Elsewhere, NV"',
+                                                            '2019-01-03T00:00:00.000Z,c,2019-01-03T01:00:00.000Z,Nowhere',
+                                                            '2019-01-04T00:00:00.000Z,d,2019-01-04T01:00:00.000Z,Anywhere',
+                                                            '2019-01-05T00:00:00.000Z,e,2019-01-05T01:00:00.000Z,Everywhere'])
+        self.assertFalse(os.path.exists(tgt_file_path + '.merged'))
+
+    def test_empty_delta(self):
+        header = 'time,id,updated,place'
+        lines = [header, '2019-01-01T00:00:00.000Z,a,2019-01-01T01:00:00.000Z,Somewhere']
+        tgt_file_path = self.write_file('catalog.csv', lines)
+        for delta_lines in ([header], []):
+            delta_file_path = self.write_file('catalog.csv.delta', delta_lines)
+            self.assertEqual(merge_catalog_delta(tgt_file_path, delta_file_path), (0, 0))
+            with io.open(tgt_file_path, 'r', encoding='utf-8', newline='') as tgt_file:
+                self.assertEqual(tgt_file.read().splitlines(), lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+# ========================================================================
+#
+# Copyright © 2016 Khepry Quixote
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ========================================================================
+
+import csv
+import io
+import json
+import threading
+import unittest
+
+from urllib.request import urlopen
+
+from pyquake.formats import comcat_fieldnames, iter_format_rows, iter_geojson_rows, iter_json_array, iter_quakeml_rows, iter_text_rows
+from pyquake.stub_fdsn import StubFdsnServer
+from pyquake.synthetic import SyntheticCatalog
+
+# the columns each format carries
+geojson_fieldnames = ['time', 'latitude', 'longitude', 'depth', 'mag', 'magType', 'nst', 'gap', 'dmin', 'rms', 'net', 'id', 'updated',
+                      'place', 'type', 'status']
+text_fieldnames = ['time', 'latitude', 'longitude', 'depth', 'mag', 'magType', 'net', 'id', 'place', 'type', 'locationSource', 'magSource']
+
+# the columns compared as numbers rather than
+# as text, the formats writing them differently
+numeric_fieldnames = ['latitude', 'longitude', 'depth', 'mag', 'nst', 'gap', 'dmin', 'rms', 'horizontalError', 'depthError', 'magError',
+                      'magNst']
+
+
+class StreamingFormatTest(unittest.TestCase):
+    """
+    Each format's rows, parsed as they're streamed, against the CSV rows
+    of the same window, all served by the stub FDSN event web service.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = StubFdsnServer(('127.0.0.1', 0), SyntheticCatalog(events_per_day=100.0, seed=0))
+        cls.server_thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.server_thread.start()
+        cls.query_url = 'http://127.0.0.1:%d/fdsnws/event/1/query?starttime=2019-01-01&endtime=2019-01-02T23:59:59.999' % cls.server.server_address[1]
+        cls.csv_rows = list(csv.reader(io.StringIO(cls.get_body('csv').decode('utf-8'))))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    @classmethod
+    def get_body(cls, format_parm):
+        with urlopen(cls.query_url + '&format=' + format_parm, timeout=60) as response:
+            return response.read()
+
+    def assertRowsMatch(self, rows, fieldnames):
+        # the rows' columns of fieldnames as the CSV rows have them
+        self.assertEqual(self.csv_rows[0], comcat_fieldnames)
+        self.assertGreater(len(self.csv_rows), 100)
+        self.assertEqual(len(rows), len(self.csv_rows) - 1)
+        for row, csv_row in zip(rows, self.csv_rows[1:]):
+            self.assertEqual(len(row), len(comcat_fieldnames))
+            for fieldname in fieldnames:
+                value, csv_value = row[comcat_fieldnames.index(fieldname)], csv_row[comcat_fieldnames.index(fieldname)]
+                if fieldname in numeric_fieldnames and value != '' and csv_value != '':
+                    self.assertAlmostEqual(float(value), float(csv_value), places=6, msg=(fieldname, value, csv_value))
+                else:
+                    self.assertEqual(value, csv_value, fieldname)
+
+    def test_geojson(self):
+        body = self.get_body('geojson')
+        expected_rows = list(iter_geojson_rows(io.BytesIO(body)))
+        self.assertRowsMatch(expected_rows, geojson_fieldnames)
+        # each feature split across chunks, down to a byte
+        # at a time, is parsed just as it is read whole
+        for chunk_size in (1, 7, 100, 1000):
+            self.assertEqual(list(iter_geojson_rows(io.BytesIO(body), chunk_size)), expected_rows, chunk_size)
+
+    def test_json_array(self):
+        # multi-byte characters and an escaped quote split across
+        # chunks, and the key itself spanning two of them
+        items = [{'place': 'Ñuñoa, Chile', 'id': 1}, [1, 2.5, None], {'place': 'a "quoted" name'}, {}]
+        body = json.dumps({'type': 'FeatureCollection', 'metadata': {'title': 'x' * 100}, 'features': items}, ensure_ascii=False).encode('utf-8')
+        for chunk_size in (1, 2, 3, 5, 64, 1024):
+            self.assertEqual(list(iter_json_array(io.BytesIO(body), 'features', chunk_size)), items, chunk_size)
+        self.assertEqual(list(iter_json_array(io.BytesIO(b'{"features": []}'), 'features', 1)), [])
+        self.assertEqual(list(iter_json_array(io.BytesIO(b'{"metadata": {}}'), 'features', 1)), [])
+        with self.assertRaises(ValueError):
+            list(iter_json_array(io.BytesIO(b'{"features": [{"id": 1}, {"id": '), 'features', 4))
+
+    def test_quakeml(self):
+        # the preferred origins and magnitudes, not the automatic ones
+        # preceding them, and the depths and uncertainties in meters
+        # converted back to kilometers
+        body = self.get_body('quakeml')
+        self.assertIn(b'/origina"', body)
+        rows = list(iter_quakeml_rows(io.BytesIO(body)))
+        self.assertRowsMatch(rows, comcat_fieldnames)
+        depth_index = comcat_fieldnames.index('depth')
+        self.assertTrue(any(float(row[depth_index]) != int(float(row[depth_index])) for row in rows))
+        self.assertEqual(list(iter_quakeml_rows(io.BytesIO(self.get_body('xml')))), rows)
+
+    def test_text(self):
+        body = self.get_body('text')
+        rows = list(iter_text_rows(io.BytesIO(body)))
+        self.assertRowsMatch(rows, text_fieldnames)
+        self.assertEqual(list(iter_format_rows(io.BytesIO(body), 'text')), [comcat_fieldnames] + rows)
+        # without its header line, the columns can't be located
+        with self.assertRaises(ValueError):
+            list(iter_text_rows(io.BytesIO(body.split(b'\n', 1)[1])))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+# ========================================================================
+#
+# Copyright © 2016 Khepry Quixote
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ========================================================================
+
+import csv
+import io
+import math
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+from pyquake.stub_fdsn import StubFdsnServer
+from pyquake.synthetic import SyntheticCatalog
+
+repo_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+run_timeout_seconds = 300
+
+
+class QuakePipelineTest(unittest.TestCase):
+    """
+    QuakePipeline.py against the stub FDSN event web service, served from
+    a thread of the test process.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = StubFdsnServer(('127.0.0.1', 0), SyntheticCatalog(events_per_day=100.0, seed=0))
+        cls.server_thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.server_thread.start()
+        cls.base_url = 'http://127.0.0.1:%d/fdsnws/event/1/' % cls.server.server_address[1]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp(prefix='test_pipeline_')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+    def get_command(self, out_file_path, *pipeline_args):
+        return [sys.executable, os.path.join(repo_path, 'QuakePipeline.py'),
+                   '--base-url', self.base_url,
+                   '--bgn-date', '2019-01-01',
+                   '--end-date', '2019-01-05',
+                   '--iteration-type', 'days',
+                   '--requests-per-second', '0',
+                   '--out-file-path', out_file_path] + list(pipeline_args)
+
+    def run_pipeline(self, out_file_basename, *pipeline_args):
+        # QuakePipeline.py's exit code and
+        # output, and the target file's lines
+        out_file_path = os.path.join(self.tmp_path, out_file_basename + '.csv')
+        command = self.get_command(out_file_path, *pipeline_args)
+        process = subprocess.run(command, cwd=self.tmp_path, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                 universal_newlines=True, timeout=run_timeout_seconds)
+        lines = None
+        if os.path.exists(out_file_path):
+            with io.open(out_file_path, 'r', encoding='utf-8', newline='') as out_file:
+                lines = out_file.readlines()
+        return process.returncode, process.stdout, lines
+
+    def test_disk_cache(self):
+        # the geocode stage's thread owns the cache's connection,
+        # and flushes the geocodes still to be committed (the
+        # 500-odd events falling short of a commit's 1,000)
+        cache_file_path = os.path.join(self.tmp_path, 'geocodes.db')
+        cache_args = ('--geocode-cache', 'Y', '--geocode-cache-file-path', cache_file_path)
+        returncode, output, uncached_lines = self.run_pipeline('uncached')
+        self.assertEqual(returncode, 0, output)
+        returncode, output, lines = self.run_pipeline('cached', *cache_args)
+        self.assertEqual(returncode, 0, output)
+        self.assertNotIn('Traceback', output)
+        self.assertGreater(len(uncached_lines), 1)
+        self.assertEqual(len(lines), len(uncached_lines))
+
+        with sqlite3.connect(cache_file_path) as db_conn:
+            db_count = db_conn.execute('SELECT COUNT(*) FROM geocodes').fetchone()[0]
+        self.assertEqual(db_count, len(lines) - 1)
+
+        # rerun from the disk tier
+        returncode, output, cached_lines = self.run_pipeline('recached', *cache_args)
+        self.assertEqual(returncode, 0, output)
+        self.assertIn('0 memory hits, {:,} disk hits, 0 misses'.format(db_count), output)
+        self.assertEqual(lines, cached_lines)
+
+    def test_parquet(self):
+        # the Parquet file's typed values read back as the CSV
+        # file's, its DTGs to the second (the milliseconds
+        # of Parquet's coarsest timestamp unit being zero)
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        from pyquake.parquet import timestamp_type
+
+        returncode, output, lines = self.run_pipeline('catalog')
+        self.assertEqual(returncode, 0, output)
+        returncode, output, parquet_lines = self.run_pipeline('typed', '--out-format', 'parquet')
+        self.assertEqual(returncode, 0, output)
+        self.assertIsNone(parquet_lines)
+        table = pq.read_table(os.path.join(self.tmp_path, 'typed.parquet'))
+        for fieldname in ('Event_DTG', 'Updated_DTG'):
+            self.assertEqual(table.schema.field(fieldname).type, pa.timestamp('ms', tz='UTC'))
+            self.assertEqual(table.column(fieldname).cast(timestamp_type).type, timestamp_type)
+
+        csv_rows = list(csv.reader(lines))
+        self.assertEqual(table.column_names, csv_rows[0])
+        self.assertEqual(table.num_rows, len(csv_rows) - 1)
+        self.assertGreater(table.num_rows, 0)
+        for field, values in zip(table.schema, table.columns):
+            column_position = csv_rows[0].index(field.name)
+            for csv_row, value in zip(csv_rows[1:], values.to_pylist()):
+                csv_value = csv_row[column_position]
+                if value is None:
+                    self.assertEqual(csv_value, '', field.name)
+                elif pa.types.is_timestamp(field.type):
+                    self.assertEqual(value.strftime('%Y-%m-%d %H:%M:%S.%f'), csv_value + '.000000', field.name)
+                elif isinstance(value, float):
+                    self.assertTrue(math.isclose(value, float(csv_value), rel_tol=1e-6), (field.name, value, csv_value))
+                elif isinstance(value, int):
+                    self.assertEqual(value, int(float(csv_value)), field.name)
+                else:
+                    self.assertEqual(value, csv_value, field.name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+# ========================================================================
+#
+# Copyright © 2016 Khepry Quixote
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ========================================================================
+
+import argparse
+import datetime
+import unittest
+
+import numpy as np
+
+from pyquake.formats import comcat_fieldnames
+from pyquake.rows import RowTransform, default_dtg_parse_pattern, get_out_fieldnames, parse_comcat_dtg, parse_comcat_dtgs
+
+last_second = datetime.datetime(2019, 12, 31, 23, 59, 59)
+
+# each value, and the datetime it parses to with
+# the - separator, or None for a value that isn't a DTG
+dtg_cases = [
+    ('2019-12-31T23:59:59.130Z', last_second),
+    ('2019-12-31T23:59:59.1', last_second),
+    ('2019-12-31T23:59:59Z', last_second),
+    ('2019-12-31T23:59:59', last_second),
+    ('2019-12-31 23:59:59.130Z', last_second),
+    ('2019-12-31 23:59:59', last_second),
+    ('2019-12-31T23:59:59.', None),
+    ('2019-12-31T23:59:59.13aZ', None),
+    ('2019-12-31T23:59:59.130ZZ', None),
+    ('2019-12-31T23:59:59+00:00', None),
+    ('2019-12-31T23:59:59 ', None),
+    ('2019-12-31T23:59:5', None),
+    ('2019-12-31X23:59:59', None),
+    ('2019/12/31T23:59:59', None),
+    ('+019-12-31T23:59:59', None),
+    (' 019-12-31T23:59:59', None),
+    ('2019-02-30T00:00:00', None),
+    ('2019-12-31T24:00:00', None),
+    ('', None),
+]
+
+
+def get_args(**values):
+    args = argparse.Namespace(out_db_null_value='', dtg_parse_pattern=default_dtg_parse_pattern,
+                              src_date_ymd_separator='-', out_date_ymd_separator='-')
+    vars(args).update(values)
+    return args
+
+
+class ParseComcatDtgTest(unittest.TestCase):
+
+    def assertBatchAgrees(self, values, ymd_separator):
+        # parsed together, and one by one, as each is parsed alone
+        dtgs = parse_comcat_dtgs(values, ymd_separator)
+        for value, dtg in zip(values, dtgs):
+            for batch_dtg in (dtg, parse_comcat_dtgs([value], ymd_separator)[0]):
+                expected = parse_comcat_dtg(value, ymd_separator)
+                if expected is None:
+                    self.assertTrue(np.isnat(batch_dtg), value)
+                else:
+                    self.assertEqual(batch_dtg, np.datetime64(expected, 's'), value)
+
+    def test_parse(self):
+        for value, expected in dtg_cases:
+            self.assertEqual(parse_comcat_dtg(value), expected, value)
+
+    def test_batch_agrees(self):
+        values = [value for value, expected in dtg_cases]
+        self.assertBatchAgrees(values, '-')
+        # only the well-formed values, parsed in numpy's single pass
+        self.assertBatchAgrees([value for value, expected in dtg_cases if expected is not None], '-')
+
+    def test_ymd_separator(self):
+        self.assertEqual(parse_comcat_dtg('2019/12/31T23:59:59.130Z', '/'), last_second)
+        self.assertEqual(parse_comcat_dtg('2019/12/31 23:59:59', '/'), last_second)
+        self.assertIsNone(parse_comcat_dtg('2019-12-31T23:59:59.130Z', '/'))
+        self.assertIsNone(parse_comcat_dtg('2019/12-31T23:59:59', '/'))
+        self.assertBatchAgrees([value.replace('-', '/', 2) for value, expected in dtg_cases], '/')
+        self.assertBatchAgrees([value for value, expected in dtg_cases], '/')
+
+
+class RowTransformTest(unittest.TestCase):
+
+    def transform(self, event_dtg, updated_dtg, **arg_values):
+        # a ComCat row's output record, or None if it's dropped
+        src_row = [''] * len(comcat_fieldnames)
+        src_values = {'time': event_dtg, 'updated': updated_dtg, 'latitude': '36.1', 'longitude': '-97.5', 'mag': '2.5'}
+        for fieldname, value in src_values.items():
+            src_row[comcat_fieldnames.index(fieldname)] = value
+        fieldnames = get_out_fieldnames(comcat_fieldnames)
+        row_transform = RowTransform(fieldnames, len(comcat_fieldnames), get_args(**arg_values))
+        record = row_transform.get_record(src_row)
+        if row_transform(record) is None:
+            return None
+        return row_transform.get_dict(record)
+
+    def test_keeps_seconds(self):
+        # fractions, other than .000, and bare Zs aren't dropped
+        for event_dtg in ('2019-12-31T23:59:59.130Z', '2019-12-31T23:59:59Z', '2019-12-31 23:59:59'):
+            row = self.transform(event_dtg, '2020-01-02T03:04:05.678Z')
+            self.assertEqual(row['Event_DTG'], '2019-12-31 23:59:59', event_dtg)
+            self.assertEqual(row['Updated_DTG'], '2020-01-02 03:04:05', event_dtg)
+            self.assertEqual([row[fieldname] for fieldname in ('Event_Year', 'Event_Month', 'Event_Day', 'Event_Hour', 'Event_Min', 'Event_Sec')],
+                             [2019, 12, 31, 23, 59, 59])
+
+    def test_drops_malformed(self):
+        self.assertIsNone(self.transform('2019-12-31T23:59:59.13aZ', '2020-01-02T03:04:05Z'))
+        self.assertIsNone(self.transform('', '2020-01-02T03:04:05Z'))
+        # a malformed update is left as it is
+        row = self.transform('2019-12-31T23:59:59Z', 'unknown')
+        self.assertEqual(row['Updated_DTG'], 'unknown')
+
+    def test_ymd_separator(self):
+        row = self.transform('2019/12/31T23:59:59.130Z', '2020/01/02T03:04:05Z', src_date_ymd_separator='/', out_date_ymd_separator='.')
+        self.assertEqual(row['Event_DTG'], '2019.12.31 23:59:59')
+        self.assertEqual(row['Updated_DTG'], '2020.01.02 03:04:05')
+        self.assertEqual(row['Event_Sec'], 59)
+        # a custom pattern parses the reformatted DTG
+        row = self.transform('2019-12-31T23:59:59Z', '2020-01-02T03:04:05Z', out_date_ymd_separator='.', dtg_parse_pattern='%Y.%m.%d %H:%M:%S')
+        self.assertEqual(row['Event_DTG'], '2019.12.31 23:59:59')
+        self.assertEqual(row['Event_Sec'], 59)
+
+
+if __name__ == '__main__':
+    unittest.main()
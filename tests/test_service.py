@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+# ========================================================================
+#
+# Copyright © 2016 Khepry Quixote
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ========================================================================
+
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from http.client import HTTPConnection
+
+from pyquake.cache import GeoCodeCache
+from pyquake.geocoder import Geocoder
+from pyquake.service import GeocodeServer
+
+
+class FailingGeocoder(object):
+    """
+    Stand-in for a geocoder whose searches fail.
+    """
+
+    def search(self, coordinates_list):
+        raise RuntimeError('index unavailable')
+
+    def close_cache(self):
+        pass
+
+
+class GeocodeServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp(prefix='test_service_')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+    def start_server(self, geocoder):
+        server = GeocodeServer(('127.0.0.1', 0), geocoder)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def stop_server(self, server):
+        server.shutdown()
+        server.server_close()
+
+    def request(self, server, method, path, value=None):
+        # the response's status and decoded JSON body
+        connection = HTTPConnection('127.0.0.1', server.server_address[1], timeout=60)
+        body = json.dumps(value) if value is not None else None
+        connection.request(method, path, body=body, headers={'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        status, value = response.status, json.loads(response.read().decode('utf-8'))
+        connection.close()
+        return status, value
+
+    def test_closes_disk_cache(self):
+        # the batcher's thread commits the pending geocodes
+        # (fewer than a commit's) and closes the connection
+        db_file_path = os.path.join(self.tmp_path, 'geocodes.db')
+        geocoder = Geocoder(geocode_cache=GeoCodeCache(db_file_path=db_file_path))
+        server = self.start_server(geocoder)
+        status, results = self.request(server, 'POST', '/reverse', [[36.1, -97.5], [37.78674, -122.39222]])
+        self.assertEqual(status, 200)
+        self.assertEqual([result['cc'] for result in results], ['US', 'US'])
+        status, result = self.request(server, 'GET', '/reverse?lat=35.6895&lon=139.69171')
+        self.assertEqual((status, result['cc']), (200, 'JP'))
+        self.stop_server(server)
+        geocoder.close()
+
+        with sqlite3.connect(db_file_path) as db_conn:
+            self.assertEqual(db_conn.execute('SELECT COUNT(*) FROM geocodes').fetchone()[0], 3)
+
+    def test_search_error(self):
+        # a failed search is answered as the server's
+        # error, rather than by dropping the connection
+        server = self.start_server(FailingGeocoder())
+        status, result = self.request(server, 'GET', '/reverse?lat=36.1&lon=-97.5')
+        self.assertEqual(status, 500)
+        self.assertIn('index unavailable', result['error'])
+        status, result = self.request(server, 'POST', '/reverse', [[36.1, -97.5]])
+        self.assertEqual(status, 500)
+        status, result = self.request(server, 'GET', '/stats')
+        self.assertEqual(status, 200)
+        self.stop_server(server)
+
+
+if __name__ == '__main__':
+    unittest.main()
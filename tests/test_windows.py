@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+# ========================================================================
+#
+# Copyright © 2016 Khepry Quixote
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ========================================================================
+
+import unittest
+
+from pyquake.windows import get_bbox_tiles, is_in_tile, min_tile_degrees, split_bbox, split_tile, world_bbox
+
+
+def get_edge_points(tiles):
+    # every tile's corners and edge midpoints, and its
+    # center, so each shared edge and corner is covered
+    points = set()
+    for min_lat, max_lat, min_lon, max_lon in tiles:
+        for latitude in (min_lat, (min_lat + max_lat) / 2.0, max_lat):
+            for longitude in (min_lon, (min_lon + max_lon) / 2.0, max_lon):
+                points.add((latitude, longitude))
+    return sorted(points)
+
+
+class TileTest(unittest.TestCase):
+
+    def assertPartitions(self, tiles):
+        # each point lands in exactly one tile
+        for latitude, longitude in get_edge_points(tiles):
+            owners = [tile for tile in tiles if is_in_tile(latitude, longitude, tile)]
+            self.assertEqual(len(owners), 1, (latitude, longitude, owners))
+
+    def test_level_tiles(self):
+        for levels in range(4):
+            self.assertPartitions(get_bbox_tiles(world_bbox, levels))
+
+    def test_uneven_tiles(self):
+        # a tile split further than its neighbours, its edges
+        # meeting them part way along theirs, as fetch_catalog
+        # leaves the tiles of a window with a dense region
+        tiles = split_tile(None)
+        for _ in range(3):
+            tiles = tiles[:-1] + split_tile(tiles[-1])
+        tiles = split_tile(tiles[0]) + tiles[1:]
+        self.assertPartitions(tiles)
+
+    def test_poles_and_antimeridian(self):
+        tiles = get_bbox_tiles(world_bbox, 2)
+        for latitude, longitude in ((90.0, 180.0), (-90.0, -180.0), (90.0, -180.0), (-90.0, 180.0), (0.0, 180.0), (90.0, 0.0)):
+            self.assertEqual(len([tile for tile in tiles if is_in_tile(latitude, longitude, tile)]), 1, (latitude, longitude))
+        # an event outside the tile on either side
+        self.assertFalse(is_in_tile(45.0, 0.0, (0.0, 45.0, 0.0, 90.0)))
+        self.assertFalse(is_in_tile(0.0, 90.0, (0.0, 45.0, 0.0, 90.0)))
+        self.assertTrue(is_in_tile(0.0, 0.0, (0.0, 45.0, 0.0, 90.0)))
+
+    def test_min_split(self):
+        self.assertEqual(split_tile(None), split_bbox(world_bbox))
+        # split down to the catalog's coordinate precision,
+        # and no further
+        tile = world_bbox
+        while True:
+            try:
+                sub_tiles = split_tile(tile)
+            except RuntimeError:
+                break
+            for sub_bbox in sub_tiles:
+                self.assertGreaterEqual(sub_bbox[1] - sub_bbox[0], min_tile_degrees)
+            self.assertPartitions(sub_tiles)
+            tile = sub_tiles[-1]
+        self.assertLess(tile[1] - tile[0], min_tile_degrees * 2)
+        self.assertGreaterEqual(tile[1] - tile[0], min_tile_degrees)
+
+
+if __name__ == '__main__':
+    unittest.main()